@@ -0,0 +1,1424 @@
+#!/usr/bin/env python3
+"""
+Benchmarks y pruebas de carga del backend.
+
+No consulta APIs reales: Gemini se sustituye por un modelo falso con latencia
+fija para medir solo el comportamiento del servidor.
+
+Uso:
+    python benchmarks.py                # ejecuta todos los escenarios
+    python benchmarks.py gemini-load    # ejecuta un escenario concreto
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Variables mínimas para que main.py arranque sin claves reales
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-fake-key")
+os.environ.pop("OPENWEATHER_API_KEY", None)
+os.environ.pop("UNSPLASH_API_KEY", None)
+
+FAKE_GEMINI_LATENCY = 0.5  # segundos por llamada simulada a Gemini
+
+# Catálogo con el que responde el modelo falso a las búsquedas de destinos
+FAKE_DESTINATION_CATALOG = [
+    "Barcelona, España", "Bariloche, Argentina", "Bari, Italia", "Barranquilla, Colombia",
+    "Bangkok, Tailandia", "Berlín, Alemania", "Bogotá, Colombia", "Buenos Aires, Argentina",
+    "París, Francia", "Praga, República Checa", "Porto, Portugal", "Punta Cana, República Dominicana",
+    "Tokio, Japón", "Toronto, Canadá", "Toledo, España", "Roma, Italia", "Río de Janeiro, Brasil",
+    "Madrid, España", "Málaga, España", "Medellín, Colombia", "México, México", "Miami, Estados Unidos",
+]
+
+
+class FakeGenerativeModel:
+    """Sustituto de genai.GenerativeModel con latencia fija y respuestas fijas."""
+
+    calls = 0
+
+    def __init__(self, model_name: str, *args, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, prompt: str, *args, stream: bool = False, **kwargs):
+        FakeGenerativeModel.calls += 1
+        if "ISO 3166-1" in prompt:
+            text = "ES"
+        elif "sugerir destinos" in prompt:
+            from destination_search_cache import normalize_query
+            query = normalize_query(prompt.split('query | usuario\n"', 1)[1].split('"', 1)[0])
+            text = "\n".join([d for d in FAKE_DESTINATION_CATALOG if query in normalize_query(d)][:5])
+        elif "resume conversaciones" in prompt:
+            text = "El usuario planea un viaje y ya recibió recomendaciones generales"
+        elif "destinos turísticos populares" in prompt:
+            text = "Barcelona, España\nBariloche, Argentina\nBari, Italia"
+        else:
+            text = json.dumps({"alojamiento": ["Hotel Central"], "comida_local": ["Mercado"],
+                               "lugares_imperdibles": ["Plaza"], "consejos_locales": ["Metro"],
+                               "estimacion_costos": ["100 USD"]}, ensure_ascii=False)
+
+        if stream:
+            return self._stream(text)
+        time.sleep(FAKE_GEMINI_LATENCY)
+        return _FakeResponse(text)
+
+    def _stream(self, text: str, parts: int = 5):
+        """Emite el texto en varios fragmentos repartiendo la latencia total."""
+        size = max(1, len(text) // parts + 1)
+        for i in range(0, len(text), size):
+            time.sleep(FAKE_GEMINI_LATENCY / parts)
+            yield _FakeResponse(text[i:i + size])
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentil por el método del rango más cercano."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+async def asgi_request(app, method: str, path: str, body: Optional[Dict[str, Any]] = None,
+                       headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+    """
+    Ejecuta una petición HTTP directamente contra la app ASGI (sin red).
+
+    Returns:
+        Tupla (status, headers, body)
+    """
+    raw_body = json.dumps(body).encode() if body is not None else b""
+    raw_headers = [(b"content-type", b"application/json")]
+    for key, value in (headers or {}).items():
+        raw_headers.append((key.lower().encode(), value.encode()))
+    path_only, _, query_string = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path_only,
+        "raw_path": path_only.encode(),
+        "query_string": query_string.encode(),
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 12345),
+        "server": ("testserver", 80),
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": raw_body, "more_body": False}
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    status = 0
+    response_headers: Dict[str, str] = {}
+    chunks: List[bytes] = []
+    start = time.perf_counter()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for key, value in message.get("headers", []):
+                response_headers[key.decode()] = value.decode()
+        elif message["type"] == "http.response.body":
+            body_part = message.get("body", b"")
+            if body_part and not chunks:
+                # Tiempo hasta el primer byte del cuerpo (TTFB)
+                response_headers["x-bench-ttfb"] = f"{time.perf_counter() - start:.6f}"
+            chunks.append(body_part)
+
+    await app(scope, receive, send)
+    return status, response_headers, b"".join(chunks)
+
+
+async def bench_gemini_load(concurrency: int = 16) -> None:
+    """
+    Prueba de carga: N búsquedas de destinos concurrentes mientras se sondea /api/health.
+
+    Con llamadas bloqueantes en el event loop la latencia se suma en serie
+    (p99 ≈ N × latencia de Gemini). Con el cliente asíncrono debe quedar en
+    ≈ ceil(N / GEMINI_MAX_CONCURRENCY) × latencia de Gemini.
+    """
+    import google.generativeai as genai
+    genai.GenerativeModel = FakeGenerativeModel
+    import main
+
+    print("=" * 60)
+    print(f"🧪 Carga concurrente sobre Gemini ({concurrency} peticiones, {FAKE_GEMINI_LATENCY}s por llamada)")
+    print("=" * 60)
+
+    latencies: List[float] = []
+    health_latencies: List[float] = []
+
+    async def one_search(i: int) -> None:
+        start = time.perf_counter()
+        status, _, _ = await asgi_request(main.app, "POST", "/api/destinations/search", {"query": f"bar{i}"})
+        latencies.append(time.perf_counter() - start)
+        assert status == 200, status
+
+    async def poll_health(stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asgi_request(main.app, "GET", "/api/health")
+            health_latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.05)
+
+    stop = asyncio.Event()
+    health_task = asyncio.create_task(poll_health(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(one_search(i) for i in range(concurrency)))
+    total = time.perf_counter() - start
+    stop.set()
+    await health_task
+
+    serial_estimate = FakeGenerativeModel.calls * FAKE_GEMINI_LATENCY
+    print(f"📊 Llamadas a Gemini: {FakeGenerativeModel.calls}")
+    print(f"📊 Tiempo total: {total:.2f}s (en serie serían ≈ {serial_estimate:.2f}s)")
+    print(f"📊 Latencia búsqueda p50={percentile(latencies, 50):.3f}s p99={percentile(latencies, 99):.3f}s")
+    print(f"📊 Latencia /api/health p99={percentile(health_latencies, 99) * 1000:.1f}ms "
+          f"({len(health_latencies)} sondeos durante la carga)")
+
+
+async def bench_travel_stream() -> None:
+    """
+    Compara el tiempo hasta el primer byte de /api/travel y /api/travel/stream.
+    """
+    import google.generativeai as genai
+    genai.GenerativeModel = FakeGenerativeModel
+    import main
+
+    print("=" * 60)
+    print(f"🧪 TTFB /api/travel vs /api/travel/stream ({FAKE_GEMINI_LATENCY}s por respuesta)")
+    print("=" * 60)
+
+    body = {"question": "Quiero viajar a Barcelona, España", "destination": "Barcelona, España"}
+    for path in ("/api/travel", "/api/travel/stream"):
+        start = time.perf_counter()
+        status, headers, payload = await asgi_request(main.app, "POST", path, body)
+        total = time.perf_counter() - start
+        ttfb = float(headers.get("x-bench-ttfb", total))
+        events = payload.count(b"event: ")
+        print(f"📊 {path}: status={status} TTFB={ttfb * 1000:.0f}ms total={total * 1000:.0f}ms"
+              + (f" eventos={events}" if events else ""))
+
+
+async def bench_search_autocomplete() -> None:
+    """
+    Simula el autocompletado (una petición por tecla) y cuenta las llamadas a Gemini.
+    """
+    global FAKE_GEMINI_LATENCY
+    FAKE_GEMINI_LATENCY = 0.0
+    import google.generativeai as genai
+    genai.GenerativeModel = FakeGenerativeModel
+    import main
+
+    print("=" * 60)
+    print("🧪 Autocompletado de destinos: llamadas a Gemini por tecla")
+    print("=" * 60)
+
+    typed = ["barcelona", "bariloche", "bogota", "paris", "praga", "tokio", "toledo",
+             "madrid", "malaga", "medellin", "roma", "zzzz", "barcelona", "tokio"]
+    keystrokes = 0
+    main.destination_search_cache.clear()
+    FakeGenerativeModel.calls = 0
+    # Los códigos de país ya cacheados no cuentan: solo llamadas de búsqueda
+    from weather import _country_code_cache
+    for country in ("España", "Argentina", "Italia", "Colombia", "Tailandia", "Alemania", "Francia",
+                    "República Checa", "Portugal", "República Dominicana", "Japón", "Canadá",
+                    "Brasil", "México", "Estados Unidos"):
+        _country_code_cache.set(country, "XX")
+
+    for word in typed:
+        for i in range(1, len(word) + 1):
+            keystrokes += 1
+            await asgi_request(main.app, "POST", "/api/destinations/search", {"query": word[:i]})
+
+    stats = main.destination_search_cache.get_stats()
+    print(f"📊 Teclas (peticiones): {keystrokes}")
+    print(f"📊 Llamadas a Gemini: {FakeGenerativeModel.calls} (sin cache serían {keystrokes})")
+    print(f"📊 Cache: exactos={stats['exact_hits']} prefijo={stats['prefix_hits']} "
+          f"negativos={stats['negative_hits']} fallos={stats['misses']}")
+
+
+async def bench_gazetteer(rounds: int = 200) -> None:
+    """
+    Mide la latencia de búsqueda en el gazetteer local, tecla a tecla.
+    """
+    from gazetteer import gazetteer
+
+    print("=" * 60)
+    print(f"🧪 Gazetteer local ({gazetteer.get_stats()['cities']} ciudades, {rounds} rondas)")
+    print("=" * 60)
+
+    typed = ["barcelona", "new york", "york", "tokio", "tokyo", "paris", "rio de janeiro",
+             "espana", "medellin", "b", "ma", "zzzz"]
+    prefixes = [word[:i] for word in typed for i in range(1, len(word) + 1)]
+    latencies: List[float] = []
+    for _ in range(rounds):
+        for prefix in prefixes:
+            start = time.perf_counter()
+            gazetteer.search(prefix)
+            latencies.append(time.perf_counter() - start)
+
+    for query in ("bar", "york", "espana", "zzzz"):
+        print(f"🔎 '{query}' → {gazetteer.search(query)}")
+    print(f"📊 Búsquedas: {len(latencies)}")
+    print(f"📊 Latencia p50={percentile(latencies, 50) * 1e6:.1f}µs p99={percentile(latencies, 99) * 1e6:.1f}µs")
+
+
+async def bench_model_registry(iterations: int = 20000) -> None:
+    """
+    Coste por petición de obtener el modelo de Gemini: resolución por llamada
+    (variable de entorno + validación + GenerativeModel nuevo, como antes del
+    registro) frente a GeminiModelRegistry.get().
+    """
+    from google.generativeai.generative_models import GenerativeModel
+    from gemini_models import GeminiModelRegistry, is_free_model
+
+    print("=" * 60)
+    print(f"🧪 Obtención del modelo de Gemini por petición ({iterations} iteraciones)")
+    print("=" * 60)
+
+    def per_call_lookup():
+        model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+        if not is_free_model(model_name):
+            raise ValueError(model_name)
+        return GenerativeModel(model_name)
+
+    # Registro propio para no dejar modelos reales en el registro global
+    registry = GeminiModelRegistry()
+    registry.configure()
+
+    for label, lookup in (("por llamada", per_call_lookup), ("registro", lambda: registry.get("search"))):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            lookup()
+        elapsed = time.perf_counter() - start
+        print(f"📊 {label}: {elapsed / iterations * 1e6:.2f}µs por petición")
+
+
+async def bench_travel_enrichment() -> None:
+    """
+    Latencia de /api/travel con clima y fotos simulados: el enriquecimiento
+    corre en paralelo a Gemini, así que la latencia es ≈ max(Gemini, clima, fotos).
+    Con fotos colgadas, el timeout de su rama acota la respuesta.
+    """
+    import google.generativeai as genai
+    genai.GenerativeModel = FakeGenerativeModel
+    import main
+
+    weather_latency, photos_latency = 0.3, 0.4
+    main.weather_service.api_key = "benchmark-fake-key"
+    main.unsplash_service.api_key = "benchmark-fake-key"
+
+    async def fake_get_weather(city: str, country: Optional[str] = None) -> Dict[str, Any]:
+        await asyncio.sleep(weather_latency)
+        return {"city": city}
+
+    main.weather_service.get_weather = fake_get_weather
+    main.weather_service.format_weather_message = lambda data: f"Clima en {data['city']}"
+
+    print("=" * 60)
+    print(f"🧪 Enriquecimiento concurrente en /api/travel (Gemini={FAKE_GEMINI_LATENCY}s, "
+          f"clima={weather_latency}s, fotos={photos_latency}s)")
+    print("=" * 60)
+
+    body = {"question": "Quiero viajar a Roma, Italia", "destination": "Roma, Italia"}
+    for label, latency in (("fotos normales", photos_latency), ("fotos colgadas", 6.0)):
+        async def fake_get_photos(destination: str, count: int = 3, latency: float = latency) -> List[Dict[str, Any]]:
+            await asyncio.sleep(latency)
+            return [{"url": "https://example.com/foto.jpg"}]
+
+        main.unsplash_service.get_photos = fake_get_photos
+        start = time.perf_counter()
+        status, _, payload = await asgi_request(main.app, "POST", "/api/travel", body)
+        total = time.perf_counter() - start
+        data = json.loads(payload)
+        print(f"📊 {label}: status={status} total={total:.2f}s clima={'sí' if data.get('weather') else 'no'} "
+              f"fotos={len(data.get('photos') or [])} (en serie ≈ "
+              f"{FAKE_GEMINI_LATENCY + weather_latency + min(latency, main.ENRICHMENT_PHOTOS_TIMEOUT):.2f}s)")
+
+
+async def bench_gemini_coalescing(concurrency: int = 20) -> None:
+    """
+    N sesiones nuevas envían el mismo formulario a la vez: el prompt del
+    primer turno es idéntico y debe resolverse con una sola llamada a Gemini.
+    """
+    import google.generativeai as genai
+    genai.GenerativeModel = FakeGenerativeModel
+    import main
+
+    print("=" * 60)
+    print(f"🧪 Coalescencia de prompts idénticos ({concurrency} formularios simultáneos)")
+    print("=" * 60)
+
+    body = {"question": "Quiero viajar a París, Francia", "destination": "París, Francia"}
+    before = main.gemini_client.get_stats()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(asgi_request(main.app, "POST", "/api/travel", body)
+                                     for _ in range(concurrency)))
+    total = time.perf_counter() - start
+    after = main.gemini_client.get_stats()
+
+    print(f"📊 Respuestas 200: {sum(1 for status, _, _ in results if status == 200)}/{concurrency}")
+    print(f"📊 Llamadas a Gemini: {after['gemini_calls'] - before['gemini_calls']} "
+          f"(coalescidas: {after['coalesced_requests'] - before['coalesced_requests']})")
+    print(f"📊 Tiempo total: {total:.2f}s")
+
+
+async def bench_travel_answer_cache(repeats: int = 4) -> None:
+    """
+    Formularios del primer turno repetidos con el cache de respuestas activado:
+    solo el primero de cada destino consulta a Gemini.
+    """
+    import google.generativeai as genai
+    genai.GenerativeModel = FakeGenerativeModel
+    import main
+
+    main.travel_answer_cache.enabled = True
+    main.travel_answer_cache.clear()
+
+    print("=" * 60)
+    print(f"🧪 Cache de respuestas del primer turno ({repeats} formularios por destino)")
+    print("=" * 60)
+
+    destinations = [("París, Francia", "Paris, France"), ("Roma, Italia", "Rome, Italy"),
+                    ("Tokio, Japón", "Tokyo, Japan")]
+    latencies: Dict[str, List[float]] = {"miss": [], "hit": []}
+    for spanish, english in destinations:
+        for i in range(repeats):
+            destination = spanish if i % 2 == 0 else english
+            body = {"question": f"Quiero viajar a {destination}", "destination": destination}
+            hits_before = main.travel_answer_cache.hits
+            start = time.perf_counter()
+            status, _, _ = await asgi_request(main.app, "POST", "/api/travel", body)
+            latencies["hit" if main.travel_answer_cache.hits > hits_before else "miss"].append(
+                time.perf_counter() - start)
+            assert status == 200, status
+
+    _, _, payload = await asgi_request(main.app, "POST", "/api/travel/answer-cache/invalidate",
+                                       {"destination": "Paris, France"})
+    stats = main.travel_answer_cache.get_stats()
+    print(f"📊 Aciertos={stats['hits']} fallos={stats['misses']} hit_rate={stats['hit_rate']}")
+    print(f"📊 Latencia fallo p50={percentile(latencies['miss'], 50):.3f}s "
+          f"acierto p50={percentile(latencies['hit'], 50) * 1000:.1f}ms")
+    print(f"📊 Invalidación: {json.loads(payload)}")
+
+
+async def bench_prompt_budget(turns: int = 4) -> None:
+    """
+    Tamaño del prompt contextual en una sesión larga: historial sin límite
+    (respuestas completas, incluido el JSON) frente al presupuesto de tokens.
+    """
+    import google.generativeai as genai
+    genai.GenerativeModel = FakeGenerativeModel
+    import main
+    from prompts import load_prompt
+    from prompt_builder import estimate_tokens, PROMPT_TOKEN_BUDGETS
+
+    print("=" * 60)
+    print(f"🧪 Presupuesto de tokens del prompt (sesión con {turns} turnos de chat)")
+    print("=" * 60)
+
+    history = main.conversation_history
+    session_id = history.create_session()
+    history.set_current_destination(session_id, "Roma, Italia")
+    itinerary = {section: [f"Recomendación {i} para {section} en Roma con muchos detalles prácticos " * 2
+                           for i in range(6)]
+                 for section in ("alojamiento", "comida_local", "lugares_imperdibles",
+                                 "consejos_locales", "estimacion_costos")}
+    history.add_message(session_id, "user", "Quiero viajar a Roma, Italia")
+    history.add_message(session_id, "assistant", json.dumps(itinerary, ensure_ascii=False))
+    for i in range(turns):
+        history.add_message(session_id, "user", f"Pregunta de seguimiento {i} sobre Roma")
+        history.add_message(session_id, "assistant", f"Respuesta {i} con muchos detalles sobre Roma. " * 60)
+
+    question = "¿Qué me recomiendas visitar por la noche?"
+    raw_prompt = load_prompt("travel_contextual", question=question, current_destination="Roma, Italia",
+                             conversation_history="\n".join(
+                                 f"{'Usuario' if m['role'] == 'user' else 'Alex'}: {m['content']}"
+                                 for m in history.get_history(session_id, limit=10)))
+
+    status, _, _ = await asgi_request(main.app, "POST", "/api/travel",
+                                      {"question": question, "session_id": session_id})
+    stats = main.prompt_size_stats.get_stats()["contextual"]
+    print(f"📊 Sin presupuesto: ~{estimate_tokens(raw_prompt)} tokens")
+    print(f"📊 Con presupuesto: ~{stats['max']} tokens (presupuesto {PROMPT_TOKEN_BUDGETS['contextual']}, "
+          f"mensajes descartados {stats['history_messages_dropped']}, status={status})")
+
+
+async def bench_conversation_store(turns: int = 500) -> None:
+    """
+    Coste de add_message/get_history en memoria frente a SQLite (WAL), y
+    visibilidad de una sesión entre dos "workers" que comparten la base de datos.
+    """
+    import tempfile
+    from conversation_history import ConversationHistory
+    from conversation_store import SQLiteConversationStore
+
+    print("=" * 60)
+    print(f"🧪 Store de conversaciones ({turns} turnos por backend)")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "conversations.db")
+        backends = {
+            "memoria": ConversationHistory(max_messages=20),
+            "sqlite": ConversationHistory(max_messages=20, store=SQLiteConversationStore(db_path)),
+        }
+        for name, history in backends.items():
+            session_id = history.create_session()
+            await history.flush()
+            writes, blocked, reads = [], [], []
+            for i in range(turns):
+                # Como una petición: revalidar, escribir y esperar al store antes de responder
+                await history.prefetch(session_id)
+                start = time.perf_counter()
+                history.add_message(session_id, "user" if i % 2 == 0 else "assistant", f"Mensaje {i} sobre Roma")
+                blocked.append(time.perf_counter() - start)
+                await history.flush()
+                writes.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                history.get_history(session_id, limit=10)
+                reads.append(time.perf_counter() - start)
+            print(f"📊 {name}: add_message+flush p50={percentile(writes, 50) * 1e6:.0f}µs "
+                  f"p99={percentile(writes, 99) * 1e6:.0f}µs (event loop bloqueado p50="
+                  f"{percentile(blocked, 50) * 1e6:.0f}µs) | get_history p50={percentile(reads, 50) * 1e6:.0f}µs "
+                  f"p99={percentile(reads, 99) * 1e6:.0f}µs | recargas={history.cache_reloads}")
+
+        # Dos procesos (aquí, dos instancias) sobre la misma base de datos
+        worker_a = backends["sqlite"]
+        worker_b = ConversationHistory(max_messages=20, store=SQLiteConversationStore(db_path))
+        session_id = worker_a.create_session()
+        worker_a.set_current_destination(session_id, "Lima, Perú")
+        worker_a.add_message(session_id, "user", "Quiero viajar a Lima")
+        await worker_a.flush()
+        await worker_b.prefetch(session_id)
+        seen = [m["content"] for m in worker_b.get_history(session_id)]
+        worker_b.add_message(session_id, "assistant", "¡Lima es genial!")
+        await worker_b.flush()
+        await worker_a.prefetch(session_id)
+        seen_by_a = len(worker_a.get_history(session_id))
+        print(f"📊 Worker B ve: {seen} (destino: {worker_b.get_current_destination(session_id)})")
+        print(f"📊 Worker A ve {seen_by_a} mensajes tras la respuesta escrita por B")
+        for history in (worker_a, worker_b):
+            history.close()
+
+
+async def bench_conversation_eviction(sessions: int = 50000) -> None:
+    """
+    Muchos visitantes anónimos que crean una sesión y no vuelven: sesiones en
+    memoria y coste por acceso con TTL de inactividad y límite LRU.
+    """
+    from conversation_history import ConversationHistory
+
+    print("=" * 60)
+    print(f"🧪 Expulsión de sesiones ({sessions} visitantes de un solo turno)")
+    print("=" * 60)
+
+    configs = {
+        "sin límites": ConversationHistory(max_messages=20),
+        "TTL 1s + 5000 sesiones": ConversationHistory(max_messages=20, session_ttl_seconds=1, max_sessions=5000),
+    }
+    for name, history in configs.items():
+        latencies = []
+        started = time.perf_counter()
+        for i in range(sessions):
+            start = time.perf_counter()
+            session_id = history.create_session()
+            history.add_message(session_id, "user", f"Quiero viajar a la ciudad número {i}")
+            latencies.append(time.perf_counter() - start)
+            if i == sessions // 2:
+                await asyncio.sleep(1.1)  # La primera mitad queda inactiva más del TTL
+        elapsed = time.perf_counter() - started
+        stats = history.get_stats()
+        print(f"📊 {name}: {stats['live_sessions']} sesiones, {stats['total_bytes']} bytes | "
+              f"expulsadas inactivas={stats['evictions_idle']} capacidad={stats['evictions_capacity']} | "
+              f"p50={percentile(latencies, 50) * 1e6:.1f}µs p99={percentile(latencies, 99) * 1e6:.1f}µs "
+              f"({elapsed:.2f}s)")
+
+
+async def bench_conversation_memory(sessions: int = 100000, messages: int = 20) -> None:
+    """
+    Memoria del historial lleno (sessions × messages) con el formato anterior
+    (objeto con __dict__ y datetime, listas recortadas por slicing) frente al
+    buffer circular con mensajes __slots__, y coste de get_history repetido.
+    """
+    import gc
+    import tracemalloc
+    from datetime import datetime
+    from conversation_history import ConversationHistory
+
+    class LegacyMessage:
+        def __init__(self, role: str, content: str):
+            self.role = role
+            self.content = content
+            self.timestamp = datetime.now()
+
+        def to_dict(self) -> Dict:
+            return {'role': self.role, 'content': self.content, 'timestamp': self.timestamp.isoformat()}
+
+    print("=" * 60)
+    print(f"🧪 Memoria del historial ({sessions} sesiones × {messages} mensajes)")
+    print("=" * 60)
+
+    # Contenidos compartidos: se mide el coste por mensaje, no el del texto
+    contents = [f"Mensaje {i} sobre el viaje" for i in range(messages)]
+    roles = ["user", "assistant"]
+
+    def measure(build) -> Tuple[Any, int]:
+        gc.collect()
+        tracemalloc.start()
+        result = build()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, current
+
+    def build_legacy() -> Dict[str, List[LegacyMessage]]:
+        conversations = {}
+        for s in range(sessions):
+            history = conversations.setdefault(f"session-{s}", [])
+            for i in range(messages):
+                history.append(LegacyMessage(roles[i % 2], contents[i]))
+                if len(history) > messages:
+                    history = conversations[f"session-{s}"] = history[-messages:]
+        return conversations
+
+    def build_current() -> ConversationHistory:
+        history = ConversationHistory(max_messages=messages)
+        for _ in range(sessions):
+            session_id = history.create_session()
+            for i in range(messages):
+                history.add_message(session_id, roles[i % 2], contents[i])
+        return history
+
+    legacy, legacy_bytes = measure(build_legacy)
+    legacy_session = legacy["session-0"]
+    start = time.perf_counter()
+    for _ in range(10000):
+        [msg.to_dict() for msg in legacy_session[-10:]]
+    legacy_read = (time.perf_counter() - start) / 10000
+    del legacy, legacy_session
+    gc.collect()
+
+    current, current_bytes = measure(build_current)
+    # Cada mensaje leído cachea su timestamp ISO y su diccionario
+    _, warm_bytes = measure(lambda: sum(len(current.get_history(sid, limit=10)) for sid in list(current.conversations)))
+    session_id = next(iter(current.conversations))
+    start = time.perf_counter()
+    for _ in range(10000):
+        current.get_history(session_id, limit=10)
+    current_read = (time.perf_counter() - start) / 10000
+
+    print(f"📊 Formato anterior: {legacy_bytes / 2**20:.0f} MiB "
+          f"({legacy_bytes / (sessions * messages):.0f} bytes/mensaje) | get_history(10) {legacy_read * 1e6:.1f}µs")
+    print(f"📊 Buffer circular + __slots__ (con la línea del prompt ya renderizada): {current_bytes / 2**20:.0f} MiB "
+          f"({current_bytes / (sessions * messages):.0f} bytes/mensaje) | get_history(10) {current_read * 1e6:.1f}µs")
+    print(f"📊 Timestamps ISO y diccionarios cacheados tras un get_history(10) por sesión: +{warm_bytes / 2**20:.0f} MiB")
+
+async def bench_conversation_context(requests: int = 20000) -> None:
+    """
+    Coste por petición de preparar el historial del prompt: renderizar cada
+    mensaje en cada petición (get_history + compactar) frente a las líneas
+    renderizadas una vez al añadir el mensaje.
+    """
+    from conversation_history import ConversationHistory
+    from prompt_builder import build_history_context, render_context_line
+
+    print("=" * 60)
+    print(f"🧪 Historial renderizado por petición ({requests} peticiones, 10 mensajes)")
+    print("=" * 60)
+
+    history = ConversationHistory(max_messages=20)
+    session_id = history.create_session()
+    itinerary = json.dumps({section: [f"Recomendación {i} para {section}" for i in range(6)]
+                            for section in ("alojamiento", "comida_local", "lugares_imperdibles",
+                                            "consejos_locales", "estimacion_costos")}, ensure_ascii=False)
+    for i in range(5):
+        history.add_message(session_id, "user", f"Pregunta {i} sobre Lisboa")
+        history.add_message(session_id, "assistant", itinerary if i == 0 else f"Respuesta {i} sobre Lisboa. " * 20)
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        lines = [render_context_line(m['role'], m['content']) for m in history.get_history(session_id, limit=10)]
+        build_history_context(lines, 2000)
+    per_message = (time.perf_counter() - start) / requests
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        build_history_context(history.get_context_lines(session_id, limit=10), 2000)
+    incremental = (time.perf_counter() - start) / requests
+
+    print(f"📊 Renderizando en cada petición: {per_message * 1e6:.1f}µs")
+    print(f"📊 Líneas renderizadas al añadir: {incremental * 1e6:.1f}µs ({per_message / incremental:.0f}x)")
+
+async def bench_session_lookup(checks: int = 2000) -> None:
+    """
+    Coste de comprobar una sesión según el número de sesiones activas:
+    búsqueda en get_all_sessions() (lista completa) frente a has_session, y
+    latencia de POST /api/conversation/history.
+    """
+    import google.generativeai as genai
+    genai.GenerativeModel = FakeGenerativeModel
+    import main
+    from conversation_history import ConversationHistory
+
+    print("=" * 60)
+    print("🧪 Búsqueda de sesión según el número de sesiones activas")
+    print("=" * 60)
+
+    global_history = main.conversation_history
+    try:
+        for sessions in (1000, 10000, 100000):
+            history = ConversationHistory(max_messages=20)
+            for _ in range(sessions):
+                history.create_session()
+            session_id = history.create_session()
+            history.add_message(session_id, "user", "Quiero viajar a Oporto")
+            main.conversation_history = history
+
+            start = time.perf_counter()
+            for _ in range(checks // 10):
+                session_id in history.get_all_sessions()
+            scan = (time.perf_counter() - start) / (checks // 10)
+
+            start = time.perf_counter()
+            for _ in range(checks):
+                history.has_session(session_id)
+            lookup = (time.perf_counter() - start) / checks
+
+            latencies = []
+            for _ in range(200):
+                start = time.perf_counter()
+                await asgi_request(main.app, "POST", "/api/conversation/history", {"session_id": session_id})
+                latencies.append(time.perf_counter() - start)
+
+            print(f"📊 {sessions:>6} sesiones: get_all_sessions {scan * 1e6:8.1f}µs | has_session {lookup * 1e6:.2f}µs | "
+                  f"/api/conversation/history p50={percentile(latencies, 50) * 1000:.2f}ms")
+    finally:
+        main.conversation_history = global_history
+
+
+async def bench_session_concurrency(concurrency: int = 8, rounds: int = 5) -> None:
+    """
+    Prueba de estrés: peticiones de chat simultáneas sobre una misma sesión
+    con latencias de Gemini distintas. Comprueba que el historial queda en
+    pares pregunta → respuesta correctos y que las peticiones no se
+    serializan (el tiempo total ≈ la llamada más lenta).
+    """
+    import random
+    import google.generativeai as genai
+    genai.GenerativeModel = FakeGenerativeModel
+    import main
+
+    print("=" * 60)
+    print(f"🧪 Concurrencia en una sesión ({concurrency} peticiones simultáneas × {rounds} rondas)")
+    print("=" * 60)
+
+    async def fake_generate_text(prompt: str, model) -> str:
+        question = prompt.split("pregunta | usuario\n", 1)[1].split("\n", 1)[0]
+        await asyncio.sleep(random.uniform(0.05, 0.3))
+        return f"Respuesta a: {question}"
+
+    original_generate_text = main.gemini_client.generate_text
+    main.gemini_client.generate_text = fake_generate_text
+    history = main.conversation_history
+    errors = 0
+    try:
+        for round_number in range(rounds):
+            session_id = history.create_session()
+            history.set_current_destination(session_id, "Lisboa, Portugal")
+            start = time.perf_counter()
+            results = await asyncio.gather(*(
+                asgi_request(main.app, "POST", "/api/travel",
+                             {"question": f"pregunta {round_number}-{i} sobre comida", "session_id": session_id})
+                for i in range(concurrency)
+            ))
+            elapsed = time.perf_counter() - start
+            messages = history.get_history(session_id)
+            pairs_ok = len(messages) == 2 * concurrency and all(
+                messages[i]['role'] == 'user' and messages[i + 1]['role'] == 'assistant'
+                and messages[i + 1]['content'] == f"Respuesta a: {messages[i]['content']}"
+                for i in range(0, len(messages), 2)
+            )
+            errors += not pairs_ok
+            statuses = sorted({status for status, _, _ in results})
+            print(f"📊 Ronda {round_number + 1}: status={statuses} mensajes={len(messages)} "
+                  f"pares correctos={'sí' if pairs_ok else 'NO'} tiempo={elapsed:.2f}s")
+    finally:
+        main.gemini_client.generate_text = original_generate_text
+    print(f"📊 Rondas con historial intercalado: {errors}/{rounds}")
+
+
+async def bench_destination_index(messages: int = 200, lookups: int = 2000) -> None:
+    """
+    Último destino mencionado en una sesión larga: re-escanear todos los
+    mensajes con las expresiones regulares en cada consulta frente al índice
+    que se actualiza en add_message.
+    """
+    import re
+    from conversation_history import ConversationHistory, _DESTINATION_PATTERNS
+
+    print("=" * 60)
+    print(f"🧪 Índice de destinos ({messages} mensajes, destino solo en el primero)")
+    print("=" * 60)
+
+    history = ConversationHistory(max_messages=messages)
+    session_id = history.create_session()
+    history.add_message(session_id, "user", "Quiero viajar a Cartagena, Colombia")
+    for i in range(1, messages):
+        history.add_message(session_id, "user" if i % 2 == 0 else "assistant",
+                            f"Mensaje {i} sin destinos: horarios de museos y transporte público " * 3)
+
+    def rescan() -> Optional[str]:
+        for msg in reversed(history.get_history(session_id)):
+            for pattern in _DESTINATION_PATTERNS:
+                for match in re.finditer(pattern.pattern, msg['content'], re.IGNORECASE):
+                    destination = match.group(1).strip()
+                    if ',' in destination:
+                        return destination
+        return None
+
+    start = time.perf_counter()
+    for _ in range(lookups // 10):
+        scanned = rescan()
+    scan = (time.perf_counter() - start) / (lookups // 10)
+
+    start = time.perf_counter()
+    for _ in range(lookups):
+        indexed = history.extract_last_destination(session_id)
+    lookup = (time.perf_counter() - start) / lookups
+
+    print(f"📊 Re-escaneo: {scan * 1e6:.0f}µs → {scanned}")
+    print(f"📊 Índice: {lookup * 1e6:.2f}µs → {indexed} ({scan / lookup:.0f}x)")
+
+
+async def bench_conversation_summary(turns: int = 30) -> None:
+    """
+    Sesión larga de chat: tamaño del prompt y latencia por turno con el
+    resumen acumulado de los turnos que salen de la ventana.
+    """
+    import google.generativeai as genai
+    genai.GenerativeModel = FakeGenerativeModel
+    import main
+    from prompt_builder import estimate_tokens
+
+    print("=" * 60)
+    print(f"🧪 Resumen acumulado ({turns} turnos de chat en una sesión)")
+    print("=" * 60)
+
+    summary_calls = 0
+
+    async def fake_generate_text(prompt: str, model) -> str:
+        nonlocal summary_calls
+        if "resume conversaciones" in prompt:
+            summary_calls += 1
+            await asyncio.sleep(0.2)
+            return f"El usuario planea un viaje a Lisboa; ya se habló de comida, barrios y transporte ({summary_calls} actualizaciones)"
+        prompt_tokens.append(estimate_tokens(prompt))
+        await asyncio.sleep(0.05)
+        return "Respuesta detallada sobre Lisboa con recomendaciones concretas. " * 20
+
+    original_generate_text = main.gemini_client.generate_text
+    main.gemini_client.generate_text = fake_generate_text
+    history = main.conversation_history
+    original_summarizer = history.summarizer
+    history.summarizer = main._summarize_conversation
+    prompt_tokens: List[int] = []
+    latencies: List[float] = []
+    try:
+        session_id = history.create_session()
+        history.set_current_destination(session_id, "Lisboa, Portugal")
+        for turn in range(turns):
+            start = time.perf_counter()
+            await asgi_request(main.app, "POST", "/api/travel",
+                               {"question": f"pregunta {turn} sobre comida y barrios", "session_id": session_id})
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)  # el usuario tarda en escribir la siguiente pregunta
+        await asyncio.sleep(0.3)
+    finally:
+        main.gemini_client.generate_text = original_generate_text
+        history.summarizer = original_summarizer
+
+    for turn in (1, 5, 10, 20, turns):
+        print(f"📊 Turno {turn:>2}: prompt ~{prompt_tokens[turn - 1]} tokens, latencia {latencies[turn - 1] * 1000:.0f}ms")
+    summary = history.get_summary(session_id) or ""
+    print(f"📊 Resumen ({len(summary)}/{history.summary_max_chars} caracteres, {summary_calls} llamadas en segundo plano): {summary[:100]}")
+
+async def bench_snapshot_restore(sessions: int = 50_000, messages: int = 10) -> None:
+    """
+    Reinicio con sesiones en memoria: tiempo de guardar el snapshot, de cargar
+    su índice al arrancar y del primer acceso a una sesión (restauración perezosa),
+    frente a decodificar todas las sesiones al arrancar.
+    """
+    import tempfile
+    from conversation_history import ConversationHistory
+
+    print("=" * 60)
+    print(f"🧪 Snapshot de conversaciones ({sessions} sesiones × {messages} mensajes)")
+    print("=" * 60)
+
+    history = ConversationHistory(max_messages=messages, max_sessions=sessions)
+    session_ids = []
+    for i in range(sessions):
+        session_id = history.create_session()
+        session_ids.append(session_id)
+        history.add_message(session_id, "user", f"Quiero viajar a Lisboa, Portugal (visitante {i})")
+        for j in range(1, messages):
+            history.add_message(session_id, "user" if j % 2 == 0 else "assistant",
+                                f"Mensaje {j}: recomendaciones de comida y barrios para el visitante {i}")
+        history.set_current_destination(session_id, "Lisboa, Portugal")
+    sample_id = session_ids[sessions // 2]
+    expected = history.get_history(sample_id)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "conversations.snapshot")
+        start = time.perf_counter()
+        history.save_snapshot(path)
+        save = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        eager_history = ConversationHistory(max_messages=messages, max_sessions=sessions)
+        start = time.perf_counter()
+        eager_history.load_snapshot(path)
+        for session_id in session_ids:
+            eager_history.has_session(session_id)
+        eager = time.perf_counter() - start
+        del eager_history
+
+        restarted = ConversationHistory(max_messages=messages, max_sessions=sessions)
+        start = time.perf_counter()
+        restarted.load_snapshot(path)
+        index_load = time.perf_counter() - start
+
+        first_access = []
+        for session_id in session_ids[:1000]:
+            start = time.perf_counter()
+            restarted.get_conversation_context(session_id)
+            first_access.append(time.perf_counter() - start)
+        restored = restarted.get_history(sample_id)
+        stats = restarted.get_stats()
+        restarted.close_snapshot()
+
+    print(f"📊 Guardado: {save * 1000:.0f}ms, {size / 1024 / 1024:.1f} MiB ({size / sessions:.0f} B/sesión)")
+    print(f"📊 Arranque decodificando todo: {eager * 1000:.0f}ms")
+    print(f"📊 Arranque con índice: {index_load * 1000:.0f}ms "
+          f"(primer acceso p50={percentile(first_access, 50) * 1e6:.0f}µs p99={percentile(first_access, 99) * 1e6:.0f}µs)")
+    print(f"📊 Restauradas {stats['snapshot_restored']}, pendientes {stats['snapshot_pending']}; "
+          f"datos {'idénticos' if restored == expected else 'DIFERENTES'}, "
+          f"destino {restarted.get_current_destination(sample_id)}")
+
+async def bench_history_polling(messages: int = 20, polls: int = 2000) -> None:
+    """
+    Cliente que consulta el historial periódicamente: lista completa en cada
+    consulta (POST) frente a cursor after + ETag (GET, 304 si no hay cambios).
+    """
+    import google.generativeai as genai
+    genai.GenerativeModel = FakeGenerativeModel
+    import main
+
+    print("=" * 60)
+    print(f"🧪 Consultas del historial ({messages} mensajes, {polls} consultas)")
+    print("=" * 60)
+
+    history = main.conversation_history
+    session_id = history.create_session()
+    for i in range(messages):
+        history.add_message(session_id, "user" if i % 2 == 0 else "assistant",
+                            f"Mensaje {i}: recomendaciones de comida y barrios en Lisboa " * 4)
+
+    async def poll(method: str, path: str, body=None, headers=None) -> Tuple[float, int, int]:
+        start = time.perf_counter()
+        status, response_headers, raw = await asgi_request(main.app, method, path, body, headers)
+        return time.perf_counter() - start, status, len(raw)
+
+    full = [await poll("POST", "/api/conversation/history", {"session_id": session_id}) for _ in range(polls)]
+
+    status, headers, raw = await asgi_request(main.app, "GET", f"/api/conversation/history/{session_id}")
+    cursor = json.loads(raw)["next_after"]
+    path = f"/api/conversation/history/{session_id}?after={cursor}"
+    _, headers, _ = await asgi_request(main.app, "GET", path)
+    etag = headers["etag"]
+    unchanged = [await poll("GET", path, headers={"If-None-Match": etag}) for _ in range(polls)]
+
+    history.add_message(session_id, "user", "¿Y para ir a Sintra?")
+    changed = await poll("GET", path, headers={"If-None-Match": etag})
+    _, _, raw = await asgi_request(main.app, "GET", path)
+    delta = json.loads(raw)
+
+    for label, samples in (("Lista completa (POST)", full), ("Sin cambios (GET + ETag)", unchanged)):
+        latencies = [sample[0] for sample in samples]
+        print(f"📊 {label}: status {samples[0][1]}, {samples[0][2]} bytes, "
+              f"p50={percentile(latencies, 50) * 1e6:.0f}µs p99={percentile(latencies, 99) * 1e6:.0f}µs")
+    print(f"📊 Tras un mensaje nuevo: status {changed[1]}, {changed[2]} bytes, "
+          f"{len(delta['messages'])} mensaje (índice {delta['messages'][0]['index']}), next_after={delta['next_after']}")
+    print(f"📊 Estadísticas de la sesión: {history.get_session_stats(session_id)}")
+
+async def bench_http_pooling(requests_count: int = 300) -> None:
+    """
+    Coste del handshake contra un servidor HTTPS local (stub, en otro proceso):
+    requests.get suelto (conexión TCP+TLS nueva por llamada, como antes) frente
+    al cliente HTTP compartido (keep-alive por host).
+    """
+    import http.server
+    import multiprocessing
+    import shutil
+    import ssl
+    import subprocess
+    import tempfile
+    import requests
+    from http_client import HTTPClient
+
+    connections = multiprocessing.Value("i", 0)
+
+    class StubHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        disable_nagle_algorithm = True  # cabeceras y cuerpo van en escrituras separadas
+
+        def setup(self):
+            with connections.get_lock():
+                connections.value += 1
+            super().setup()
+
+        def do_GET(self):
+            body = b'{"main": {"temp": 21.5}, "weather": [{"description": "despejado"}]}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    def serve(port_queue, cert: Optional[str], key: Optional[str]) -> None:
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        server.daemon_threads = True
+        if cert:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert, key)
+            server.socket = context.wrap_socket(server.socket, server_side=True)
+        port_queue.put(server.server_address[1])
+        server.serve_forever()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert = key = None
+        scheme, verify = "http", True
+        if shutil.which("openssl"):
+            cert, key = os.path.join(tmp, "stub.pem"), os.path.join(tmp, "stub.key")
+            subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                            "-keyout", key, "-out", cert, "-subj", "/CN=localhost",
+                            "-addext", "subjectAltName=IP:127.0.0.1,DNS:localhost"],
+                           check=True, capture_output=True)
+            scheme, verify = "https", cert
+
+        context = multiprocessing.get_context("fork")
+        port_queue = context.Queue()
+        server = context.Process(target=serve, args=(port_queue, cert, key), daemon=True)
+        server.start()
+        url = f"{scheme}://127.0.0.1:{port_queue.get(timeout=10)}/data/2.5/weather"
+
+        print("=" * 60)
+        print(f"🧪 Conexiones HTTP a un stub {scheme.upper()} local ({requests_count} peticiones)")
+        print("=" * 60)
+
+        def measure(label: str, fn) -> float:
+            connections.value = 0
+            latencies = []
+            for _ in range(requests_count):
+                start = time.perf_counter()
+                fn().raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            print(f"📊 {label}: p50={percentile(latencies, 50) * 1000:.2f}ms "
+                  f"p99={percentile(latencies, 99) * 1000:.2f}ms, conexiones abiertas={connections.value}")
+            return percentile(latencies, 50)
+
+        policies = {"stub": {"connect_timeout": 3.05, "read_timeout": 5, "retries": 1}}
+        client = HTTPClient(policies=policies)
+        try:
+            per_call = measure("requests.get por llamada", lambda: requests.get(url, params={"q": "Roma"}, timeout=5, verify=verify))
+            pooled = measure("cliente compartido", lambda: client.get_sync("stub", url, params={"q": "Roma"}, verify=verify))
+            print(f"📊 Ahorro por petición: {(per_call - pooled) * 1000:.2f}ms ({per_call / pooled:.1f}x)")
+
+            # Bloqueo del event loop: mayor retraso de un latido de 1ms mientras se hacen las peticiones
+            async def max_loop_stall(fetch) -> float:
+                done = False
+                stall = 0.0
+
+                async def heartbeat():
+                    nonlocal stall
+                    while not done:
+                        start = time.perf_counter()
+                        await asyncio.sleep(0.001)
+                        stall = max(stall, time.perf_counter() - start - 0.001)
+
+                beat = asyncio.create_task(heartbeat())
+                await asyncio.sleep(0.01)
+                for _ in range(50):
+                    await fetch()
+                done = True
+                await beat
+                return stall
+
+            async def blocking_fetch():
+                return requests.get(url, timeout=5, verify=verify)
+
+            blocked = await max_loop_stall(blocking_fetch)
+            shared = await max_loop_stall(lambda: client.get("stub", url, verify=verify))
+            print(f"📊 Event loop bloqueado como máximo: requests.get en el endpoint {blocked * 1000:.2f}ms, "
+                  f"cliente compartido {shared * 1000:.2f}ms")
+            print(f"📊 Estadísticas del cliente: {client.get_stats()['stub']}")
+        finally:
+            client.close()
+            server.terminate()
+            server.join()
+
+async def bench_weather_swr(api_latency: float = 0.3, requests_count: int = 20) -> None:
+    """
+    Clima de una ciudad justo después de vencer el TTL: sin stale-while-revalidate
+    (la petición espera a OpenWeatherMap) frente a servir el dato vencido y
+    actualizarlo en segundo plano.
+    """
+    from weather import WeatherService
+
+    print("=" * 60)
+    print(f"🧪 Cache de clima vencido ({requests_count} peticiones, API={api_latency}s)")
+    print("=" * 60)
+
+    api_calls = 0
+
+    async def fake_fetch(city: str, country: Optional[str] = None) -> Dict[str, Any]:
+        nonlocal api_calls
+        api_calls += 1
+        await asyncio.sleep(api_latency)
+        return {"ciudad": city, "temperatura": 20 + api_calls}
+
+    ttl = 0.2
+    for label, hard_ttl in (("sin stale-while-revalidate", ttl), ("stale-while-revalidate", 60)):
+        service = WeatherService(api_key="benchmark-fake-key", cache_ttl_seconds=ttl, cache_hard_ttl_seconds=hard_ttl)
+        service._fetch_weather_from_api = fake_fetch
+        api_calls = 0
+        await service.get_weather("Lisboa", "PT")
+        await asyncio.sleep(ttl * 1.5)
+
+        async def timed() -> Tuple[float, Optional[Dict[str, Any]]]:
+            start = time.perf_counter()
+            data = await service.get_weather("Lisboa", "PT")
+            return time.perf_counter() - start, data
+
+        results = await asyncio.gather(*(timed() for _ in range(requests_count)))
+        latencies = [latency for latency, _ in results]
+        await asyncio.sleep(api_latency * 1.5)
+        after_refresh = await service.get_weather("Lisboa", "PT")
+        stats = service.cache.get_stats()
+        print(f"📊 {label}: p50={percentile(latencies, 50) * 1000:.1f}ms máx={max(latencies) * 1000:.1f}ms, "
+              f"llamadas a la API={api_calls}, temperatura servida {results[0][1]['temperatura']} → "
+              f"{after_refresh['temperatura']}")
+        print(f"   servidos vencidos={stats['served_stale']} actualizaciones={stats['refreshes']} "
+              f"hits={stats['hits']} misses={stats['misses']} coalescidas={stats['coalesced_requests']}")
+
+async def bench_weather_cache_scale(cities: int = 100000, steps: int = 20) -> None:
+    """
+    Cache de clima con muchas ciudades guardadas a lo largo del TTL máximo:
+    el formato anterior (dict de dicts; clear_expired y get_stats recorren
+    todo) frente a los heaps de vencimiento con entradas __slots__ y
+    contadores. Cada paso avanza el reloj lo justo para que caduque un 1% de
+    las ciudades. También mide la expulsión LRU con un límite de ciudades.
+    """
+    import contextlib
+    import gc
+    import tracemalloc
+    import weather_cache
+    from weather_cache import WeatherCache
+
+    print("=" * 60)
+    print(f"🧪 Cache de clima a escala ({cities} ciudades, {steps} pasos de limpieza)")
+    print("=" * 60)
+
+    # Reloj falso para repartir las ciudades a lo largo del TTL máximo
+    real_time = weather_cache.time
+    clock = [1_000_000_000.0]
+
+    class FakeClock:
+        @staticmethod
+        def time() -> float:
+            return clock[0]
+
+    ttl, hard_ttl = 1800, 7200
+    spacing = hard_ttl / cities  # la ciudad más antigua está a punto de caducar
+    step = spacing * cities / 100  # cada paso caduca un 1% de las ciudades
+    weather_data = {"ciudad": "x", "temperatura": 20}
+
+    def measure(build) -> Tuple[Any, int]:
+        gc.collect()
+        tracemalloc.start()
+        result = build()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, current
+
+    def build_legacy() -> Dict[str, Dict[str, Any]]:
+        start = clock[0]
+        return {f"ciudad {i},xx": {"weather_data": weather_data, "cached_at": start + i * spacing}
+                for i in range(cities)}
+
+    def build_current() -> WeatherCache:
+        cache = WeatherCache(ttl_seconds=ttl, hard_ttl_seconds=hard_ttl, max_entries=cities)
+        start = clock[0]
+        for i in range(cities):
+            clock[0] = start + i * spacing
+            cache.set(f"Ciudad {i}", "XX", weather_data)
+        return cache
+
+    def legacy_clear_and_stats(legacy: Dict[str, Dict[str, Any]], now: float) -> Tuple[int, int]:
+        expired_keys = [k for k, v in legacy.items() if now - v["cached_at"] > hard_ttl]
+        for key in expired_keys:
+            del legacy[key]
+        valid = sum(1 for v in legacy.values() if now - v["cached_at"] <= ttl)
+        return len(expired_keys), valid
+
+    weather_cache.time = FakeClock
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            legacy, legacy_bytes = measure(build_legacy)
+            clock[0] = 1_000_000_000.0
+            cache, current_bytes = measure(build_current)
+            cache.get_stats()
+
+            legacy_times, current_times = [], []
+            legacy_expired = 0
+            for _ in range(steps):
+                clock[0] += step
+                start = time.perf_counter()
+                expired, _ = legacy_clear_and_stats(legacy, clock[0])
+                legacy_times.append(time.perf_counter() - start)
+                legacy_expired += expired
+
+                start = time.perf_counter()
+                cache.clear_expired()
+                stats = cache.get_stats()
+                current_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for i in range(10000):
+                cache.set(f"Ciudad {i}", "XX", weather_data)
+            set_cost = (time.perf_counter() - start) / 10000
+
+            bounded = WeatherCache(ttl_seconds=ttl, hard_ttl_seconds=hard_ttl, max_entries=cities // 10)
+            for i in range(cities):
+                bounded.set(f"Ciudad {i}", "XX", weather_data)
+            bounded_stats = bounded.get_stats()
+    finally:
+        weather_cache.time = real_time
+
+    print(f"📊 memoria: anterior {legacy_bytes / cities:.0f} B/ciudad, actual {current_bytes / cities:.0f} B/ciudad")
+    print(f"📊 clear_expired + get_stats por paso (~{cities // 100} caducan): "
+          f"recorrido p50={percentile(legacy_times, 50) * 1000:.1f}ms, "
+          f"heaps p50={percentile(current_times, 50) * 1000:.2f}ms")
+    print(f"   caducadas: anterior={legacy_expired} actual={stats['expirations']}, "
+          f"válidas={stats['valid_entries']} vencidas={stats['stale_entries']}")
+    print(f"📊 set: {set_cost * 1e6:.1f}µs por ciudad")
+    print(f"📊 límite de {bounded.max_entries} ciudades: {bounded_stats['total_entries']} en cache, "
+          f"{bounded_stats['evictions']} expulsadas (LRU)")
+
+async def bench_circuit_breaker(duration: float = 2.0, outage: float = 0.6, interval: float = 0.01) -> None:
+    """
+    OpenWeatherMap responde 503 durante `outage` segundos y después se
+    recupera. Antes, el primer fallo marcaba la API como no disponible hasta
+    reiniciar el servidor; con el circuit breaker se limita la carga durante
+    la caída y el clima vuelve tras una petición de prueba. También comprueba
+    que un 429 con Retry-After mantiene el circuito abierto lo que pide la API.
+    """
+    import contextlib
+    import requests
+    import weather
+    from circuit_breaker import CircuitBreaker
+    from weather import WeatherService
+
+    print("=" * 60)
+    print(f"🧪 Circuit breaker (caída de {outage}s en {duration}s, una petición cada {interval * 1000:.0f}ms)")
+    print("=" * 60)
+
+    state = {"calls": 0, "outage_calls": 0, "down_until": 0.0, "status": 503, "retry_after": None}
+
+    def make_response(status_code: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        response = requests.Response()
+        response.status_code = status_code
+        response.reason = "Error" if status_code >= 400 else "OK"
+        response.url = WeatherService.BASE_URL
+        response._content = json.dumps(body).encode()
+        response.headers.update(headers or {})
+        return response
+
+    async def fake_get(upstream: str, url: str, **kwargs):
+        state["calls"] += 1
+        await asyncio.sleep(0.002)
+        if time.perf_counter() < state["down_until"]:
+            state["outage_calls"] += 1
+            headers = {"Retry-After": state["retry_after"]} if state["retry_after"] else None
+            return make_response(state["status"], {"message": "no disponible"}, headers)
+        return make_response(200, {"name": kwargs["params"]["q"], "main": {"temp": 20}, "weather": [{}]})
+
+    class LegacyWeatherService(WeatherService):
+        """Comportamiento anterior: el primer fallo desactiva la API hasta reiniciar."""
+
+        api_unavailable = False
+
+        async def _load_weather(self, city: str, country: Optional[str] = None):
+            if self.api_unavailable:
+                return None
+            data = await self._fetch_weather_from_api(city, country)
+            if data is None:
+                self.api_unavailable = True
+            return data
+
+    async def run(service: WeatherService, status: int = 503, retry_after: Optional[str] = None) -> Dict[str, Any]:
+        state.update(calls=0, outage_calls=0, status=status, retry_after=retry_after)
+        start = time.perf_counter()
+        state["down_until"] = start + outage
+        served_after_recovery = after_recovery = 0
+        first_served = None
+        i = 0
+        while time.perf_counter() - start < duration:
+            data = await service.get_weather(f"Ciudad {i}", "XX")
+            elapsed = time.perf_counter() - start
+            if elapsed >= outage:
+                after_recovery += 1
+                if data:
+                    served_after_recovery += 1
+                    if first_served is None:
+                        first_served = elapsed - outage
+            i += 1
+            await asyncio.sleep(interval)
+        return {
+            "requests": i,
+            "calls": state["calls"],
+            "outage_calls": state["outage_calls"],
+            "served": served_after_recovery,
+            "after_recovery": after_recovery,
+            "first_served": first_served
+        }
+
+    original_get = weather.http_client.get
+    weather.http_client.get = fake_get
+    try:
+        results = []
+        for label, service_class, status, retry_after in (
+            ("flag api_unavailable (anterior)", LegacyWeatherService, 503, None),
+            ("circuit breaker, 503", WeatherService, 503, None),
+            ("circuit breaker, 429 + Retry-After: 1", WeatherService, 429, "1"),
+        ):
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                service = service_class(api_key="benchmark-fake-key")
+                service.circuit_breaker = CircuitBreaker("OpenWeatherMap", window_seconds=1,
+                                                         cooldown_seconds=0.1, max_cooldown_seconds=0.8)
+                result = await run(service, status, retry_after)
+            results.append((label, result, service.circuit_breaker.get_stats()))
+    finally:
+        weather.http_client.get = original_get
+
+    for label, result, stats in results:
+        first = f"{result['first_served'] * 1000:.0f}ms" if result["first_served"] is not None else "nunca"
+        print(f"📊 {label}: {result['requests']} peticiones, {result['calls']} llamadas a la API "
+              f"({result['outage_calls']} durante la caída)")
+        print(f"   clima servido tras la recuperación: {result['served']}/{result['after_recovery']}, "
+              f"primero a los {first}")
+        if stats["times_opened"]:
+            transitions = " → ".join(t["to"] for t in stats["transitions"])
+            print(f"   aperturas={stats['times_opened']} pruebas={stats['probes']} "
+                  f"rechazadas={stats['rejected']}: {transitions}")
+
+async def bench_weather_coalescing(cities: int = 5, requests_per_city: int = 50, api_latency: float = 0.3) -> None:
+    """
+    Ciudades populares que fallan en cache a la vez (cache frío o recién
+    caducado): cada petición consulta OpenWeatherMap por su cuenta frente a
+    una sola consulta por ciudad compartida por todas (single-flight).
+    """
+    import contextlib
+    from weather import WeatherService
+
+    print("=" * 60)
+    print(f"🧪 Coalescencia de fallos de cache de clima ({cities} ciudades × {requests_per_city} peticiones, "
+          f"API={api_latency}s)")
+    print("=" * 60)
+
+    api_calls = 0
+
+    async def fake_fetch(city: str, country: Optional[str] = None) -> Dict[str, Any]:
+        nonlocal api_calls
+        api_calls += 1
+        await asyncio.sleep(api_latency)
+        return {"ciudad": city, "temperatura": 20}
+
+    async def timed(call) -> float:
+        start = time.perf_counter()
+        data = await call()
+        assert data is not None
+        return time.perf_counter() - start
+
+    for label, coalesce in (("sin coalescencia", False), ("single-flight", True)):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            service = WeatherService(api_key="benchmark-fake-key")
+            service._fetch_weather_from_api = fake_fetch
+            api_calls = 0
+            calls = []
+            for c in range(cities):
+                city = f"Ciudad {c}"
+                for _ in range(requests_per_city):
+                    if coalesce:
+                        calls.append(lambda city=city: service.get_weather(city, "XX"))
+                    else:
+                        # Camino anterior de un fallo de cache: cada petición consulta la API y guarda
+                        calls.append(lambda city=city: service.cache._load(
+                            city, "XX", lambda: service._load_weather(city, "XX")))
+            latencies = await asyncio.gather(*(timed(call) for call in calls))
+            stats = service.cache.get_stats()
+        print(f"📊 {label}: llamadas a la API={api_calls} ({api_calls / cities:.0f} por ciudad), "
+              f"p50={percentile(latencies, 50) * 1000:.0f}ms, coalescidas={stats['coalesced_requests']}")
+
+
+SCENARIOS = {
+    "gemini-load": bench_gemini_load,
+    "gemini-coalescing": bench_gemini_coalescing,
+    "travel-stream": bench_travel_stream,
+    "travel-enrichment": bench_travel_enrichment,
+    "travel-answer-cache": bench_travel_answer_cache,
+    "prompt-budget": bench_prompt_budget,
+    "search-autocomplete": bench_search_autocomplete,
+    "gazetteer": bench_gazetteer,
+    "model-registry": bench_model_registry,
+    "conversation-store": bench_conversation_store,
+    "conversation-eviction": bench_conversation_eviction,
+    "conversation-memory": bench_conversation_memory,
+    "conversation-context": bench_conversation_context,
+    "session-lookup": bench_session_lookup,
+    "session-concurrency": bench_session_concurrency,
+    "destination-index": bench_destination_index,
+    "conversation-summary": bench_conversation_summary,
+    "snapshot-restore": bench_snapshot_restore,
+    "history-polling": bench_history_polling,
+    "http-pooling": bench_http_pooling,
+    "weather-swr": bench_weather_swr,
+    "weather-coalescing": bench_weather_coalescing,
+    "weather-cache-scale": bench_weather_cache_scale,
+    "circuit-breaker": bench_circuit_breaker,
+}
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(SCENARIOS)
+    for name in selected:
+        if name not in SCENARIOS:
+            print(f"❌ Escenario desconocido: {name}. Disponibles: {', '.join(SCENARIOS)}")
+            sys.exit(1)
+        asyncio.run(SCENARIOS[name]())
@@ -0,0 +1,230 @@
+"""
+Circuit breaker para las APIs externas (OpenWeatherMap, Unsplash).
+
+Un fallo puntual (timeout, 429) no desactiva el servicio hasta reiniciar el
+servidor: tras varios fallos se deja de llamar a la API durante un
+enfriamiento y después se vuelve a probar.
+
+Estados:
+- closed: las peticiones pasan; se cuentan éxitos y fallos en una ventana de tiempo
+- open: las peticiones se rechazan sin llamar a la API durante el enfriamiento
+- half_open: pasado el enfriamiento se deja pasar una sola petición de prueba;
+  si va bien el circuito se cierra y si falla se vuelve a abrir con el
+  enfriamiento duplicado (hasta un máximo)
+"""
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Optional, Tuple
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_COOLDOWN_SECONDS", "30"))
+DEFAULT_MAX_COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_MAX_COOLDOWN_SECONDS", "600"))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Interpreta la cabecera Retry-After (segundos o fecha HTTP).
+
+    Args:
+        value: Valor de la cabecera (None si no viene)
+
+    Returns:
+        Segundos de espera o None si no hay cabecera o no se entiende
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker con ventana de tasa de fallos, enfriamiento exponencial y
+    prueba en semiabierto.
+
+    El circuito se abre cuando en los últimos window_seconds hubo al menos
+    min_requests peticiones y la fracción de fallos llega a failure_rate, o
+    de inmediato con trip=True (401/403/429). Un 429 con Retry-After alarga
+    el enfriamiento hasta lo que pide la API.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, min_requests: int = 5,
+                 window_seconds: float = 60, cooldown_seconds: float = DEFAULT_COOLDOWN_SECONDS,
+                 max_cooldown_seconds: float = DEFAULT_MAX_COOLDOWN_SECONDS,
+                 probe_timeout_seconds: float = 30, max_transitions: int = 20):
+        """
+        Inicializa el circuit breaker (cerrado).
+
+        Args:
+            name: Nombre del upstream (para logs y estadísticas)
+            failure_rate: Fracción de fallos en la ventana que abre el circuito
+            min_requests: Peticiones mínimas en la ventana para evaluar la tasa
+            window_seconds: Duración de la ventana de fallos en segundos
+            cooldown_seconds: Enfriamiento tras la primera apertura
+            max_cooldown_seconds: Enfriamiento máximo tras aperturas consecutivas
+            probe_timeout_seconds: Tiempo tras el que una prueba sin resultado
+                deja pasar otra
+            max_transitions: Cambios de estado recientes que se conservan
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max(max_cooldown_seconds, cooldown_seconds)
+        self.probe_timeout_seconds = probe_timeout_seconds
+        self.state = CLOSED
+        self._window: Deque[Tuple[float, bool]] = deque()  # (monotonic, es_fallo)
+        self._window_failures = 0
+        self._consecutive_opens = 0
+        self._current_cooldown = 0.0
+        self._open_until = 0.0
+        self._probe_started_at: Optional[float] = None
+        self._transitions: Deque[Dict[str, Any]] = deque(maxlen=max_transitions)
+        self.opened = 0
+        self.rejected = 0
+        self.probes = 0
+
+    def _trim_window(self, now: float) -> None:
+        window = self._window
+        while window and now - window[0][0] > self.window_seconds:
+            _, failed = window.popleft()
+            self._window_failures -= failed
+
+    def _transition(self, state: str, reason: str) -> None:
+        self._transitions.append({
+            "from": self.state,
+            "to": state,
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "reason": reason
+        })
+        self.state = state
+
+    def _open(self, now: float, reason: str, retry_after: Optional[float] = None) -> None:
+        """Abre el circuito con el siguiente enfriamiento de la serie exponencial."""
+        cooldown = min(self.cooldown_seconds * (2 ** self._consecutive_opens), self.max_cooldown_seconds)
+        if retry_after is not None:
+            cooldown = max(cooldown, retry_after)
+        self._consecutive_opens += 1
+        self._current_cooldown = cooldown
+        self._open_until = now + cooldown
+        self._probe_started_at = None
+        self.opened += 1
+        self._transition(OPEN, reason)
+        print(f"🔴 Circuito de {self.name} abierto ({reason}); "
+              f"sin llamadas a la API durante {cooldown:.0f} seg")
+
+    def allow_request(self) -> bool:
+        """
+        Indica si se puede llamar a la API. Pasado el enfriamiento, deja pasar
+        una sola petición de prueba (semiabierto).
+
+        Returns:
+            True si la petición puede hacerse; después hay que llamar a
+            record_success o record_failure
+        """
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now < self._open_until:
+                self.rejected += 1
+                return False
+            self._transition(HALF_OPEN, "enfriamiento terminado")
+            print(f"🟡 Circuito de {self.name} semiabierto, se deja pasar una petición de prueba")
+        elif self._probe_started_at is not None and now - self._probe_started_at < self.probe_timeout_seconds:
+            self.rejected += 1
+            return False
+        self._probe_started_at = now
+        self.probes += 1
+        return True
+
+    def record_success(self) -> None:
+        """Registra una respuesta correcta de la API (cierra el circuito si estaba en prueba)."""
+        now = time.monotonic()
+        if self.state == OPEN:
+            return  # Respuesta de una petición anterior a la apertura
+        if self.state == HALF_OPEN:
+            self._window.clear()
+            self._window_failures = 0
+            self._consecutive_opens = 0
+            self._probe_started_at = None
+            self._transition(CLOSED, "prueba correcta")
+            print(f"🟢 Circuito de {self.name} cerrado, la API responde de nuevo")
+            return
+        self._window.append((now, False))
+        self._trim_window(now)
+
+    def record_failure(self, reason: str = "error", retry_after: Optional[float] = None, trip: bool = False) -> None:
+        """
+        Registra un fallo de la API.
+
+        Args:
+            reason: Motivo (para logs y estadísticas), p.ej. "timeout" o "HTTP 429"
+            retry_after: Segundos indicados por Retry-After, si los hay
+            trip: Abrir el circuito sin esperar a la tasa de fallos
+        """
+        now = time.monotonic()
+        if self.state == OPEN:
+            return
+        if self.state == HALF_OPEN:
+            self._open(now, f"prueba fallida: {reason}", retry_after)
+            return
+        self._window.append((now, True))
+        self._window_failures += 1
+        self._trim_window(now)
+        requests_in_window = len(self._window)
+        if trip or retry_after is not None:
+            self._open(now, reason, retry_after)
+        elif (requests_in_window >= self.min_requests
+              and self._window_failures / requests_in_window >= self.failure_rate):
+            self._open(now, f"{self._window_failures}/{requests_in_window} fallos en "
+                            f"{self.window_seconds:.0f} seg, último: {reason}")
+
+    def is_open(self) -> bool:
+        """True si el circuito rechaza peticiones ahora mismo (abierto y enfriando)."""
+        return self.state == OPEN and time.monotonic() < self._open_until
+
+    def retry_in(self) -> float:
+        """Segundos que faltan para la siguiente petición de prueba (0 si no está abierto)."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._open_until - time.monotonic())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Obtiene el estado del circuito.
+
+        Returns:
+            Diccionario con estado, ventana de fallos, enfriamiento y cambios de estado recientes
+        """
+        self._trim_window(time.monotonic())
+        requests_in_window = len(self._window)
+        return {
+            "state": self.state,
+            "window_requests": requests_in_window,
+            "window_failures": self._window_failures,
+            "failure_rate": round(self._window_failures / requests_in_window, 3) if requests_in_window else None,
+            "failure_rate_threshold": self.failure_rate,
+            "cooldown_seconds": self._current_cooldown if self.state != CLOSED else 0.0,
+            "retry_in_seconds": round(self.retry_in(), 1),
+            "times_opened": self.opened,
+            "rejected": self.rejected,
+            "probes": self.probes,
+            "transitions": list(self._transitions)
+        }
@@ -2,31 +2,100 @@
 Módulo para gestionar el historial de conversaciones.
 Permite mantener contexto entre múltiples preguntas del usuario.
 """
-from typing import List, Dict, Optional
+import asyncio
+import functools
+import marshal
+import os
+import re
+import time
+from struct import error as struct_error
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Iterable, Iterator, List, Dict, Any, Optional, Set, Tuple, Union
 from datetime import datetime
 import uuid
+from conversation_store import ConversationStore, create_conversation_store
+from conversation_snapshot import SnapshotReader, write_snapshot
+from prompt_builder import render_context_line, cap_summary, extractive_summary
+
+
+# Patrones de destinos en formato "Ciudad, País", en orden de prioridad
+_DESTINATION_PATTERNS = [
+    re.compile(r'viajar a\s+([A-ZÁÉÍÓÚÑ][a-záéíóúñ\s]+(?:,\s*[A-ZÁÉÍÓÚÑ][a-záéíóúñ\s]+)?)', re.IGNORECASE),
+    re.compile(r'destino[:\s]+([A-ZÁÉÍÓÚÑ][a-záéíóúñ\s]+(?:,\s*[A-ZÁÉÍÓÚÑ][a-záéíóúñ\s]+)?)', re.IGNORECASE),
+    re.compile(r'([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[a-záéíóúñ]+)*,\s*[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[a-záéíóúñ]+)*)', re.IGNORECASE),  # Formato "Ciudad, País"
+    # Respuestas JSON del asistente: "alojamiento": ["Hotel en Roma, Italia"]
+    re.compile(r'["\']([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[a-záéíóúñ]+)*,\s*[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[a-záéíóúñ]+)*)["\']', re.IGNORECASE),
+]
+
+
+def extract_destination(content: str) -> Optional[str]:
+    """
+    Extrae el destino mencionado en un mensaje (pregunta del usuario o
+    respuesta del asistente)
+    
+    Args:
+        content: Contenido del mensaje
+    
+    Returns:
+        Destino en formato "Ciudad, País" o None si no se encuentra
+    """
+    for pattern in _DESTINATION_PATTERNS:
+        for match in pattern.finditer(content):
+            destination = match.group(1).strip()
+            # Validar que parece un destino (tiene coma)
+            if ',' in destination:
+                return destination
+    return None
 
 
 class ConversationMessage:
-    """Representa un mensaje en la conversación"""
+    """
+    Representa un mensaje en la conversación.
+    
+    Usa __slots__ y guarda el timestamp como epoch (float) para ocupar poco
+    por mensaje. Los mensajes no cambian una vez creados, así que la línea
+    del historial para el prompt se renderiza al crearlo y el timestamp ISO y
+    el diccionario de to_dict se construyen la primera vez que se piden;
+    ninguno se recalcula después (no hay nada que invalidar).
+    """
     
-    def __init__(self, role: str, content: str, timestamp: Optional[datetime] = None):
+    __slots__ = ('role', 'content', 'timestamp', 'context_line', '_iso_timestamp', '_dict')
+    
+    def __init__(self, role: str, content: str, timestamp: Optional[Union[float, datetime]] = None):
         self.role = role  # 'user' o 'assistant'
         self.content = content
-        self.timestamp = timestamp or datetime.now()
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        self.timestamp = timestamp if timestamp is not None else time.time()  # epoch en segundos
+        self.context_line = render_context_line(role, content)  # "Usuario: ..." / "Alex: ..."
+        self._iso_timestamp: Optional[str] = None
+        self._dict: Optional[Dict] = None
+    
+    @property
+    def iso_timestamp(self) -> str:
+        """Timestamp en formato ISO (calculado una vez)"""
+        if self._iso_timestamp is None:
+            self._iso_timestamp = datetime.fromtimestamp(self.timestamp).isoformat()
+        return self._iso_timestamp
     
     def to_dict(self) -> Dict:
-        """Convierte el mensaje a diccionario"""
-        return {
-            'role': self.role,
-            'content': self.content,
-            'timestamp': self.timestamp.isoformat()
-        }
+        """
+        Convierte el mensaje a diccionario (construido una vez y compartido
+        entre llamadas: no debe modificarse)
+        """
+        if self._dict is None:
+            self._dict = {
+                'role': self.role,
+                'content': self.content,
+                'timestamp': self.iso_timestamp
+            }
+        return self._dict
     
     @classmethod
     def from_dict(cls, data: Dict) -> 'ConversationMessage':
         """Crea un mensaje desde un diccionario"""
-        timestamp = datetime.fromisoformat(data['timestamp']) if 'timestamp' in data else datetime.now()
+        timestamp = datetime.fromisoformat(data['timestamp']) if 'timestamp' in data else None
         return cls(
             role=data['role'],
             content=data['content'],
@@ -34,25 +103,596 @@ class ConversationMessage:
         )
 
 
+class MessageRing:
+    """
+    Buffer circular de tamaño fijo con los mensajes de una sesión.
+    
+    Al llenarse, cada mensaje nuevo sobrescribe el más antiguo sin copiar la
+    lista. Ocupa bastante menos que un deque (que reserva bloques de 64
+    posiciones), lo que importa con decenas de miles de sesiones.
+    
+    Cada mensaje tiene un índice que no cambia (0 para el primero de la
+    sesión, también después de clear()), usado como cursor por los clientes.
+    
+    Guarda también el último destino mencionado y el índice del mensaje que
+    lo contiene, para saber en O(1) si sigue dentro de la ventana, y cuántos
+    mensajes son del usuario.
+    """
+    
+    __slots__ = ('maxlen', '_items', '_start', '_appended', '_destination', '_destination_seq', '_user_messages')
+    
+    def __init__(self, maxlen: int, first_index: int = 0):
+        """
+        Args:
+            maxlen: Número máximo de mensajes
+            first_index: Índice del primer mensaje que se añada (al reconstruir una sesión)
+        """
+        self.maxlen = maxlen
+        self._items: List[ConversationMessage] = []
+        self._start = 0  # Posición del mensaje más antiguo cuando el buffer está lleno
+        self._appended = first_index  # Índice que tendrá el próximo mensaje
+        self._destination: Optional[str] = None
+        self._destination_seq = 0
+        self._user_messages = 0
+    
+    def append(self, message: ConversationMessage, destination: Optional[str] = None) -> None:
+        """
+        Añade un mensaje, descartando el más antiguo si el buffer está lleno.
+        
+        Args:
+            message: Mensaje a añadir
+            destination: Destino mencionado en el mensaje (ver extract_destination)
+        """
+        if len(self._items) < self.maxlen:
+            self._items.append(message)
+        else:
+            if self._items[self._start].role == 'user':
+                self._user_messages -= 1
+            self._items[self._start] = message
+            self._start = (self._start + 1) % self.maxlen
+        if message.role == 'user':
+            self._user_messages += 1
+        if destination:
+            self._destination = destination
+            self._destination_seq = self._appended
+        self._appended += 1
+    
+    def last_destination(self) -> Optional[str]:
+        """Último destino mencionado entre los mensajes que siguen en el buffer."""
+        if self._destination is None or self._destination_seq < self._appended - len(self._items):
+            return None
+        return self._destination
+    
+    def last_destination_age(self) -> Optional[int]:
+        """Mensajes añadidos después del que contiene el último destino (None si no hay)."""
+        if self.last_destination() is None:
+            return None
+        return self._appended - 1 - self._destination_seq
+    
+    @property
+    def first_index(self) -> int:
+        """Índice del mensaje más antiguo que sigue en el buffer."""
+        return self._appended - len(self._items)
+    
+    @property
+    def next_index(self) -> int:
+        """Índice que tendrá el próximo mensaje."""
+        return self._appended
+    
+    @property
+    def user_messages(self) -> int:
+        """Número de mensajes del usuario en el buffer."""
+        return self._user_messages
+    
+    def after(self, index: int, limit: Optional[int] = None) -> List[ConversationMessage]:
+        """
+        Devuelve los mensajes con índice mayor que index, en orden cronológico.
+        
+        Args:
+            index: Índice del último mensaje que ya tiene el cliente (-1 = ninguno)
+            limit: Número máximo de mensajes (None = todos)
+        
+        Returns:
+            Lista de mensajes; el primero tiene índice max(index + 1, first_index)
+        """
+        first = max(index + 1 - self.first_index, 0)
+        last = len(self._items) if limit is None else min(len(self._items), first + limit)
+        items = self._items
+        return [items[(self._start + position) % len(items)] for position in range(first, last)]
+    
+    def tail(self, count: int) -> List[ConversationMessage]:
+        """
+        Devuelve los últimos count mensajes en orden cronológico.
+        
+        Args:
+            count: Número de mensajes
+        
+        Returns:
+            Lista de mensajes (del más antiguo al más reciente)
+        """
+        items = self._items
+        if self._start:
+            items = items[self._start:] + items[:self._start]
+        return items[-count:] if count < len(items) else list(items)
+    
+    def from_end(self, offset: int) -> Optional[ConversationMessage]:
+        """
+        Devuelve el mensaje en la posición offset contando desde el final
+        (1 = el más reciente), o None si no hay tantos mensajes.
+        """
+        if offset < 1 or offset > len(self._items):
+            return None
+        return self._items[(self._start - offset) % len(self._items)]
+    
+    def clear(self) -> None:
+        """Elimina todos los mensajes (los índices siguen contando)."""
+        self._items = []
+        self._start = 0
+        self._destination = None
+        self._user_messages = 0
+    
+    def __len__(self) -> int:
+        return len(self._items)
+    
+    def __iter__(self) -> Iterator[ConversationMessage]:
+        items = self._items
+        for i in range(self._start, len(items)):
+            yield items[i]
+        for i in range(self._start):
+            yield items[i]
+
+
 class ConversationHistory:
-    """Gestiona el historial de conversaciones por sesión"""
+    """
+    Gestiona el historial de conversaciones por sesión.
+    
+    Sin store, el estado vive solo en memoria del proceso. Con un store
+    (ver conversation_store), cada cambio se escribe en él y la memoria actúa
+    como cache de lectura: cada petición revalida la sesión una vez al empezar
+    (prefetch) comparando su versión con la del store y solo la recarga si
+    otro proceso la modificó; los métodos síncronos nunca consultan el store,
+    solo la memoria. Las operaciones del store se ejecutan en orden en un hilo propio, sin bloquear el event loop;
+    flush espera a que terminen antes de responder. Sin store, la versión es un
+    contador del proceso; en ambos casos sirve de ETag del historial.
+    
+    Límites de memoria (0 = sin límite):
+    - Las sesiones sin actividad durante session_ttl_seconds expiran
+    - Como máximo max_sessions sesiones y max_bytes de contenido entre los tres
+      mapas; al superarlos se expulsan las sesiones usadas hace más tiempo (LRU)
+    - Las sesiones se mantienen ordenadas por último acceso, así que el barrido
+      de expiración solo mira las más antiguas (como mucho sweep_batch por
+      acceso) en lugar de recorrer todas
     
-    def __init__(self, max_messages: int = 20):
+    Resumen acumulado: los mensajes que salen de la ventana del prompt
+    (context_window) se acumulan y, cada summary_batch mensajes, una tarea en
+    segundo plano los incorpora al resumen de la sesión con el summarizer
+    configurado (Gemini en main.py; resumen local si no hay o si falla).
+    El resumen se limita a summary_max_chars y vive solo en memoria del proceso
+    (y en el snapshot). Limitación con store: no se guarda en él, así que cada
+    worker resume solo los mensajes que salen de la ventana en ese worker y
+    tras un reinicio el resumen empieza de cero.
+    
+    Snapshot (sin store): save_snapshot escribe todo el estado en un fichero
+    binario (ver conversation_snapshot) y load_snapshot carga solo su índice;
+    cada sesión se restaura la primera vez que se usa.
+    """
+    
+    def __init__(self, max_messages: int = 20, store: Optional[ConversationStore] = None,
+                 session_ttl_seconds: int = 0, max_sessions: int = 0, max_bytes: int = 0,
+                 sweep_batch: int = 100, context_window: int = 10, summary_max_chars: int = 0,
+                 summary_batch: int = 4,
+                 summarizer: Optional[Callable[[Optional[str], List[str]], Awaitable[str]]] = None):
         """
         Args:
             max_messages: Número máximo de mensajes a mantener por conversación
+            store: Backend persistente compartido (None = solo memoria)
+            session_ttl_seconds: Segundos sin actividad tras los que expira una sesión
+            max_sessions: Número máximo de sesiones en memoria
+            max_bytes: Tamaño máximo aproximado del contenido en memoria
+            sweep_batch: Máximo de sesiones expiradas que se eliminan por acceso
+            context_window: Mensajes recientes que se incluyen tal cual en el prompt
+            summary_max_chars: Tamaño máximo del resumen (0 = sin resumen)
+            summary_batch: Mensajes fuera de la ventana que disparan una actualización del resumen
+            summarizer: Corrutina (resumen anterior, líneas nuevas) → resumen nuevo
         """
-        self.conversations: Dict[str, List[ConversationMessage]] = {}
+        self.conversations: Dict[str, MessageRing] = {}  # Buffer circular por sesión
         self.current_destinations: Dict[str, str] = {}  # Rastrea el destino actual por sesión
         self.pending_confirmations: Dict[str, Dict] = {}  # Rastrea confirmaciones pendientes por sesión
         self.max_messages = max_messages
+        self.store = store
+        self._versions: Dict[str, int] = {}  # Versión del store cacheada por sesión (sin store, contador propio)
+        self._write_seq = 0  # Sin store: última versión asignada (no se repite dentro del proceso)
+        # Prefijo de las versiones: con store son compartidas entre workers; sin store, solo de este proceso
+        self.version_tag = "store" if store is not None else uuid.uuid4().hex[:8]
+        self.cache_reloads = 0
+        self._stale: Set[str] = set()  # Sesiones cuya memoria hay que recargar del store
+        self._pending_writes: Dict[str, int] = {}  # Escrituras en el store aún sin terminar
+        self._store_futures: Set[asyncio.Future] = set()
+        self._store_executor: Optional[ThreadPoolExecutor] = None
+        self.store_write_errors = 0
+        self.session_ttl_seconds = session_ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.sweep_batch = sweep_batch
+        self._last_access: 'OrderedDict[str, float]' = OrderedDict()  # Menos reciente primero
+        self._session_bytes: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.evictions_idle = 0
+        self.evictions_capacity = 0
+        self.store_expired = 0
+        self._next_store_sweep = 0.0
+        self.context_window = context_window
+        self.summary_max_chars = summary_max_chars
+        self.summary_batch = summary_batch
+        self.summarizer = summarizer
+        self.summaries: Dict[str, str] = {}
+        self._summary_pending: Dict[str, List[str]] = {}  # Líneas que salieron de la ventana, sin resumir
+        self._summary_generation: Dict[str, int] = {}  # Cambia al vaciar el historial
+        self._summary_tasks: Dict[str, asyncio.Task] = {}
+        self.summaries_generated = 0
+        self.summary_failures = 0
+        self._snapshot: Optional[SnapshotReader] = None
+        self.snapshot_restored = 0
+        self.snapshot_corrupt = 0
+    
+    def _session_size(self, session_id: str) -> int:
+        """Tamaño aproximado (caracteres) del estado de una sesión en los tres mapas."""
+        size = sum(len(msg.content) for msg in self.conversations.get(session_id, ()))
+        size += len(self.current_destinations.get(session_id) or '')
+        size += len(self.summaries.get(session_id, ''))
+        size += sum(len(line) for line in self._summary_pending.get(session_id, ()))
+        pending = self.pending_confirmations.get(session_id)
+        if pending:
+            size += sum(len(value) for value in pending.values() if isinstance(value, str))
+        return size
+    
+    def _touch(self, session_id: str, resized: bool = False) -> None:
+        """
+        Marca la sesión como usada ahora y aplica los límites de memoria.
+        
+        Args:
+            session_id: ID de la sesión
+            resized: True si la sesión cambió y hay que recalcular su tamaño
+        """
+        if (session_id not in self.conversations and session_id not in self.current_destinations
+                and session_id not in self.pending_confirmations):
+            return
+        now = time.time()
+        self._last_access[session_id] = now
+        self._last_access.move_to_end(session_id)
+        if resized:
+            size = self._session_size(session_id)
+            self.total_bytes += size - self._session_bytes.get(session_id, 0)
+            self._session_bytes[session_id] = size
+        self._sweep(now)
+    
+    def _sweep(self, now: float) -> None:
+        """
+        Expulsa sesiones expiradas y, si se superan los límites, las menos usadas.
+        La sesión usada más recientemente nunca se expulsa.
+        """
+        expired = 0
+        if self.session_ttl_seconds:
+            cutoff = now - self.session_ttl_seconds
+            while expired < self.sweep_batch and len(self._last_access) > 1:
+                session_id, last_access = next(iter(self._last_access.items()))
+                if last_access > cutoff:
+                    break
+                self._forget(session_id)
+                expired += 1
+            self.evictions_idle += expired
+            # En el store la expiración se hace como mucho una vez por minuto
+            if self.store is not None and now >= self._next_store_sweep:
+                self._next_store_sweep = now + 60
+                self._run_store(self._count_store_expired, self.store.expire_sessions, cutoff, self.sweep_batch)
+        
+        evicted = 0
+        while len(self._last_access) > 1 and (
+                (self.max_sessions and len(self._last_access) > self.max_sessions)
+                or (self.max_bytes and self.total_bytes > self.max_bytes)):
+            self._forget(next(iter(self._last_access)))
+            evicted += 1
+        self.evictions_capacity += evicted
+        
+        # Un resumen cada 1000 expulsiones (en régimen estable se expulsa una por acceso)
+        total = self.evictions_idle + self.evictions_capacity
+        if (expired or evicted) and total // 1000 != (total - expired - evicted) // 1000:
+            print(f"🧹 [HISTORY] Sesiones expulsadas de memoria: {self.evictions_idle} inactivas, "
+                  f"{self.evictions_capacity} por capacidad ({len(self._last_access)} activas, {self.total_bytes} bytes)")
+    
+    def _get_store_executor(self) -> ThreadPoolExecutor:
+        """Crea el hilo del store la primera vez que se necesita (uno solo: las operaciones van en orden)."""
+        if self._store_executor is None:
+            self._store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-store")
+        return self._store_executor
+    
+    def _run_store(self, on_done: Callable[[Any, Optional[BaseException]], None],
+                   method: Callable[..., Any], *args) -> None:
+        """
+        Ejecuta una operación del store en su hilo, sin bloquear el event loop,
+        y llama a on_done(resultado, error) en el event loop al terminar. Fuera
+        de un event loop (scripts) la ejecuta directamente.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            on_done(method(*args), None)
+            return
+        future = loop.run_in_executor(self._get_store_executor(), functools.partial(method, *args))
+        self._store_futures.add(future)
+        future.add_done_callback(functools.partial(self._store_done, on_done))
+    
+    def _store_done(self, on_done: Callable[[Any, Optional[BaseException]], None], future: asyncio.Future) -> None:
+        self._store_futures.discard(future)
+        if future.cancelled():
+            on_done(None, asyncio.CancelledError())
+        elif future.exception() is not None:
+            on_done(None, future.exception())
+        else:
+            on_done(future.result(), None)
+    
+    def _store_write(self, session_id: str, method: Callable[..., int], *args) -> None:
+        """Escribe un cambio de la sesión en el store y actualiza su versión al terminar."""
+        self._pending_writes[session_id] = self._pending_writes.get(session_id, 0) + 1
+        self._run_store(functools.partial(self._write_done, session_id), method, session_id, *args)
+    
+    def _write_done(self, session_id: str, new_version: Optional[int], error: Optional[BaseException]) -> None:
+        pending = self._pending_writes.pop(session_id, 1) - 1
+        if pending:
+            self._pending_writes[session_id] = pending
+        if error is not None:
+            self.store_write_errors += 1
+            print(f"❌ [HISTORY] Error al guardar la sesión {session_id} en el store: {error}")
+            self._mark_stale(session_id)
+            return
+        if (session_id in self.conversations or session_id in self.current_destinations
+                or session_id in self.pending_confirmations):
+            self._after_write(session_id, new_version)
+    
+    def _count_store_expired(self, expired: Optional[int], error: Optional[BaseException]) -> None:
+        if error is not None:
+            print(f"⚠️ [HISTORY] Error al expirar sesiones en el store: {error}")
+        else:
+            self.store_expired += expired
+    
+    def _log_store_error(self, result: Any, error: Optional[BaseException]) -> None:
+        if error is not None:
+            print(f"⚠️ [HISTORY] Error en el store: {error}")
+    
+    def _mark_stale(self, session_id: str) -> None:
+        """La memoria de la sesión ya no coincide con el store: recargarla en el próximo prefetch."""
+        self._stale.add(session_id)
+    
+    async def prefetch(self, session_id: Optional[str]) -> None:
+        """
+        Revalida una sesión contra el store en su hilo (y la recarga si otro
+        proceso la modificó). Se llama al empezar cada petición y antes de
+        registrar una respuesta que tardó en generarse; es la única lectura
+        del store, los accesos síncronos usan la memoria.
+        
+        Args:
+            session_id: ID de la sesión (None = nada que revalidar)
+        """
+        if self.store is None or not session_id or self._pending_writes.get(session_id):
+            return
+        cached_version = self._versions.get(session_id)
+        loop = asyncio.get_running_loop()
+        version = await loop.run_in_executor(self._get_store_executor(), self.store.get_version, session_id)
+        data = None
+        if version is not None and (session_id in self._stale or cached_version != version):
+            data = await loop.run_in_executor(self._get_store_executor(), self.store.load_session, session_id)
+            if data is None:
+                version = None
+        if self._pending_writes.get(session_id) or self._versions.get(session_id) != cached_version:
+            return  # Otra petición escribió mientras tanto: su versión es más reciente
+        if version is None:
+            self._forget(session_id)
+            return
+        if data is not None:
+            self._apply_loaded(session_id, data)
+    
+    async def flush(self) -> None:
+        """
+        Espera a que terminen las operaciones del store encoladas hasta ahora,
+        para que la siguiente petición (en este u otro worker) vea los cambios.
+        """
+        if self._store_futures:
+            await asyncio.gather(*self._store_futures, return_exceptions=True)
+    
+    def close(self) -> None:
+        """Espera a las operaciones pendientes del store y lo cierra."""
+        if self._store_executor is not None:
+            self._store_executor.shutdown(wait=True)
+            self._store_executor = None
+        if self.store is not None:
+            self.store.close()
+    
+    def _apply_loaded(self, session_id: str, data: Optional[Dict[str, Any]]) -> None:
+        """Sustituye la sesión en memoria por la cargada del store (None = ya no existe)."""
+        if data is None:
+            self._forget(session_id)
+            return
+        ring = MessageRing(self.max_messages, data['next_seq'] - len(data['messages']))
+        for m in data['messages']:
+            ring.append(ConversationMessage(m['role'], m['content'], m['timestamp']), extract_destination(m['content']))
+        self.conversations[session_id] = ring
+        if data['current_destination']:
+            self.current_destinations[session_id] = data['current_destination']
+        else:
+            self.current_destinations.pop(session_id, None)
+        pending = data['pending_confirmation']
+        if pending:
+            pending['timestamp'] = datetime.fromisoformat(pending['timestamp'])
+            self.pending_confirmations[session_id] = pending
+        else:
+            self.pending_confirmations.pop(session_id, None)
+        self._versions[session_id] = data['version']
+        self._stale.discard(session_id)
+        self.cache_reloads += 1
+        self._touch(session_id, resized=True)
+    
+    def _forget(self, session_id: str) -> None:
+        """Elimina una sesión de la memoria del proceso."""
+        self.conversations.pop(session_id, None)
+        self.current_destinations.pop(session_id, None)
+        self.pending_confirmations.pop(session_id, None)
+        self._versions.pop(session_id, None)
+        self._stale.discard(session_id)
+        self._last_access.pop(session_id, None)
+        self.total_bytes -= self._session_bytes.pop(session_id, 0)
+        self._reset_summary(session_id)
+        self._summary_generation.pop(session_id, None)
+        if self._snapshot is not None:
+            self._snapshot.discard(session_id)
+    
+    def _reset_summary(self, session_id: str) -> None:
+        """Descarta el resumen y las líneas pendientes (el historial se vació)."""
+        self.summaries.pop(session_id, None)
+        self._summary_pending.pop(session_id, None)
+        self._summary_generation[session_id] = self._summary_generation.get(session_id, 0) + 1
+    
+    def _queue_for_summary(self, session_id: str, message: ConversationMessage) -> None:
+        """Acumula un mensaje que salió de la ventana y lanza el resumen si hay suficientes."""
+        pending = self._summary_pending.setdefault(session_id, [])
+        pending.append(message.context_line)
+        if len(pending) < self.summary_batch or session_id in self._summary_tasks:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Sin event loop (scripts): resumen local en el momento
+            self.summaries[session_id] = extractive_summary(self.summaries.get(session_id), pending, self.summary_max_chars)
+            self._summary_pending.pop(session_id, None)
+            self.summaries_generated += 1
+            return
+        self._summary_tasks[session_id] = loop.create_task(self._update_summary(session_id))
+    
+    async def _update_summary(self, session_id: str) -> None:
+        """
+        Incorpora al resumen las líneas pendientes de una sesión (tarea en
+        segundo plano, fuera del camino de la petición).
+        """
+        try:
+            while len(self._summary_pending.get(session_id, ())) >= self.summary_batch:
+                generation = self._summary_generation.get(session_id, 0)
+                lines = list(self._summary_pending[session_id])
+                previous = self.summaries.get(session_id)
+                summary = None
+                if self.summarizer is not None:
+                    try:
+                        summary = await self.summarizer(previous, lines)
+                    except Exception as e:
+                        self.summary_failures += 1
+                        print(f"⚠️ [HISTORY] Error al resumir la conversación ({type(e).__name__}: {e}), se usa el resumen local")
+                if not summary:
+                    summary = extractive_summary(previous, lines, self.summary_max_chars)
+                
+                # El historial se vació o la sesión se expulsó mientras se resumía
+                if self._summary_generation.get(session_id, 0) != generation or session_id not in self._last_access:
+                    return
+                self.summaries[session_id] = cap_summary(summary, self.summary_max_chars)
+                del self._summary_pending[session_id][:len(lines)]
+                self.summaries_generated += 1
+                self._touch(session_id, resized=True)
+        finally:
+            self._summary_tasks.pop(session_id, None)
+    
+    def get_unsummarized_lines(self, session_id: str) -> List[str]:
+        """
+        Obtiene las líneas que ya salieron de la ventana del prompt pero aún no
+        se han incorporado al resumen (se resume cada summary_batch mensajes)
+        
+        Args:
+            session_id: ID de la sesión
+        
+        Returns:
+            Lista de líneas renderizadas, de la más antigua a la más reciente
+        """
+        self._refresh(session_id)
+        return list(self._summary_pending.get(session_id, ()))
+    
+    def get_summary(self, session_id: str) -> Optional[str]:
+        """
+        Obtiene el resumen de los turnos que ya salieron de la ventana del prompt
+        
+        Args:
+            session_id: ID de la sesión
+        
+        Returns:
+            Resumen en una línea o None si aún no hay
+        """
+        self._refresh(session_id)
+        self._touch(session_id)
+        return self.summaries.get(session_id)
+    
+    def _refresh(self, session_id: str) -> None:
+        """
+        Prepara la sesión antes de usarla: la restaura del snapshot o la
+        descarta si lleva inactiva más del TTL. Nunca consulta el store (puede
+        bloquear); la revalidación contra él la hace prefetch.
+        """
+        if self._snapshot is not None and session_id not in self._last_access and session_id in self._snapshot:
+            self._restore_from_snapshot(session_id)
+        last_access = self._last_access.get(session_id)
+        if (last_access is not None and self.session_ttl_seconds
+                and time.time() - last_access > self.session_ttl_seconds):
+            self._forget(session_id)
+            self.evictions_idle += 1
+    
+    def _after_write(self, session_id: str, new_version: Optional[int] = None) -> None:
+        """
+        Actualiza la versión cacheada tras escribir en el store. Si la versión
+        avanzó más de uno, otro proceso escribió en medio: la sesión se recarga
+        en el próximo acceso. Sin store (new_version None), asigna la siguiente versión del proceso.
+        """
+        if new_version is None:
+            self._write_seq += 1
+            self._versions[session_id] = self._write_seq
+            return
+        previous = self._versions.get(session_id)
+        if session_id in self._stale or (previous is not None and new_version != previous + 1):
+            self._mark_stale(session_id)
+        else:
+            self._versions[session_id] = new_version
     
     def create_session(self) -> str:
         """Crea una nueva sesión de conversación y devuelve su ID"""
         session_id = str(uuid.uuid4())
-        self.conversations[session_id] = []
+        self.conversations[session_id] = MessageRing(self.max_messages)
+        if self.store is not None:
+            self._store_write(session_id, self.store.create_session)
+        else:
+            self._after_write(session_id)
+        self._touch(session_id, resized=True)
         return session_id
     
+    def has_session(self, session_id: str) -> bool:
+        """
+        Indica si la sesión existe (O(1), sin recorrer todas las sesiones)
+        
+        Args:
+            session_id: ID de la sesión
+        
+        Returns:
+            True si la sesión existe y no ha expirado
+        """
+        self._refresh(session_id)
+        return session_id in self._last_access
+    
+    def get_or_create_session(self, session_id: Optional[str]) -> Tuple[str, bool]:
+        """
+        Devuelve la sesión indicada si existe o crea una nueva
+        
+        Args:
+            session_id: ID de la sesión enviado por el cliente (puede ser None)
+        
+        Returns:
+            Tupla (ID de la sesión a usar, True si se creó una sesión nueva)
+        """
+        if session_id and self.has_session(session_id):
+            return session_id, False
+        return self.create_session(), True
+    
     def add_message(self, session_id: str, role: str, content: str) -> None:
         """
         Añade un mensaje a la conversación
@@ -62,16 +702,25 @@ class ConversationHistory:
             role: 'user' o 'assistant'
             content: Contenido del mensaje
         """
+        self._refresh(session_id)
         if session_id not in self.conversations:
-            self.conversations[session_id] = []
+            self.conversations[session_id] = MessageRing(self.max_messages)
         
         message = ConversationMessage(role=role, content=content)
-        self.conversations[session_id].append(message)
+        ring = self.conversations[session_id]
+        # Mensaje que sale de la ventana del prompt con este nuevo mensaje
+        leaving = ring.from_end(self.context_window) if self.summary_max_chars else None
+        # El buffer circular descarta el mensaje más antiguo al superar max_messages
+        ring.append(message, extract_destination(content))
+        if leaving is not None:
+            self._queue_for_summary(session_id, leaving)
         
-        # Limitar el número de mensajes
-        if len(self.conversations[session_id]) > self.max_messages:
-            # Mantener los últimos max_messages mensajes
-            self.conversations[session_id] = self.conversations[session_id][-self.max_messages:]
+        if self.store is not None:
+            self._store_write(session_id, self.store.append_message,
+                              role, content, message.timestamp, self.max_messages)
+        else:
+            self._after_write(session_id)
+        self._touch(session_id, resized=True)
     
     def get_history(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
         """
@@ -82,16 +731,82 @@ class ConversationHistory:
             limit: Número máximo de mensajes a devolver (None = todos)
         
         Returns:
-            Lista de mensajes en formato diccionario
+            Lista de mensajes en formato diccionario (los de cada mensaje se
+            reutilizan entre llamadas: no deben modificarse)
         """
+        self._refresh(session_id)
         if session_id not in self.conversations:
             return []
         
+        self._touch(session_id)
         messages = self.conversations[session_id]
-        if limit:
-            messages = messages[-limit:]
+        return [msg.to_dict() for msg in messages.tail(limit or len(messages))]
+    
+    def get_history_page(self, session_id: str, after: Optional[int] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Obtiene los mensajes posteriores a un cursor (para no reenviar todo el
+        historial en cada consulta)
+        
+        Args:
+            session_id: ID de la sesión
+            after: Índice del último mensaje que ya tiene el cliente (None = desde el principio)
+            limit: Número máximo de mensajes a devolver (None = todos)
+        
+        Returns:
+            Diccionario con messages (cada uno con su index), next_after (cursor
+            para la siguiente consulta) y has_more (quedan mensajes tras el límite)
+        """
+        self._refresh(session_id)
+        ring = self.conversations.get(session_id)
+        if ring is None:
+            return {'messages': [], 'next_after': after, 'has_more': False}
+        
+        self._touch(session_id)
+        start = max(-1 if after is None else after, ring.first_index - 1)
+        messages = ring.after(start, limit)
+        page = [dict(msg.to_dict(), index=start + 1 + i) for i, msg in enumerate(messages)]
+        next_after = start + len(messages) if messages else after
+        return {
+            'messages': page,
+            'next_after': next_after,
+            'has_more': start + len(messages) < ring.next_index - 1
+        }
+    
+    def get_version(self, session_id: str) -> Optional[int]:
+        """
+        Obtiene la versión de una sesión, que cambia con cada modificación de su
+        historial (O(1), sin serializar nada)
+        
+        Args:
+            session_id: ID de la sesión
+        
+        Returns:
+            Versión de la sesión o None si no existe
+        """
+        self._refresh(session_id)
+        if session_id not in self._last_access:
+            return None
+        return self._versions.get(session_id)
+    
+    def get_context_lines(self, session_id: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Obtiene las líneas del historial ya renderizadas para el prompt
+        (se renderizan una vez al añadir cada mensaje)
+        
+        Args:
+            session_id: ID de la sesión
+            limit: Número máximo de mensajes a incluir (None = todos)
         
-        return [msg.to_dict() for msg in messages]
+        Returns:
+            Lista de líneas "Usuario: ..." / "Alex: ..." en orden cronológico
+        """
+        self._refresh(session_id)
+        if session_id not in self.conversations:
+            return []
+        
+        self._touch(session_id)
+        messages = self.conversations[session_id]
+        return [msg.context_line for msg in messages.tail(limit or len(messages))]
     
     def get_conversation_context(self, session_id: str, limit: Optional[int] = None) -> str:
         """
@@ -105,22 +820,13 @@ class ConversationHistory:
         Returns:
             String con el contexto formateado
         """
-        messages = self.get_history(session_id, limit)
-        
-        if not messages:
-            return ""
-        
-        context_parts = []
-        for msg in messages:
-            role_name = "Usuario" if msg['role'] == 'user' else "Alex"
-            context_parts.append(f"{role_name}: {msg['content']}")
-        
-        return "\n".join(context_parts)
+        return "\n".join(self.get_context_lines(session_id, limit))
     
     def extract_last_destination(self, session_id: str) -> Optional[str]:
         """
         Extrae el último destino mencionado en la conversación
         Busca tanto en preguntas del usuario como en respuestas del asistente
+        (los destinos se extraen una vez en add_message; la consulta es O(1))
         
         Args:
             session_id: ID de la sesión
@@ -128,71 +834,59 @@ class ConversationHistory:
         Returns:
             String con el destino o None si no se encuentra
         """
-        import re
-        messages = self.get_history(session_id)
-        
-        # Buscar en orden inverso (más reciente primero)
-        for msg in reversed(messages):
-            content = msg['content']
-            
-            # Buscar patrones comunes de destinos en formato "Ciudad, País"
-            patterns = [
-                r'viajar a\s+([A-ZÁÉÍÓÚÑ][a-záéíóúñ\s]+(?:,\s*[A-ZÁÉÍÓÚÑ][a-záéíóúñ\s]+)?)',
-                r'destino[:\s]+([A-ZÁÉÍÓÚÑ][a-záéíóúñ\s]+(?:,\s*[A-ZÁÉÍÓÚÑ][a-záéíóúñ\s]+)?)',
-                r'([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[a-záéíóúñ]+)*,\s*[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[a-záéíóúñ]+)*)',  # Formato "Ciudad, País"
-            ]
-            
-            for pattern in patterns:
-                matches = re.finditer(pattern, content, re.IGNORECASE)
-                for match in matches:
-                    destination = match.group(1).strip()
-                    # Validar que parece un destino (tiene coma)
-                    if ',' in destination:
-                        return destination
-            
-            # También buscar en respuestas del asistente que pueden contener el destino en el JSON
-            # Buscar en formato JSON: "alojamiento": ["Hotel en Roma, Italia"]
-            json_pattern = r'["\']([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[a-záéíóúñ]+)*,\s*[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[a-záéíóúñ]+)*)["\']'
-            json_matches = re.finditer(json_pattern, content, re.IGNORECASE)
-            for match in json_matches:
-                destination = match.group(1).strip()
-                if ',' in destination:
-                    return destination
-        
-        return None
+        self._refresh(session_id)
+        if session_id not in self.conversations:
+            return None
+        
+        self._touch(session_id)
+        return self.conversations[session_id].last_destination()
     
     def clear_session(self, session_id: str) -> None:
         """Limpia el historial de una sesión"""
+        self._refresh(session_id)
         if session_id in self.conversations:
-            self.conversations[session_id] = []
+            self.conversations[session_id].clear()
+            self._reset_summary(session_id)
+            if self.store is not None:
+                self._store_write(session_id, self.store.clear_messages)
+            else:
+                self._after_write(session_id)
+            self._touch(session_id, resized=True)
     
     def delete_session(self, session_id: str) -> None:
         """Elimina completamente una sesión"""
-        if session_id in self.conversations:
-            del self.conversations[session_id]
+        self._forget(session_id)
+        if self.store is not None:
+            self._run_store(self._log_store_error, self.store.delete_session, session_id)
     
     def get_all_sessions(self) -> List[str]:
         """Obtiene la lista de todos los IDs de sesión"""
-        return list(self.conversations.keys())
+        if self.store is not None:
+            return self.store.list_sessions()
+        self._sweep(time.time())
+        sessions = list(self.conversations.keys())
+        if self._snapshot is not None:
+            sessions.extend(self._snapshot.session_ids())
+        return sessions
     
     def get_session_stats(self, session_id: str) -> Dict:
         """Obtiene estadísticas de una sesión"""
+        self._refresh(session_id)
         if session_id not in self.conversations:
             return {
                 'exists': False,
                 'message_count': 0
             }
         
+        self._touch(session_id)
         messages = self.conversations[session_id]
-        user_messages = [m for m in messages if m.role == 'user']
-        assistant_messages = [m for m in messages if m.role == 'assistant']
         
         return {
             'exists': True,
             'message_count': len(messages),
-            'user_messages': len(user_messages),
-            'assistant_messages': len(assistant_messages),
-            'last_message': messages[-1].timestamp.isoformat() if messages else None
+            'user_messages': messages.user_messages,
+            'assistant_messages': len(messages) - messages.user_messages,
+            'last_message': messages.tail(1)[0].iso_timestamp if messages else None
         }
     
     def set_current_destination(self, session_id: str, destination: str, clear_history_on_change: bool = True) -> None:
@@ -204,11 +898,13 @@ class ConversationHistory:
             destination: Destino en formato "Ciudad, País"
             clear_history_on_change: Si True, limpia el historial si el destino cambia
         """
+        self._refresh(session_id)
         if session_id not in self.conversations:
-            self.conversations[session_id] = []
+            self.conversations[session_id] = MessageRing(self.max_messages)
         
         # Verificar si el destino está cambiando
         previous_destination = self.current_destinations.get(session_id)
+        history_cleared = False
         
         # Comparar destinos (normalizar para comparación)
         if previous_destination and clear_history_on_change:
@@ -218,9 +914,17 @@ class ConversationHistory:
                 # El destino cambió, limpiar el historial
                 print(f"🔄 [HISTORY] Destino cambió de '{previous_destination}' a '{destination}'")
                 print(f"🧹 [HISTORY] Limpiando historial de conversación para sesión {session_id}")
-                self.conversations[session_id] = []
+                self.conversations[session_id].clear()
+                self._reset_summary(session_id)
+                history_cleared = True
         
         self.current_destinations[session_id] = destination
+        if self.store is not None:
+            self._store_write(session_id, self.store.set_current_destination, destination, history_cleared)
+        elif history_cleared or session_id not in self._versions:
+            # También si la sesión se crea aquí: toda sesión necesita versión (ETag)
+            self._after_write(session_id)
+        self._touch(session_id, resized=True)
         print(f"📍 [HISTORY] Destino actual establecido para sesión {session_id}: {destination}")
     
     def get_current_destination(self, session_id: str) -> Optional[str]:
@@ -233,6 +937,8 @@ class ConversationHistory:
         Returns:
             String con el destino actual o None si no hay destino establecido
         """
+        self._refresh(session_id)
+        self._touch(session_id)
         return self.current_destinations.get(session_id)
     
     def clear_current_destination(self, session_id: str) -> None:
@@ -242,8 +948,12 @@ class ConversationHistory:
         Args:
             session_id: ID de la sesión
         """
+        self._refresh(session_id)
         if session_id in self.current_destinations:
             del self.current_destinations[session_id]
+            if self.store is not None:
+                self._store_write(session_id, self.store.set_current_destination, None)
+            self._touch(session_id, resized=True)
             print(f"🧹 [HISTORY] Destino actual limpiado para sesión {session_id}")
     
     def set_pending_confirmation(self, session_id: str, detected_destination: str, current_destination: str, original_question: str) -> None:
@@ -257,12 +967,20 @@ class ConversationHistory:
             original_question: Pregunta original que generó la confirmación
         """
         from datetime import datetime
+        self._refresh(session_id)
         self.pending_confirmations[session_id] = {
             'detected_destination': detected_destination,
             'current_destination': current_destination,
             'original_question': original_question,
             'timestamp': datetime.now()
         }
+        if self.store is not None:
+            stored = dict(self.pending_confirmations[session_id])
+            stored['timestamp'] = stored['timestamp'].isoformat()
+            self._store_write(session_id, self.store.set_pending_confirmation, stored)
+        elif session_id not in self._versions:
+            self._after_write(session_id)
+        self._touch(session_id, resized=True)
         print(f"⏳ [HISTORY] Confirmación pendiente establecida para sesión {session_id}: {detected_destination}")
     
     def get_pending_confirmation(self, session_id: str) -> Optional[Dict]:
@@ -275,6 +993,8 @@ class ConversationHistory:
         Returns:
             Diccionario con información de la confirmación pendiente o None
         """
+        self._refresh(session_id)
+        self._touch(session_id)
         return self.pending_confirmations.get(session_id)
     
     def clear_pending_confirmation(self, session_id: str) -> None:
@@ -284,11 +1004,187 @@ class ConversationHistory:
         Args:
             session_id: ID de la sesión
         """
+        self._refresh(session_id)
         if session_id in self.pending_confirmations:
             del self.pending_confirmations[session_id]
+            if self.store is not None:
+                self._store_write(session_id, self.store.set_pending_confirmation, None)
+            self._touch(session_id, resized=True)
             print(f"🧹 [HISTORY] Confirmación pendiente limpiada para sesión {session_id}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Obtiene estadísticas globales del historial en memoria.
+        
+        Returns:
+            Diccionario con sesiones activas, tamaño, límites y expulsiones
+        """
+        return {
+            "live_sessions": len(self._last_access),
+            "total_bytes": self.total_bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "session_ttl_seconds": self.session_ttl_seconds,
+            "evictions_idle": self.evictions_idle,
+            "evictions_capacity": self.evictions_capacity,
+            "store": type(self.store).__name__ if self.store is not None else "memory",
+            "store_expired": self.store_expired,
+            "store_pending_writes": sum(self._pending_writes.values()),
+            "store_write_errors": self.store_write_errors,
+            "cache_reloads": self.cache_reloads,
+            "summaries": len(self.summaries),
+            "summaries_generated": self.summaries_generated,
+            "summary_failures": self.summary_failures,
+            "summary_max_chars": self.summary_max_chars,
+            "snapshot_pending": len(self._snapshot) if self._snapshot is not None else 0,
+            "snapshot_restored": self.snapshot_restored,
+            "snapshot_corrupt": self.snapshot_corrupt
+        }
+    
+    def _snapshot_state(self, session_id: str) -> tuple:
+        """
+        Copia el estado de una sesión para el snapshot sin serializarlo: los
+        mensajes se copian por referencia (no se modifican una vez creados).
+        """
+        pending = self.pending_confirmations.get(session_id)
+        if pending:
+            pending = dict(pending)
+            pending['timestamp'] = pending['timestamp'].timestamp()
+        ring = self.conversations.get(session_id)
+        # El índice de destinos se guarda tal cual para no re-escanear los mensajes al restaurar
+        mentioned = (ring.last_destination(), ring.last_destination_age()) if ring is not None else (None, None)
+        return (
+            self.current_destinations.get(session_id),
+            pending,
+            self.summaries.get(session_id),
+            list(self._summary_pending.get(session_id, [])),
+            mentioned,
+            ring.first_index if ring is not None else 0,
+            tuple(ring) if ring is not None else ()
+        )
+    
+    @staticmethod
+    def _encode_snapshot(captured: List[Tuple[str, float, tuple]],
+                         raw: Iterable[Tuple[str, float, bytes]]) -> Iterator[Tuple[str, float, bytes]]:
+        """
+        Serializa con marshal las sesiones copiadas por snapshot_records y
+        después lee los registros aún no restaurados del snapshot anterior
+        (ambas cosas en el hilo que escribe).
+        """
+        for session_id, last_access, (*fields, messages) in captured:
+            record = (*fields, [(msg.role, msg.content, msg.timestamp) for msg in messages])
+            yield session_id, last_access, marshal.dumps(record)
+        yield from raw
+    
+    def snapshot_records(self) -> Iterator[Tuple[str, float, bytes]]:
+        """
+        Copia el estado de todas las sesiones (las cargadas y las del snapshot
+        anterior que aún no se han usado). Al llamarla, desde el event loop,
+        solo se copian las sesiones cargadas y las posiciones del índice del
+        snapshot anterior; la serialización y la lectura de sus registros
+        ocurren al recorrer el iterador, así que write_snapshot puede hacerlas
+        en otro hilo. Las sesiones restauradas entre medias se omiten (están
+        en memoria y entrarán en el siguiente snapshot).
+        
+        Returns:
+            Iterador de tuplas (session_id, último acceso epoch, registro)
+        """
+        captured = [(session_id, last_access, self._snapshot_state(session_id))
+                    for session_id, last_access in self._last_access.items()]
+        raw = (self._snapshot.iter_raw_records(self._snapshot.pending_entries())
+               if self._snapshot is not None else ())
+        return self._encode_snapshot(captured, raw)
+    
+    def save_snapshot(self, path: str) -> int:
+        """
+        Escribe un snapshot de todas las sesiones (de forma atómica).
+        
+        Args:
+            path: Ruta del snapshot
+        
+        Returns:
+            Número de sesiones guardadas
+        """
+        start = time.perf_counter()
+        count = write_snapshot(path, self.snapshot_records())
+        print(f"💾 [HISTORY] Snapshot guardado en {path}: {count} sesiones ({(time.perf_counter() - start) * 1000:.0f}ms)")
+        return count
+    
+    def load_snapshot(self, path: str) -> int:
+        """
+        Carga el índice de un snapshot; las sesiones se restauran al usarse.
+        
+        Args:
+            path: Ruta del snapshot
+        
+        Returns:
+            Número de sesiones disponibles en el snapshot (0 si no existe o no es válido)
+        """
+        if not os.path.exists(path):
+            print(f"ℹ️  [HISTORY] Sin snapshot previo en {path}")
+            return 0
+        start = time.perf_counter()
+        try:
+            reader = SnapshotReader(path)
+        except (OSError, ValueError, EOFError, struct_error) as e:
+            print(f"⚠️ [HISTORY] Snapshot {path} no válido ({type(e).__name__}: {e}), se ignora")
+            return 0
+        self.close_snapshot()
+        self._snapshot = reader
+        print(f"💾 [HISTORY] Snapshot cargado de {path}: {len(reader)} sesiones "
+              f"({(time.perf_counter() - start) * 1000:.0f}ms, se restauran al usarse)")
+        return len(reader)
+    
+    def close_snapshot(self) -> None:
+        """Cierra el snapshot cargado (las sesiones no restauradas se descartan)."""
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+    
+    def _restore_from_snapshot(self, session_id: str) -> None:
+        """
+        Restaura una sesión del snapshot en memoria (si no expiró mientras tanto).
+        Un registro corrupto se descarta: la sesión se trata como inexistente.
+        """
+        try:
+            last_access, record = self._snapshot.pop(session_id)
+            destination, pending, summary, summary_pending, (mentioned, mentioned_age), first_index, messages = record
+            if self.session_ttl_seconds and time.time() - last_access > self.session_ttl_seconds:
+                self.evictions_idle += 1
+                return
+            ring = MessageRing(self.max_messages, first_index)
+            mentioned_at = len(messages) - 1 - mentioned_age if mentioned is not None else -1
+            for i, (role, content, timestamp) in enumerate(messages):
+                ring.append(ConversationMessage(role, content, timestamp), mentioned if i == mentioned_at else None)
+            if pending:
+                pending['timestamp'] = datetime.fromtimestamp(pending['timestamp'])
+        except (ValueError, EOFError, TypeError, KeyError, OverflowError) as e:
+            self.snapshot_corrupt += 1
+            print(f"⚠️ [HISTORY] Registro del snapshot no válido para la sesión {session_id} "
+                  f"({type(e).__name__}: {e}), se descarta")
+            return
+        self.conversations[session_id] = ring
+        if destination:
+            self.current_destinations[session_id] = destination
+        if pending:
+            self.pending_confirmations[session_id] = pending
+        if summary:
+            self.summaries[session_id] = summary
+        if summary_pending:
+            self._summary_pending[session_id] = summary_pending
+        self.snapshot_restored += 1
+        self._after_write(session_id)
+        self._touch(session_id, resized=True)
 
 
 # Instancia global del historial de conversaciones
-conversation_history = ConversationHistory(max_messages=20)
+# (backend configurable con CONVERSATION_STORE, ver conversation_store)
+conversation_history = ConversationHistory(
+    max_messages=20,
+    store=create_conversation_store(),
+    session_ttl_seconds=int(os.getenv("CONVERSATION_SESSION_TTL_SECONDS", "86400")),
+    max_sessions=int(os.getenv("CONVERSATION_MAX_SESSIONS", "10000")),
+    max_bytes=int(os.getenv("CONVERSATION_MAX_BYTES", str(64 * 1024 * 1024))),
+    summary_max_chars=int(os.getenv("CONVERSATION_SUMMARY_MAX_CHARS", "600"))
+)
 
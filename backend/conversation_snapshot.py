@@ -0,0 +1,159 @@
+"""
+Snapshot binario del historial de conversaciones en memoria.
+
+Permite conservar las sesiones entre reinicios (p.ej. redeploys) cuando no se
+usa un store persistente (ver conversation_store).
+
+Formato del fichero:
+- Cabecera: magic, posición y tamaño del índice
+- Datos: un registro marshal por sesión, uno detrás de otro
+- Índice (al final): marshal de {session_id: (posición, tamaño, último acceso)}
+
+Al arrancar solo se lee el índice; cada sesión se decodifica la primera vez
+que se usa.
+"""
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+SNAPSHOT_MAGIC = b"VIAJEIA\x01"
+_HEADER = struct.Struct("<8sQQ")  # magic, posición del índice, tamaño del índice
+
+
+def write_snapshot(path: str, records: Iterable[Tuple[str, float, bytes]]) -> int:
+    """
+    Escribe un snapshot de forma atómica: un fichero temporal con nombre
+    único en el mismo directorio (el guardado periódico y el del apagado no se
+    pisan) que luego sustituye al snapshot con os.replace.
+
+    Args:
+        path: Ruta del snapshot
+        records: Tuplas (session_id, último acceso epoch, registro marshal)
+
+    Returns:
+        Número de sesiones escritas
+    """
+    index: Dict[str, Tuple[int, int, float]] = {}
+    directory, name = os.path.split(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=f"{name}.", suffix=".tmp", delete=False) as f:
+        try:
+            f.write(_HEADER.pack(SNAPSHOT_MAGIC, 0, 0))
+            offset = _HEADER.size
+            for session_id, last_access, data in records:
+                f.write(data)
+                index[session_id] = (offset, len(data), last_access)
+                offset += len(data)
+            index_data = marshal.dumps(index)
+            f.write(index_data)
+            f.seek(0)
+            f.write(_HEADER.pack(SNAPSHOT_MAGIC, offset, len(index_data)))
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    try:
+        os.replace(f.name, path)
+    except OSError:
+        os.unlink(f.name)
+        raise
+    return len(index)
+
+
+class SnapshotReader:
+    """
+    Lee un snapshot de forma perezosa: el índice se carga al abrirlo y cada
+    sesión se decodifica (desde un mmap del fichero) solo cuando se pide.
+    """
+
+    def __init__(self, path: str):
+        """
+        Abre el snapshot y carga su índice.
+
+        Args:
+            path: Ruta del snapshot
+
+        Raises:
+            ValueError: Si el fichero no es un snapshot válido
+        """
+        self.path = path
+        # El guardado periódico lee registros desde otro hilo: no cerrar el mmap a mitad
+        self._lock = threading.Lock()
+        self._closed = False
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, index_offset, index_length = _HEADER.unpack_from(self._mm, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} no es un snapshot de conversaciones")
+            self._index: Dict[str, Tuple[int, int, float]] = marshal.loads(
+                self._mm[index_offset:index_offset + index_length]
+            )
+        except Exception:
+            self._file.close()
+            raise
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def session_ids(self) -> List[str]:
+        """IDs de las sesiones que aún no se han cargado."""
+        return list(self._index)
+
+    def pending_entries(self) -> List[Tuple[str, Tuple[int, int, float]]]:
+        """Copia del índice (solo posiciones, sin datos) de las sesiones aún no cargadas."""
+        return list(self._index.items())
+
+    def iter_raw_records(self, entries: List[Tuple[str, Tuple[int, int, float]]]) -> Iterator[Tuple[str, float, bytes]]:
+        """
+        Lee tal cual, al recorrerlo, los registros de las entradas indicadas
+        (ver pending_entries) que sigan sin cargarse, para volver a escribirlos
+        en otro snapshot. Puede recorrerse desde otro hilo.
+
+        Raises:
+            ValueError: Si el snapshot se cierra mientras se recorre
+        """
+        for session_id, (offset, length, last_access) in entries:
+            with self._lock:
+                if self._closed:
+                    raise ValueError(f"el snapshot {self.path} se cerró mientras se copiaba")
+                if session_id not in self._index:
+                    continue  # Restaurada desde que se copió el índice
+                data = self._mm[offset:offset + length]
+            yield session_id, last_access, data
+
+    def pop(self, session_id: str) -> Optional[Tuple[float, tuple]]:
+        """
+        Decodifica una sesión y la quita del índice.
+
+        Args:
+            session_id: ID de la sesión
+
+        Returns:
+            Tupla (último acceso epoch, registro) o None si no está en el snapshot
+        """
+        entry = self._index.pop(session_id, None)
+        if entry is None:
+            return None
+        offset, length, last_access = entry
+        return last_access, marshal.loads(self._mm[offset:offset + length])
+
+    def discard(self, session_id: str) -> None:
+        """Olvida una sesión del snapshot sin decodificarla."""
+        self._index.pop(session_id, None)
+
+    def close(self) -> None:
+        """Cierra el fichero."""
+        with self._lock:
+            self._closed = True
+            self._mm.close()
+            self._file.close()
@@ -0,0 +1,253 @@
+"""
+Almacenamiento persistente del historial de conversaciones.
+
+ConversationHistory mantiene siempre el estado en memoria; si se le pasa un
+store, además escribe cada cambio en él y lo usa como fuente de verdad
+compartida entre procesos (p.ej. uvicorn --workers N).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Optional
+
+
+class ConversationStore(ABC):
+    """
+    Interfaz de un backend de almacenamiento de conversaciones.
+
+    Cada sesión tiene un número de versión que se incrementa en cada cambio.
+    Los métodos que modifican una sesión devuelven la nueva versión; así el
+    cache en memoria de cada proceso sabe si otro proceso la modificó.
+    """
+
+    @abstractmethod
+    def get_version(self, session_id: str) -> Optional[int]:
+        """Devuelve la versión de la sesión o None si no existe."""
+
+    @abstractmethod
+    def load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Carga una sesión completa.
+
+        Returns:
+            Diccionario con version, messages (role, content, timestamp epoch),
+            next_seq (índice del próximo mensaje), current_destination y
+            pending_confirmation, o None si no existe
+        """
+
+    @abstractmethod
+    def create_session(self, session_id: str) -> int:
+        """Crea una sesión vacía (si no existe) y devuelve su versión."""
+
+    @abstractmethod
+    def append_message(self, session_id: str, role: str, content: str, timestamp: float, max_messages: int) -> int:
+        """Añade un mensaje conservando solo los últimos max_messages."""
+
+    @abstractmethod
+    def clear_messages(self, session_id: str) -> int:
+        """Elimina los mensajes de la sesión (conserva destino y confirmación)."""
+
+    @abstractmethod
+    def set_current_destination(self, session_id: str, destination: Optional[str], clear_messages: bool = False) -> int:
+        """Establece (o limpia con None) el destino actual, opcionalmente vaciando el historial."""
+
+    @abstractmethod
+    def set_pending_confirmation(self, session_id: str, confirmation: Optional[Dict[str, Any]]) -> int:
+        """Establece (o limpia con None) la confirmación pendiente."""
+
+    @abstractmethod
+    def delete_session(self, session_id: str) -> None:
+        """Elimina la sesión y sus mensajes."""
+
+    @abstractmethod
+    def list_sessions(self) -> List[str]:
+        """Devuelve los IDs de todas las sesiones."""
+
+    @abstractmethod
+    def expire_sessions(self, idle_before: float, limit: int) -> int:
+        """
+        Elimina hasta limit sesiones sin cambios desde idle_before (epoch).
+
+        Returns:
+            Número de sesiones eliminadas
+        """
+
+    def close(self) -> None:
+        """Libera los recursos del backend."""
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Backend SQLite en modo WAL: varios procesos del mismo host pueden leer y
+    escribir la misma base de datos (los lectores no bloquean al escritor).
+    """
+
+    def __init__(self, path: str):
+        """
+        Abre (o crea) la base de datos.
+
+        Args:
+            path: Ruta del fichero SQLite
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                current_destination TEXT,
+                pending_confirmation TEXT,
+                version INTEGER NOT NULL DEFAULT 0,
+                next_seq INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at);
+        """)
+        print(f"💾 Historial de conversaciones en SQLite (WAL): {path}")
+
+    def _write(self, session_id: str, statements) -> int:
+        """
+        Ejecuta sentencias en una transacción que crea la sesión si no existe
+        e incrementa su versión.
+        """
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute(
+                    "INSERT OR IGNORE INTO sessions (session_id, updated_at) VALUES (?, ?)",
+                    (session_id, time.time())
+                )
+                for sql, params in statements:
+                    cursor.execute(sql, params)
+                cursor.execute(
+                    "UPDATE sessions SET version = version + 1, updated_at = ? WHERE session_id = ?",
+                    (time.time(), session_id)
+                )
+                version = cursor.execute(
+                    "SELECT version FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()[0]
+                cursor.execute("COMMIT")
+                return version
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def get_version(self, session_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                row = cursor.execute(
+                    "SELECT version, current_destination, pending_confirmation, next_seq FROM sessions WHERE session_id = ?",
+                    (session_id,)
+                ).fetchone()
+                messages = cursor.execute(
+                    "SELECT role, content, timestamp FROM messages WHERE session_id = ? ORDER BY seq",
+                    (session_id,)
+                ).fetchall() if row else []
+            finally:
+                cursor.execute("COMMIT")
+        if not row:
+            return None
+        return {
+            "version": row[0],
+            "current_destination": row[1],
+            "pending_confirmation": json.loads(row[2]) if row[2] else None,
+            "messages": [{"role": r, "content": c, "timestamp": t} for r, c, t in messages],
+            "next_seq": row[3],
+        }
+
+    def create_session(self, session_id: str) -> int:
+        return self._write(session_id, [])
+
+    def append_message(self, session_id: str, role: str, content: str, timestamp: float, max_messages: int) -> int:
+        return self._write(session_id, [
+            ("INSERT INTO messages (session_id, seq, role, content, timestamp) "
+             "SELECT ?, next_seq, ?, ?, ? FROM sessions WHERE session_id = ?",
+             (session_id, role, content, timestamp, session_id)),
+            ("UPDATE sessions SET next_seq = next_seq + 1 WHERE session_id = ?", (session_id,)),
+            # Mantener solo los últimos max_messages mensajes
+            ("DELETE FROM messages WHERE session_id = ? AND seq < "
+             "(SELECT next_seq FROM sessions WHERE session_id = ?) - ?",
+             (session_id, session_id, max_messages)),
+        ])
+
+    def clear_messages(self, session_id: str) -> int:
+        return self._write(session_id, [
+            ("DELETE FROM messages WHERE session_id = ?", (session_id,)),
+        ])
+
+    def set_current_destination(self, session_id: str, destination: Optional[str], clear_messages: bool = False) -> int:
+        statements = [
+            ("UPDATE sessions SET current_destination = ? WHERE session_id = ?", (destination, session_id)),
+        ]
+        if clear_messages:
+            statements.append(("DELETE FROM messages WHERE session_id = ?", (session_id,)))
+        return self._write(session_id, statements)
+
+    def set_pending_confirmation(self, session_id: str, confirmation: Optional[Dict[str, Any]]) -> int:
+        payload = json.dumps(confirmation, ensure_ascii=False) if confirmation is not None else None
+        return self._write(session_id, [
+            ("UPDATE sessions SET pending_confirmation = ? WHERE session_id = ?", (payload, session_id)),
+        ])
+
+    def delete_session(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def list_sessions(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT session_id FROM sessions")]
+
+    def expire_sessions(self, idle_before: float, limit: int) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM sessions WHERE session_id IN "
+                "(SELECT session_id FROM sessions WHERE updated_at < ? ORDER BY updated_at LIMIT ?)",
+                (idle_before, limit)
+            )
+            return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_conversation_store() -> Optional[ConversationStore]:
+    """
+    Crea el backend configurado en CONVERSATION_STORE.
+
+    - "memory" (por defecto): sin persistencia, solo memoria del proceso
+    - "sqlite": SQLite WAL en CONVERSATION_SQLITE_PATH (default: conversations.db)
+
+    Returns:
+        Instancia del backend o None para usar solo memoria
+    """
+    backend = os.getenv("CONVERSATION_STORE", "memory").lower()
+    if backend == "sqlite":
+        return SQLiteConversationStore(os.getenv("CONVERSATION_SQLITE_PATH", "conversations.db"))
+    if backend != "memory":
+        print(f"⚠️ CONVERSATION_STORE desconocido '{backend}', usando memoria")
+    return None
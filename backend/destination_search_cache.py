@@ -0,0 +1,223 @@
+"""
+Cache con conocimiento de prefijos para el autocompletado de destinos.
+"""
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normaliza una búsqueda para usarla como clave (minúsculas, sin tildes,
+    espacios colapsados).
+
+    Args:
+        query: Texto escrito por el usuario
+
+    Returns:
+        Texto normalizado
+    """
+    decomposed = unicodedata.normalize('NFD', query.lower())
+    without_accents = ''.join(c for c in decomposed if unicodedata.category(c) != 'Mn')
+    return ' '.join(without_accents.split())
+
+
+class _SearchEntry:
+    """Resultado cacheado de una búsqueda."""
+
+    __slots__ = ('query', 'results', 'normalized_results', 'cached_at')
+
+    def __init__(self, query: str, results: List[str]):
+        self.query = query
+        self.results = results
+        self.normalized_results = [normalize_query(r) for r in results]
+        self.cached_at = time.time()
+
+
+class _TrieNode:
+    """Nodo del trie de búsquedas normalizadas."""
+
+    __slots__ = ('children', 'entry')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.entry: Optional[_SearchEntry] = None
+
+
+class DestinationSearchCache:
+    """
+    Cache en memoria para /api/destinations/search.
+
+    El autocompletado envía una petición por tecla ("bar" → "barc" → "barce").
+    Las búsquedas se guardan en un trie; una búsqueda más larga se responde
+    filtrando los resultados de un prefijo ya cacheado solo si el filtrado
+    sigue teniendo max_results destinos (una lista llena). Que Gemini devuelva
+    menos resultados para "san" no significa que "sant" no tenga otros, así
+    que una lista corta o vacía tras filtrar es un fallo y se consulta a Gemini.
+
+    Las búsquedas sin resultados también se cachean (cache negativo), pero
+    solo responden a esa misma búsqueda, nunca a las más largas.
+    El tamaño está acotado con expulsión LRU y cada entrada tiene TTL.
+    """
+
+    def __init__(self, max_entries: int = 2000, ttl_seconds: int = 21600, max_results: int = 5):
+        """
+        Inicializa el cache.
+
+        Args:
+            max_entries: Número máximo de búsquedas cacheadas
+            ttl_seconds: Tiempo de vida de cada búsqueda en segundos (default: 6 horas)
+            max_results: Número máximo de destinos que devuelve una búsqueda
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_results = max_results
+        self._root = _TrieNode()
+        self._lru: 'OrderedDict[str, _SearchEntry]' = OrderedDict()
+        self.exact_hits = 0
+        self.prefix_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        print(f"📦 Cache de búsqueda de destinos inicializado ({max_entries} entradas, TTL de {ttl_seconds // 60} minutos)")
+
+    def _is_expired(self, entry: _SearchEntry, now: float) -> bool:
+        return now - entry.cached_at > self.ttl_seconds
+
+    def _remove(self, key: str) -> None:
+        """Elimina una búsqueda del trie y del LRU, podando nodos vacíos."""
+        self._lru.pop(key, None)
+        path = [self._root]
+        node = self._root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return
+            path.append(node)
+        node.entry = None
+        # Podar nodos sin entrada ni hijos desde la hoja hacia la raíz
+        for i in range(len(key), 0, -1):
+            child = path[i]
+            if child.entry is not None or child.children:
+                break
+            del path[i - 1].children[key[i - 1]]
+
+    def _filter(self, entry: _SearchEntry, normalized: str) -> List[str]:
+        """Filtra los resultados de un prefijo por la búsqueda más larga."""
+        return [
+            result for result, norm in zip(entry.results, entry.normalized_results)
+            if normalized in norm
+        ]
+
+    def get(self, query: str) -> Optional[List[str]]:
+        """
+        Busca resultados para una búsqueda, directamente o a partir de un prefijo.
+
+        Args:
+            query: Texto escrito por el usuario
+
+        Returns:
+            Lista de destinos (puede estar vacía si es un resultado negativo)
+            o None si hay que consultar a Gemini
+        """
+        normalized = normalize_query(query)
+        if not normalized:
+            return None
+
+        now = time.time()
+        # Recorrer el trie guardando las entradas de los prefijos encontrados
+        prefix_entries: List[_SearchEntry] = []
+        node = self._root
+        for char in normalized:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.entry is not None:
+                prefix_entries.append(node.entry)
+
+        # Del prefijo más largo al más corto
+        for entry in reversed(prefix_entries):
+            if self._is_expired(entry, now):
+                self._remove(entry.query)
+                continue
+
+            if entry.query == normalized:
+                self._lru.move_to_end(entry.query)
+                self.exact_hits += 1
+                if entry.results:
+                    print(f"📦 Cache HIT para búsqueda '{query}'")
+                else:
+                    self.negative_hits += 1
+                    print(f"📦 Cache HIT (sin resultados) para búsqueda '{query}'")
+                return list(entry.results)
+
+            filtered = self._filter(entry, normalized)
+            if len(filtered) >= self.max_results:
+                self._lru.move_to_end(entry.query)
+                self.prefix_hits += 1
+                print(f"📦 Cache HIT por prefijo '{entry.query}' para búsqueda '{query}' ({len(filtered)} resultados)")
+                return filtered[:self.max_results]
+
+        self.misses += 1
+        print(f"📦 Cache MISS para búsqueda '{query}'")
+        return None
+
+    def set(self, query: str, results: List[str]) -> None:
+        """
+        Guarda los resultados de una búsqueda (lista vacía = resultado negativo).
+
+        Args:
+            query: Texto escrito por el usuario
+            results: Destinos devueltos por Gemini
+        """
+        normalized = normalize_query(query)
+        if not normalized:
+            return
+
+        results = list(results[:self.max_results])
+        entry = _SearchEntry(normalized, results)
+
+        node = self._root
+        for char in normalized:
+            node = node.children.setdefault(char, _TrieNode())
+        node.entry = entry
+        self._lru[normalized] = entry
+        self._lru.move_to_end(normalized)
+
+        # Expulsar las búsquedas menos usadas recientemente
+        while len(self._lru) > self.max_entries:
+            oldest_key = next(iter(self._lru))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """
+        Limpia todo el cache.
+        """
+        count = len(self._lru)
+        self._root = _TrieNode()
+        self._lru.clear()
+        print(f"🗑️  Cache de búsqueda de destinos limpiado ({count} entradas eliminadas)")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Obtiene estadísticas del cache.
+
+        Returns:
+            Diccionario con estadísticas del cache
+        """
+        hits = self.exact_hits + self.prefix_hits
+        total = hits + self.misses
+        return {
+            "total_entries": len(self._lru),
+            "max_entries": self.max_entries,
+            "exact_hits": self.exact_hits,
+            "prefix_hits": self.prefix_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(hits / total, 3) if total else None,
+            "ttl_seconds": self.ttl_seconds,
+            "ttl_minutes": self.ttl_seconds // 60
+        }
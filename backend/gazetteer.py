@@ -0,0 +1,165 @@
+"""
+Índice local de ciudades y países para el autocompletado de destinos.
+"""
+import heapq
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+from destination_search_cache import normalize_query
+
+
+GAZETTEER_PATH = Path(__file__).parent / "data" / "cities.tsv"
+
+
+class Gazetteer:
+    """
+    Gazetteer embebido (data/cities.tsv) con nombres en español e inglés.
+
+    Índice de prefijos compacto:
+    - Las ciudades se ordenan por población; su posición es su ranking
+    - Cada nombre normalizado (ciudad y país, en ambos idiomas, y cada palabra
+      a partir de la que empieza, p.ej. "york" para "Nueva York") se guarda en
+      una lista ordenada junto al ranking de la ciudad
+    - Una búsqueda es un bisect al primer nombre con el prefijo y un recorrido
+      del rango contiguo; se devuelven las ciudades de menor ranking
+    """
+
+    def __init__(self, path: Path = GAZETTEER_PATH, max_results: int = 5):
+        """
+        Carga el dataset y construye el índice.
+
+        Args:
+            path: Ruta del fichero TSV con las ciudades
+            max_results: Número máximo de destinos que devuelve una búsqueda
+        """
+        self.path = path
+        self.max_results = max_results
+        self._labels: List[str] = []  # "Ciudad, País" en español, por ranking
+        self._iso_codes: List[str] = []  # Código ISO del país, por ranking
+        self._city_ranks: Dict[str, List[int]] = {}  # Nombre de ciudad normalizado → rankings
+        self._keys: List[str] = []  # Nombres normalizados ordenados
+        self._ranks: List[int] = []  # Ranking de la ciudad de cada nombre
+        self._country_codes: Dict[str, str] = {}
+        self.searches = 0
+        self.hits = 0
+        self._load()
+        print(f"🗺️  Gazetteer cargado ({len(self._labels)} ciudades, {len(self._country_codes)} nombres de países)")
+
+    def _load(self) -> None:
+        """Lee el TSV y construye el índice de prefijos."""
+        if not self.path.exists():
+            print(f"⚠️ Gazetteer no encontrado en {self.path}, el autocompletado usará solo Gemini")
+            return
+
+        rows = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            header = None
+            for line in f:
+                line = line.rstrip('\n')
+                if not line.strip() or line.startswith('#'):
+                    continue
+                fields = line.split('\t')
+                if header is None:
+                    header = fields
+                    continue
+                rows.append(dict(zip(header, fields)))
+
+        rows.sort(key=lambda row: int(row["poblacion"]), reverse=True)
+
+        entries = []
+        for rank, row in enumerate(rows):
+            self._labels.append(f"{row['ciudad_es']}, {row['pais_es']}")
+            self._iso_codes.append(row["iso"])
+            for city in {normalize_query(row["ciudad_es"]), normalize_query(row["ciudad_en"])}:
+                self._city_ranks.setdefault(city, []).append(rank)
+            names = {row["ciudad_es"], row["ciudad_en"], row["pais_es"], row["pais_en"]}
+            keys = set()
+            for name in names:
+                words = normalize_query(name).split(' ')
+                for i in range(len(words)):
+                    keys.add(' '.join(words[i:]))
+            entries.extend((key, rank) for key in keys)
+
+            for country in (row["pais_es"], row["pais_en"]):
+                self._country_codes[normalize_query(country)] = row["iso"]
+
+        entries.sort()
+        self._keys = [key for key, _ in entries]
+        self._ranks = [rank for _, rank in entries]
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Busca destinos cuyo nombre (o una de sus palabras) empiece por la búsqueda.
+
+        Args:
+            query: Texto escrito por el usuario
+            limit: Número máximo de resultados (default: max_results)
+
+        Returns:
+            Lista de destinos "Ciudad, País" ordenada por población (vacía si no hay coincidencias)
+        """
+        self.searches += 1
+        normalized = normalize_query(query)
+        if not normalized:
+            return []
+
+        ranks = set()
+        i = bisect_left(self._keys, normalized)
+        while i < len(self._keys) and self._keys[i].startswith(normalized):
+            ranks.add(self._ranks[i])
+            i += 1
+
+        if ranks:
+            self.hits += 1
+        return [self._labels[rank] for rank in heapq.nsmallest(limit or self.max_results, ranks)]
+
+    def get_country_code(self, country_name: str) -> Optional[str]:
+        """
+        Obtiene el código ISO de un país del dataset.
+
+        Args:
+            country_name: Nombre del país en español o inglés
+
+        Returns:
+            Código ISO del país o None si no está en el dataset
+        """
+        return self._country_codes.get(normalize_query(country_name))
+
+    def canonical_destination(self, destination: str) -> Optional[str]:
+        """
+        Obtiene el nombre canónico de un destino ("Paris, France" → "París, Francia").
+
+        Args:
+            destination: Destino en formato "Ciudad, País" o solo "Ciudad"
+
+        Returns:
+            Destino "Ciudad, País" en español o None si la ciudad no está en el dataset
+        """
+        city, _, country = destination.partition(',')
+        ranks = self._city_ranks.get(normalize_query(city))
+        if not ranks:
+            return None
+        if country.strip():
+            country_code = self.get_country_code(country)
+            ranks = [rank for rank in ranks if self._iso_codes[rank] == country_code]
+        return self._labels[ranks[0]] if ranks else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Obtiene estadísticas del gazetteer.
+
+        Returns:
+            Diccionario con tamaño del índice y búsquedas respondidas
+        """
+        return {
+            "cities": len(self._labels),
+            "index_keys": len(self._keys),
+            "countries": len(self._country_codes),
+            "searches": self.searches,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.searches, 3) if self.searches else None
+        }
+
+
+# Instancia global del gazetteer
+gazetteer = Gazetteer()
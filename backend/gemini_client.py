@@ -0,0 +1,200 @@
+"""
+Cliente asíncrono para Google Gemini.
+
+La librería google-generativeai hace llamadas bloqueantes. Este módulo las
+ejecuta en un pool de hilos acotado para que los endpoints async de FastAPI
+no bloqueen el event loop mientras esperan a Gemini.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Any, AsyncIterator, Dict
+import google.generativeai as genai
+from single_flight import SingleFlight
+
+
+def extract_response_text(response: Any) -> Optional[str]:
+    """
+    Extrae el texto de una respuesta de Gemini.
+    Gemini puede devolver el texto de diferentes formas.
+
+    Args:
+        response: Respuesta de generate_content
+
+    Returns:
+        Texto de la respuesta o None si está vacía o en formato inesperado
+    """
+    if not response:
+        return None
+
+    if hasattr(response, 'text') and response.text:
+        return response.text
+
+    if hasattr(response, 'candidates') and response.candidates:
+        # Intentar obtener el texto de los candidatos
+        candidate = response.candidates[0]
+        if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
+            parts = candidate.content.parts
+            if parts and len(parts) > 0:
+                return parts[0].text if hasattr(parts[0], 'text') else str(parts[0])
+
+    return None
+
+
+# Marca de fin de stream
+_STREAM_END = object()
+
+
+class GeminiClient:
+    """
+    Capa asíncrona sobre google-generativeai.
+
+    Las llamadas a generate_content se ejecutan en un ThreadPoolExecutor con
+    un número máximo de hilos. Si llegan más peticiones que hilos, esperan en
+    cola sin bloquear el event loop (health checks y otros endpoints siguen
+    respondiendo).
+
+    Las llamadas concurrentes con el mismo prompt y modelo comparten una sola
+    llamada a Gemini (single-flight por hash de modelo + prompt). Típico
+    cuando muchas sesiones envían el mismo formulario a la vez ("viajar a
+    París, Francia"): el prompt estructurado del primer turno no lleva
+    historial y es idéntico para todas.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        """
+        Inicializa el cliente.
+
+        Args:
+            max_workers: Número máximo de llamadas concurrentes a Gemini
+        """
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._single_flight = SingleFlight()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Crea el pool de hilos la primera vez que se necesita."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="gemini"
+            )
+        return self._executor
+
+    def _generate_sync(self, model: genai.GenerativeModel, prompt: str) -> Optional[str]:
+        """Llamada bloqueante a Gemini (se ejecuta en el pool de hilos)."""
+        response = model.generate_content(prompt)
+        return extract_response_text(response)
+
+    @staticmethod
+    def _prompt_key(prompt: str, model: genai.GenerativeModel) -> str:
+        """Clave de coalescencia: hash del nombre del modelo y el prompt completo."""
+        model_name = getattr(model, "model_name", None) or str(id(model))
+        return hashlib.sha256(f"{model_name}\0{prompt}".encode("utf-8")).hexdigest()
+
+    async def _generate(self, prompt: str, model: genai.GenerativeModel) -> Optional[str]:
+        """Ejecuta la llamada a Gemini en el pool de hilos."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), self._generate_sync, model, prompt
+        )
+
+    async def generate_text(self, prompt: str, model: genai.GenerativeModel) -> Optional[str]:
+        """
+        Genera una respuesta de Gemini sin bloquear el event loop.
+        Si ya hay una llamada en curso con el mismo prompt y modelo, espera su resultado.
+
+        Args:
+            prompt: Prompt completo a enviar
+            model: Modelo de Gemini (ver gemini_models)
+
+        Returns:
+            Texto de la respuesta o None si Gemini devolvió una respuesta vacía
+
+        Raises:
+            Exception: Cualquier error de la librería de Gemini se propaga
+        """
+        key = self._prompt_key(prompt, model)
+        if self._single_flight.is_in_flight(key):
+            print(f"🔗 Prompt idéntico ya en curso, esperando su respuesta de Gemini")
+        return await self._single_flight.do(key, lambda: self._generate(prompt, model))
+
+    def _stream_sync(self, model: genai.GenerativeModel, prompt: str, loop: asyncio.AbstractEventLoop,
+                     queue: asyncio.Queue, stop: threading.Event) -> None:
+        """
+        Itera la respuesta en streaming de Gemini (en el pool de hilos) y
+        publica cada fragmento en la cola del event loop.
+        """
+        try:
+            for chunk in model.generate_content(prompt, stream=True):
+                if stop.is_set():
+                    break
+                try:
+                    text = extract_response_text(chunk)
+                except ValueError:
+                    # Fragmentos sin partes de texto (p.ej. solo metadatos)
+                    text = None
+                if text:
+                    loop.call_soon_threadsafe(queue.put_nowait, text)
+            loop.call_soon_threadsafe(queue.put_nowait, _STREAM_END)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+
+    async def stream_text(self, prompt: str, model: genai.GenerativeModel) -> AsyncIterator[str]:
+        """
+        Genera una respuesta de Gemini en streaming sin bloquear el event loop.
+
+        Args:
+            prompt: Prompt completo a enviar
+            model: Modelo de Gemini (ver gemini_models)
+
+        Yields:
+            Fragmentos de texto a medida que Gemini los produce
+
+        Raises:
+            Exception: Cualquier error de la librería de Gemini se propaga
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        loop.run_in_executor(
+            self._get_executor(), self._stream_sync, model, prompt, loop, queue, stop
+        )
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Si el cliente se desconecta, dejar de consumir el stream de Gemini
+            stop.set()
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Obtiene estadísticas de las llamadas a Gemini (sin streaming).
+
+        Returns:
+            Diccionario con llamadas realizadas, peticiones coalescidas y llamadas en curso
+        """
+        flight_stats = self._single_flight.get_stats()
+        return {
+            "max_workers": self.max_workers,
+            "gemini_calls": flight_stats["executions"],
+            "coalesced_requests": flight_stats["coalesced"],
+            "in_flight": flight_stats["in_flight"]
+        }
+
+    def shutdown(self) -> None:
+        """Libera el pool de hilos."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Instancia global del cliente de Gemini
+gemini_client = GeminiClient(max_workers=int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")))
@@ -0,0 +1,162 @@
+"""
+Registro de modelos de Gemini por propósito.
+
+La configuración (API key, nombre del modelo y validación de modelos
+gratuitos) se resuelve una sola vez al arrancar la app; las peticiones solo
+reutilizan los GenerativeModel ya creados.
+"""
+import os
+from typing import Dict, Any, Optional
+import google.generativeai as genai
+
+
+# Modelo por defecto: gemini-2.0-flash (100% gratuito)
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+# Lista de modelos gratuitos permitidos
+FREE_MODELS = [
+    "gemini-2.0-flash",
+    "gemini-2.5-flash",
+    "gemini-2.0-flash-lite",
+    "gemini-flash-latest",
+    "gemini-pro-latest"  # Gratuito con límites
+]
+
+# Usos de Gemini en el backend. Cada uno puede sobrescribir el modelo con
+# GEMINI_MODEL_<PROPÓSITO> (p.ej. GEMINI_MODEL_SEARCH); si no, usa GEMINI_MODEL
+MODEL_PURPOSES = ("travel", "popular", "search", "country_code", "summary")
+
+
+def is_free_model(model_name: str) -> bool:
+    """
+    Indica si un modelo es gratuito.
+    IMPORTANTE: Solo usamos modelos GRATUITOS de Gemini (modelos Flash).
+    NO usar modelos Pro (gemini-pro, gemini-2.5-pro, etc.) ya que son de pago.
+
+    Args:
+        model_name: Nombre del modelo de Gemini
+
+    Returns:
+        True si el nombre contiene "flash" o es "gemini-pro-latest"
+    """
+    model_lower = model_name.lower()
+    return (
+        "flash" in model_lower or
+        model_lower == "gemini-pro-latest" or
+        model_lower == "models/gemini-pro-latest"
+    )
+
+
+class GeminiModelRegistry:
+    """
+    Modelos de Gemini listos para usar, uno por propósito.
+
+    configure() se llama en el lifespan de la app. Si se usa el registro
+    fuera de la app (scripts, benchmarks), se configura en el primer get().
+    Los propósitos que comparten nombre de modelo comparten instancia.
+    """
+
+    def __init__(self):
+        """Inicializa el registro sin configurar."""
+        self.configured = False
+        self.has_api_key = False
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        self._model_names: Dict[str, str] = {}
+        self._errors: Dict[str, str] = {}
+
+    def configure(self, api_key: Optional[str] = None) -> None:
+        """
+        Configura la API key, valida los modelos y crea las instancias.
+
+        Args:
+            api_key: API key de Gemini (default: variable de entorno GEMINI_API_KEY)
+        """
+        api_key = api_key if api_key is not None else os.getenv("GEMINI_API_KEY")
+        self.has_api_key = bool(api_key)
+        if api_key:
+            genai.configure(api_key=api_key)
+
+        default_model = os.getenv("GEMINI_MODEL", DEFAULT_MODEL)
+        models_by_name: Dict[str, genai.GenerativeModel] = {}
+        self._models = {}
+        self._model_names = {}
+        self._errors = {}
+
+        for purpose in MODEL_PURPOSES:
+            model_name = os.getenv(f"GEMINI_MODEL_{purpose.upper()}", default_model)
+            self._model_names[purpose] = model_name
+
+            if not is_free_model(model_name):
+                self._errors[purpose] = (
+                    f"❌ Modelo '{model_name}' NO permitido. Solo se permiten modelos GRATUITOS de Gemini. " +
+                    f"Modelos permitidos: {', '.join(FREE_MODELS)}. " +
+                    "Los modelos Pro (gemini-2.5-pro, gemini-2.0-pro) son de pago y NO están permitidos."
+                )
+                print(f"❌ Modelo de Gemini para '{purpose}' no permitido: {model_name}")
+                continue
+
+            if model_name not in models_by_name:
+                models_by_name[model_name] = genai.GenerativeModel(model_name)
+            self._models[purpose] = models_by_name[model_name]
+
+        self.configured = True
+        print(f"✅ Modelos de Gemini configurados: " +
+              ", ".join(f"{purpose}={name}" for purpose, name in self._model_names.items()))
+
+    def is_available(self) -> bool:
+        """Verifica si la API key de Gemini está configurada."""
+        if not self.configured:
+            self.configure()
+        return self.has_api_key
+
+    def get(self, purpose: str) -> genai.GenerativeModel:
+        """
+        Obtiene el modelo para un propósito.
+
+        Args:
+            purpose: Uno de MODEL_PURPOSES
+
+        Returns:
+            Instancia de GenerativeModel reutilizable
+
+        Raises:
+            ValueError: Si el modelo configurado para ese propósito no está permitido
+        """
+        if not self.configured:
+            self.configure()
+        model = self._models.get(purpose)
+        if model is None:
+            raise ValueError(self._errors.get(purpose, f"Propósito de modelo desconocido: {purpose}"))
+        return model
+
+    def get_model_name(self, purpose: str) -> Optional[str]:
+        """
+        Obtiene el nombre del modelo configurado para un propósito (para logs).
+
+        Args:
+            purpose: Uno de MODEL_PURPOSES
+
+        Returns:
+            Nombre del modelo o None si el propósito no existe
+        """
+        if not self.configured:
+            self.configure()
+        return self._model_names.get(purpose)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Obtiene la configuración resuelta del registro.
+
+        Returns:
+            Diccionario con el modelo de cada propósito y los no permitidos
+        """
+        return {
+            "configured": self.configured,
+            "models": dict(self._model_names),
+            "instances": len({id(model) for model in self._models.values()}),
+            "not_allowed": sorted(self._errors)
+        }
+
+
+# Instancia global del registro de modelos
+gemini_models = GeminiModelRegistry()
@@ -0,0 +1,222 @@
+"""
+Cliente HTTP compartido para las APIs externas (OpenWeatherMap, Unsplash,
+tipo de cambio e imágenes del PDF).
+
+Un requests.get suelto abre una conexión TCP+TLS nueva en cada llamada y
+bloquea el hilo que lo ejecuta. Este módulo mantiene una requests.Session por
+upstream (pool de conexiones por host con keep-alive) y ejecuta las
+peticiones en un pool de hilos acotado para no bloquear el event loop.
+
+No es un cliente async nativo ni usa HTTP/2 (httpx no es una dependencia
+del proyecto): es requests + urllib3 con HTTP/1.1 keep-alive. Las
+estadísticas cuentan peticiones por upstream y conexiones abiertas en el
+pool de urllib3, no streams ni conexiones HTTP/2.
+"""
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Política por upstream: timeouts (conexión, lectura) en segundos y reintentos.
+# Solo se reintentan errores de conexión y respuestas 502/503/504; un timeout
+# de lectura o un 429 no se reintentan para no alargar la respuesta.
+UPSTREAM_POLICIES: Dict[str, Dict[str, Any]] = {
+    "openweathermap": {
+        "connect_timeout": 3.05,
+        "read_timeout": float(os.getenv("HTTP_TIMEOUT_WEATHER_SECONDS", "5")),
+        "retries": 1,
+    },
+    "unsplash": {
+        "connect_timeout": 3.05,
+        "read_timeout": float(os.getenv("HTTP_TIMEOUT_UNSPLASH_SECONDS", "5")),
+        "retries": 1,
+    },
+    "exchange_rate": {
+        "connect_timeout": 3.05,
+        "read_timeout": float(os.getenv("HTTP_TIMEOUT_EXCHANGE_RATE_SECONDS", "5")),
+        "retries": 2,
+    },
+    "images": {
+        "connect_timeout": 3.05,
+        "read_timeout": float(os.getenv("HTTP_TIMEOUT_IMAGES_SECONDS", "10")),
+        "retries": 1,
+    },
+}
+
+
+class HTTPClient:
+    """
+    Sesiones HTTP compartidas, una por upstream.
+
+    Cada sesión tiene su pool de conexiones por host (keep-alive), sus
+    timeouts y su política de reintentos (UPSTREAM_POLICIES). Las peticiones
+    async se ejecutan en un ThreadPoolExecutor con un número máximo de hilos;
+    request_sync permite usar las mismas conexiones desde código síncrono
+    (p.ej. la generación del PDF, que ya corre en un hilo).
+
+    Las sesiones se abren en el lifespan de la app (open) o al primer uso, y
+    se cierran al apagarla (close).
+    """
+
+    def __init__(self, policies: Optional[Dict[str, Dict[str, Any]]] = None,
+                 max_workers: int = 16, pool_maxsize: Optional[int] = None):
+        """
+        Inicializa el cliente.
+
+        Args:
+            policies: Política de cada upstream (default: UPSTREAM_POLICIES)
+            max_workers: Número máximo de peticiones HTTP concurrentes
+            pool_maxsize: Conexiones keep-alive que se conservan por host
+                (default: max_workers, una por hilo)
+        """
+        self.policies = policies or UPSTREAM_POLICIES
+        self.max_workers = max_workers
+        self.pool_maxsize = pool_maxsize or max_workers
+        self._sessions: Dict[str, requests.Session] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Los contadores se actualizan desde los hilos del pool
+        self._stats_lock = threading.Lock()
+        self._requests: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+
+    def open(self) -> None:
+        """Crea las sesiones de todos los upstreams y el pool de hilos."""
+        for upstream in self.policies:
+            self._session(upstream)
+        self._get_executor()
+        print(f"🌐 Cliente HTTP compartido listo ({', '.join(self.policies)}; "
+              f"{self.max_workers} peticiones concurrentes)")
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Crea el pool de hilos la primera vez que se necesita."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="http"
+                )
+            return self._executor
+
+    def _session(self, upstream: str) -> requests.Session:
+        """Devuelve la sesión del upstream, creándola la primera vez."""
+        session = self._sessions.get(upstream)
+        if session is not None:
+            return session
+        policy = self.policies[upstream]
+        with self._lock:
+            session = self._sessions.get(upstream)
+            if session is None:
+                retries = Retry(
+                    total=policy["retries"],
+                    connect=policy["retries"],
+                    read=0,
+                    status=policy["retries"],
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset({"GET", "HEAD"}),
+                    backoff_factor=0.2,
+                    raise_on_status=False,
+                    respect_retry_after_header=False
+                )
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize, max_retries=retries)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[upstream] = session
+        return session
+
+    def request_sync(self, upstream: str, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Hace una petición bloqueante con la sesión del upstream.
+
+        Args:
+            upstream: Nombre del upstream (clave de UPSTREAM_POLICIES)
+            method: Método HTTP
+            url: URL de la petición
+            **kwargs: Argumentos de requests (params, headers, ...). Si no se
+                indica timeout, se usa el de la política del upstream
+
+        Returns:
+            Respuesta de requests
+
+        Raises:
+            requests.exceptions.RequestException: Errores de conexión o timeout
+        """
+        policy = self.policies[upstream]
+        kwargs.setdefault("timeout", (policy["connect_timeout"], policy["read_timeout"]))
+        with self._stats_lock:
+            self._requests[upstream] = self._requests.get(upstream, 0) + 1
+        try:
+            return self._session(upstream).request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._stats_lock:
+                self._errors[upstream] = self._errors.get(upstream, 0) + 1
+            raise
+
+    def get_sync(self, upstream: str, url: str, **kwargs) -> requests.Response:
+        """GET bloqueante (ver request_sync)."""
+        return self.request_sync(upstream, "GET", url, **kwargs)
+
+    async def get(self, upstream: str, url: str, **kwargs) -> requests.Response:
+        """
+        GET sin bloquear el event loop (ver request_sync).
+
+        Args:
+            upstream: Nombre del upstream (clave de UPSTREAM_POLICIES)
+            url: URL de la petición
+            **kwargs: Argumentos de requests
+
+        Returns:
+            Respuesta de requests
+
+        Raises:
+            requests.exceptions.RequestException: Errores de conexión o timeout
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), functools.partial(self.request_sync, upstream, "GET", url, **kwargs)
+        )
+
+    def close(self) -> None:
+        """Cierra las conexiones abiertas y el pool de hilos."""
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+            executor, self._executor = self._executor, None
+        for session in sessions.values():
+            session.close()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Obtiene estadísticas por upstream.
+
+        Returns:
+            Diccionario con peticiones, errores y conexiones abiertas de cada upstream
+        """
+        with self._stats_lock:
+            requests_by_upstream = dict(self._requests)
+            errors_by_upstream = dict(self._errors)
+        stats = {}
+        for upstream in self.policies:
+            connections = 0
+            session = self._sessions.get(upstream)
+            if session is not None:
+                pools = session.get_adapter("https://").poolmanager.pools
+                connections = sum(pools[key].num_connections for key in pools.keys())
+            stats[upstream] = {
+                "requests": requests_by_upstream.get(upstream, 0),
+                "errors": errors_by_upstream.get(upstream, 0),
+                "connections_opened": connections
+            }
+        return stats
+
+
+# Instancia global del cliente HTTP
+http_client = HTTPClient(max_workers=int(os.getenv("HTTP_CLIENT_MAX_WORKERS", "16")))
@@ -1,10 +1,12 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-import google.generativeai as genai
+from typing import Optional, List, Dict, Any, Tuple, Union
+from contextlib import asynccontextmanager
+import asyncio
 import os
+import json
 import unicodedata
 import re
 from prompts import load_prompt
@@ -12,8 +14,17 @@ from weather import WeatherService, extract_destination_from_question, parse_for
 from unsplash import UnsplashService
 from realtime_info import RealtimeInfoService
 from conversation_history import conversation_history
+from conversation_snapshot import write_snapshot
 from destination_detector import detect_destination_change, interpret_confirmation_response
 from pdf_generator import create_pdf
+from gemini_client import gemini_client
+from http_client import http_client
+from gemini_models import gemini_models
+from popular_destinations_cache import PopularDestinationsCache
+from destination_search_cache import DestinationSearchCache
+from gazetteer import gazetteer
+from travel_answer_cache import TravelAnswerCache
+from prompt_builder import build_history_context, history_budget, estimate_tokens, prompt_size_stats, render_context_line
 
 
 def parse_destinations_simple(response_text: str) -> list[str]:
@@ -50,11 +61,47 @@ def parse_destinations_simple(response_text: str) -> list[str]:
     
     return destinations
 
-app = FastAPI(title="ViajeIA API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Arranque y parada de la app: resuelve la configuración de Gemini una sola vez,
+    abre el cliente HTTP compartido y valida con él las API keys de clima y fotos,
+    carga el índice del snapshot de conversaciones (si está configurado) y, al
+    terminar, guarda el snapshot y libera el cliente HTTP, el pool de hilos de
+    Gemini y el store.
+    """
+    gemini_models.configure(GEMINI_API_KEY)
+    http_client.open()
+    await asyncio.gather(_validate_weather_api_key(), _validate_unsplash_api_key())
+    snapshot_task = None
+    if CONVERSATION_SNAPSHOT_PATH:
+        conversation_history.load_snapshot(CONVERSATION_SNAPSHOT_PATH)
+        snapshot_task = asyncio.create_task(_snapshot_conversations_periodically())
+    yield
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+        try:
+            await snapshot_task
+        except asyncio.CancelledError:
+            pass
+        try:
+            conversation_history.save_snapshot(CONVERSATION_SNAPSHOT_PATH)
+        except OSError as e:
+            print(f"⚠️ [HISTORY] No se pudo guardar el snapshot: {e}")
+        conversation_history.close_snapshot()
+    http_client.close()
+    gemini_client.shutdown()
+    await conversation_history.flush()
+    conversation_history.close()
+
+
+app = FastAPI(title="ViajeIA API", lifespan=lifespan)
 
 # Configurar la API key de Gemini desde variable de entorno del sistema
 # IMPORTANTE: La API key debe estar configurada como variable de entorno
 # NO se usa archivo .env para mayor seguridad
+# (genai.configure y la validación del modelo se hacen en el lifespan, ver gemini_models)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 if not GEMINI_API_KEY:
@@ -68,23 +115,16 @@ else:
     # Solo mostrar confirmación, nunca la key completa por seguridad
     masked_key = f"{GEMINI_API_KEY[:10]}...{GEMINI_API_KEY[-4:]}" if len(GEMINI_API_KEY) > 14 else "***"
     print(f"✅ API Key de Gemini configurada ({masked_key})")
-    genai.configure(api_key=GEMINI_API_KEY)
 
 # Inicializar servicio de clima
-weather_service = WeatherService()
+weather_service = WeatherService(
+    cache_ttl_seconds=int(os.getenv("WEATHER_CACHE_TTL_SECONDS", "1800")),
+    cache_hard_ttl_seconds=int(os.getenv("WEATHER_CACHE_HARD_TTL_SECONDS", "7200")),
+    cache_max_entries=int(os.getenv("WEATHER_CACHE_MAX_ENTRIES", "10000"))
+)
 if weather_service.is_available():
     masked_weather_key = f"{weather_service.api_key[:10]}...{weather_service.api_key[-4:]}" if len(weather_service.api_key) > 14 else "***"
     print(f"✅ API Key de OpenWeatherMap configurada ({masked_weather_key})")
-    
-    # Validar la API key al inicio
-    print("🔍 Validando API key de OpenWeatherMap...")
-    is_valid, error_msg = weather_service.validate_api_key()
-    if is_valid:
-        print("✅ API key de OpenWeatherMap válida y funcionando")
-    else:
-        print(f"❌ API key de OpenWeatherMap no válida: {error_msg}")
-        print("   El clima no estará disponible hasta que corrijas la API key")
-        print("   Verifica en: https://home.openweathermap.org/api_keys")
 else:
     print("⚠️  ADVERTENCIA: OPENWEATHER_API_KEY no encontrada")
     print("   El clima no estará disponible. Configura la variable de entorno OPENWEATHER_API_KEY")
@@ -95,25 +135,76 @@ unsplash_service = UnsplashService()
 if unsplash_service.is_available():
     masked_unsplash_key = f"{unsplash_service.api_key[:10]}...{unsplash_service.api_key[-4:]}" if len(unsplash_service.api_key) > 14 else "***"
     print(f"✅ API Key de Unsplash configurada ({masked_unsplash_key})")
-    
-    # Validar la API key al inicio
+else:
+    print("⚠️  ADVERTENCIA: UNSPLASH_API_KEY no encontrada")
+    print("   Las fotos no estarán disponibles. Configura la variable de entorno UNSPLASH_API_KEY")
+    print("   Ver SECRETS.md para más detalles")
+
+
+async def _validate_weather_api_key() -> None:
+    """Valida la API key de OpenWeatherMap al arrancar (si está configurada)."""
+    if not weather_service.is_available():
+        return
+    print("🔍 Validando API key de OpenWeatherMap...")
+    is_valid, error_msg = await weather_service.validate_api_key()
+    if is_valid:
+        print("✅ API key de OpenWeatherMap válida y funcionando")
+    else:
+        print(f"❌ API key de OpenWeatherMap no válida: {error_msg}")
+        print("   El clima no estará disponible hasta que corrijas la API key")
+        print("   Verifica en: https://home.openweathermap.org/api_keys")
+
+
+async def _validate_unsplash_api_key() -> None:
+    """Valida la API key de Unsplash al arrancar (si está configurada)."""
+    if not unsplash_service.is_available():
+        return
     print("🔍 Validando API key de Unsplash...")
-    is_valid, error_msg = unsplash_service.validate_api_key()
+    is_valid, error_msg = await unsplash_service.validate_api_key()
     if is_valid:
         print("✅ API key de Unsplash válida y funcionando")
     else:
         print(f"❌ API key de Unsplash no válida: {error_msg}")
         print("   Las fotos no estarán disponibles hasta que corrijas la API key")
         print("   Verifica en: https://unsplash.com/developers")
-else:
-    print("⚠️  ADVERTENCIA: UNSPLASH_API_KEY no encontrada")
-    print("   Las fotos no estarán disponibles. Configura la variable de entorno UNSPLASH_API_KEY")
-    print("   Ver SECRETS.md para más detalles")
+
 
 # Inicializar servicio de información en tiempo real
-realtime_info_service = RealtimeInfoService()
+# Comparte el servicio de clima con /api/travel: un solo cache, una sola
+# consulta en curso por ciudad y un solo circuit breaker por proceso
+realtime_info_service = RealtimeInfoService(weather_service)
 print("✅ Servicio de información en tiempo real inicializado")
 
+# Cache de destinos populares (TTL configurable, por defecto 24 horas)
+popular_destinations_cache = PopularDestinationsCache(
+    ttl_seconds=int(os.getenv("POPULAR_DESTINATIONS_TTL_SECONDS", "86400"))
+)
+
+# Cache por prefijos para el autocompletado de destinos
+destination_search_cache = DestinationSearchCache(
+    max_entries=int(os.getenv("DESTINATION_SEARCH_CACHE_SIZE", "2000")),
+    ttl_seconds=int(os.getenv("DESTINATION_SEARCH_CACHE_TTL_SECONDS", "21600"))
+)
+
+# Cache opcional de respuestas estructuradas del primer turno (desactivado por defecto)
+travel_answer_cache = TravelAnswerCache(
+    enabled=os.getenv("TRAVEL_ANSWER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes"),
+    max_entries=int(os.getenv("TRAVEL_ANSWER_CACHE_SIZE", "500")),
+    ttl_seconds=int(os.getenv("TRAVEL_ANSWER_CACHE_TTL_SECONDS", "86400"))
+)
+
+# Timeouts de cada rama de enriquecimiento (clima y fotos) en /api/travel
+ENRICHMENT_WEATHER_TIMEOUT = float(os.getenv("ENRICHMENT_WEATHER_TIMEOUT_SECONDS", "3"))
+ENRICHMENT_PHOTOS_TIMEOUT = float(os.getenv("ENRICHMENT_PHOTOS_TIMEOUT_SECONDS", "3"))
+
+# Resumen de los turnos que salen de la ventana del prompt: con Gemini (por defecto) o local
+CONVERSATION_SUMMARY_WITH_GEMINI = os.getenv("CONVERSATION_SUMMARY_WITH_GEMINI", "true").lower() in ("1", "true", "yes")
+
+# Snapshot de las sesiones en memoria para conservarlas entre reinicios (vacío = desactivado).
+# Solo se usa sin store persistente (CONVERSATION_STORE=memory).
+CONVERSATION_SNAPSHOT_PATH = os.getenv("CONVERSATION_SNAPSHOT_PATH", "") if conversation_history.store is None else ""
+CONVERSATION_SNAPSHOT_INTERVAL = int(os.getenv("CONVERSATION_SNAPSHOT_INTERVAL_SECONDS", "300"))
+
 # Configurar CORS para permitir requests del frontend
 # En producción, permite orígenes desde variable de entorno o todos los orígenes
 allowed_origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",")
@@ -170,6 +261,10 @@ class DestinationConfirmation(BaseModel):
     original_question: Optional[str] = None  # Para re-procesar si se confirma
 
 
+class AnswerCacheInvalidation(BaseModel):
+    destination: str  # Destino en formato "Ciudad, País"
+
+
 @app.get("/")
 def read_root():
     return {"message": "ViajeIA API is running"}
@@ -198,6 +293,7 @@ async def generate_itinerary_pdf(
         print(f"🔑 [API] Session ID: {session_id}")
         
         # Obtener historial de conversación
+        await conversation_history.prefetch(session_id)
         messages = conversation_history.get_history(session_id)
         if not messages:
             raise HTTPException(
@@ -228,15 +324,14 @@ async def generate_itinerary_pdf(
         
         # Si no hay fotos, intentar obtenerlas del servicio
         if not photos:
-            from unsplash import UnsplashService
-            unsplash_service = UnsplashService()
             if unsplash_service.is_available():
-                photos = unsplash_service.get_photos(current_destination, count=6)
+                photos = await unsplash_service.get_photos(current_destination, count=6)
                 if photos:
                     print(f"📸 [API] {len(photos)} fotos obtenidas para el PDF")
         
-        # Generar PDF
-        pdf_buffer = create_pdf(
+        # Generar PDF (reportlab y la descarga de las fotos son bloqueantes: se ejecuta en un hilo)
+        pdf_buffer = await asyncio.to_thread(
+            create_pdf,
             destination=current_destination,
             departure_date=departure_date,
             return_date=return_date,
@@ -293,394 +388,643 @@ async def generate_itinerary_pdf(
         )
 
 
-@app.post("/api/travel", response_model=TravelResponse)
-async def plan_travel(query: TravelQuery):
+def _get_gemini_model(purpose: str):
     """
-    Endpoint para procesar preguntas sobre viajes usando Google Gemini
-    Mantiene historial de conversación para contexto
+    Obtiene el modelo de Gemini ya configurado para un propósito.
+    
+    Args:
+        purpose: Propósito del modelo (ver gemini_models.MODEL_PURPOSES)
+        
+    Returns:
+        Instancia de GenerativeModel
+        
+    Raises:
+        HTTPException: 400 si el modelo configurado no es gratuito
     """
     try:
-        print(f"\n{'='*80}")
-        print(f"🚀 [API] Nueva petición recibida")
-        print(f"📝 [API] Pregunta: {query.question[:100]}...")
-        print(f"📍 [API] Destino (formulario): {query.destination}")
-        print(f"🔑 [API] Session ID recibido: {query.session_id}")
-        
-        # ============================================================
-        # PASO 1: Determinar tipo de petición
-        # ============================================================
-        is_form_submission = query.destination is not None and query.destination.strip() != ""
-        is_chat_question = not is_form_submission
+        return gemini_models.get(purpose)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _detect_question_topic(question_lower: str) -> Optional[str]:
+    """
+    Identifica el tema específico de una pregunta.
+    
+    Args:
+        question_lower: Pregunta del usuario en minúsculas
         
-        if is_form_submission:
-            print(f"📋 [API] Tipo: PREGUNTA DE FORMULARIO")
-        else:
-            print(f"💬 [API] Tipo: PREGUNTA DE CHAT")
+    Returns:
+        "transporte", "comida", "alojamiento", "precios" o None si no es específica
+    """
+    if any(word in question_lower for word in ['transporte', 'metro', 'autobús', 'taxi', 'movilidad']):
+        return "transporte"
+    if any(word in question_lower for word in ['comida', 'restaurante', 'gastronomía', 'plato', 'comer']):
+        return "comida"
+    if any(word in question_lower for word in ['alojamiento', 'hotel', 'hostal', 'dormir', 'hospedaje']):
+        return "alojamiento"
+    if any(word in question_lower for word in ['precio', 'costo', 'gasto', 'presupuesto']):
+        return "precios"
+    return None
+
+
+async def _prepare_travel_request(query: TravelQuery) -> Union[TravelResponse, Dict[str, Any]]:
+    """
+    Prepara una petición de viaje: sesión, confirmaciones pendientes,
+    detección de cambio de destino y construcción del prompt.
+    Tras revalidar la sesión contra el store (el único await, antes de leer
+    nada) no hay más awaits: en el event loop se ejecuta entera sin que otra
+    petición de la misma sesión modifique el estado a mitad.
+    
+    Args:
+        query: Petición del usuario
         
+    Returns:
+        TravelResponse si la petición se resuelve sin consultar a Gemini
+        (confirmación o aclaración de destino), o un diccionario con el prompt
+        y el contexto necesario para generar y registrar la respuesta
+    """
+    print(f"\n{'='*80}")
+    print(f"🚀 [API] Nueva petición recibida")
+    print(f"📝 [API] Pregunta: {query.question[:100]}...")
+    print(f"📍 [API] Destino (formulario): {query.destination}")
+    print(f"🔑 [API] Session ID recibido: {query.session_id}")
+    
+    # ============================================================
+    # PASO 1: Determinar tipo de petición
+    # ============================================================
+    is_form_submission = query.destination is not None and query.destination.strip() != ""
+    is_chat_question = not is_form_submission
+    # Si la pregunta se añade al historial junto con la respuesta (ver _record_travel_exchange)
+    record_question = is_form_submission
+    # Pregunta de chat que aún no está en el historial pero debe aparecer en el del prompt
+    pending_question = None
+    
+    if is_form_submission:
+        print(f"📋 [API] Tipo: PREGUNTA DE FORMULARIO")
+    else:
+        print(f"💬 [API] Tipo: PREGUNTA DE CHAT")
+    
+    if travel_answer_cache.enabled:
+        print(f"📦 [API] Cache de respuestas activo (solo primer turno estructurado sin historial)")
+    else:
         print(f"✅ [API] Esta petición SIEMPRE consulta a Gemini (no hay caché de respuestas)")
+    
+    # Verificar que la API key esté configurada
+    if not GEMINI_API_KEY:
+        raise HTTPException(
+            status_code=500,
+            detail="API key de Gemini no configurada. Por favor, configura la variable de entorno GEMINI_API_KEY. Ver SECRETS.md para instrucciones."
+        )
+    
+    # Gestionar sesión de conversación
+    await conversation_history.prefetch(query.session_id)
+    session_id, created = conversation_history.get_or_create_session(query.session_id)
+    if not created:
+        print(f"✅ [API] Usando sesión existente: {session_id}")
+    elif query.session_id:
+        # Si la sesión no existe, se creó una nueva
+        print(f"🆕 [API] Sesión no válida, nueva sesión creada: {session_id}")
+    else:
+        print(f"🆕 [API] Nueva sesión creada: {session_id}")
+    
+    # ============================================================
+    # PASO 1.5: Verificar si hay confirmación pendiente y procesar respuesta
+    # ============================================================
+    pending_confirmation = conversation_history.get_pending_confirmation(session_id)
+    skip_destination_detection = False
+    
+    if pending_confirmation:
+        print(f"⏳ [API] Confirmación pendiente detectada")
+        print(f"📍 [API] Destino detectado: {pending_confirmation['detected_destination']}")
+        print(f"📍 [API] Destino actual: {pending_confirmation['current_destination']}")
+        
+        # Intentar interpretar la pregunta como respuesta a la confirmación
+        is_response, confirmed = interpret_confirmation_response(
+            query.question,
+            pending_confirmation['detected_destination'],
+            pending_confirmation['current_destination']
+        )
         
-        # Verificar que la API key esté configurada
-        if not GEMINI_API_KEY:
-            raise HTTPException(
-                status_code=500,
-                detail="API key de Gemini no configurada. Por favor, configura la variable de entorno GEMINI_API_KEY. Ver SECRETS.md para instrucciones."
-            )
-        
-        # Gestionar sesión de conversación
-        session_id = query.session_id
-        if not session_id:
-            # Crear nueva sesión si no existe
-            session_id = conversation_history.create_session()
-            print(f"🆕 [API] Nueva sesión creada: {session_id}")
-        elif session_id not in conversation_history.get_all_sessions():
-            # Si la sesión no existe, crear una nueva
-            session_id = conversation_history.create_session()
-            print(f"🆕 [API] Sesión no válida, nueva sesión creada: {session_id}")
-        else:
-            print(f"✅ [API] Usando sesión existente: {session_id}")
-        
-        # ============================================================
-        # PASO 1.5: Verificar si hay confirmación pendiente y procesar respuesta
-        # ============================================================
-        pending_confirmation = conversation_history.get_pending_confirmation(session_id)
-        skip_destination_detection = False
-        
-        if pending_confirmation:
-            print(f"⏳ [API] Confirmación pendiente detectada")
-            print(f"📍 [API] Destino detectado: {pending_confirmation['detected_destination']}")
-            print(f"📍 [API] Destino actual: {pending_confirmation['current_destination']}")
+        if is_response:
+            print(f"✅ [API] Pregunta interpretada como respuesta a confirmación: confirmed={confirmed}")
             
-            # Intentar interpretar la pregunta como respuesta a la confirmación
-            is_response, confirmed = interpret_confirmation_response(
-                query.question,
-                pending_confirmation['detected_destination'],
-                pending_confirmation['current_destination']
-            )
+            # Añadir pregunta del usuario al historial
+            conversation_history.add_message(session_id, 'user', query.question)
             
-            if is_response:
-                print(f"✅ [API] Pregunta interpretada como respuesta a confirmación: confirmed={confirmed}")
+            if confirmed is True:
+                # Usuario confirmó el cambio
+                print(f"✅ [API] Usuario confirmó cambio de destino")
+                conversation_history.set_current_destination(session_id, pending_confirmation['detected_destination'])
+                conversation_history.clear_pending_confirmation(session_id)
                 
-                # Añadir pregunta del usuario al historial
-                conversation_history.add_message(session_id, 'user', query.question)
+                # Procesar pregunta original con el nuevo destino
+                original_question = pending_confirmation['original_question']
+                print(f"📝 [API] Procesando pregunta original: {original_question}")
                 
-                if confirmed is True:
-                    # Usuario confirmó el cambio
-                    print(f"✅ [API] Usuario confirmó cambio de destino")
-                    conversation_history.set_current_destination(session_id, pending_confirmation['detected_destination'])
-                    conversation_history.clear_pending_confirmation(session_id)
-                    
-                    # Procesar pregunta original con el nuevo destino
-                    original_question = pending_confirmation['original_question']
-                    print(f"📝 [API] Procesando pregunta original: {original_question}")
-                    
-                    # Establecer destino y continuar con lógica normal
-                    current_destination = pending_confirmation['detected_destination']
-                    destination_string = pending_confirmation['detected_destination']
-                    use_structured_format = True
-                    skip_destination_detection = True
-                    # Cambiar la pregunta a la original para procesarla
-                    # Pero primero añadir la pregunta original al historial si no está
-                    # (la respuesta de confirmación ya se añadió arriba)
-                    query.question = original_question
-                    # No añadir de nuevo al historial, ya se añadió cuando se detectó el cambio
-                    
-                elif confirmed is False:
-                    # Usuario rechazó el cambio
-                    print(f"❌ [API] Usuario rechazó cambio de destino")
-                    conversation_history.clear_pending_confirmation(session_id)
-                    current_destination = pending_confirmation['current_destination']
-                    # Continuar con pregunta actual normalmente
-                    skip_destination_detection = False
-                    
-                else:
-                    # Respuesta ambigua - pedir aclaración
-                    print(f"❓ [API] Respuesta ambigua, solicitando aclaración")
-                    clarification_message = (
-                        f"No estoy seguro de tu respuesta. "
-                        f"¿Quieres cambiar el destino a '{pending_confirmation['detected_destination']}' "
-                        f"o prefieres continuar con '{pending_confirmation['current_destination']}'? "
-                        f"Por favor responde 'sí' o 'no', o menciona el destino que prefieres."
-                    )
-                    conversation_history.add_message(session_id, 'assistant', clarification_message)
-                    return TravelResponse(
-                        answer=clarification_message,
-                        session_id=session_id,
-                        weather=None,
-                        photos=None,
-                        requires_confirmation=False,
-                        detected_destination=None,
-                        current_destination=pending_confirmation['current_destination'],
-                        response_format="confirmation"
-                    )
-            else:
-                # No es respuesta a confirmación - limpiar confirmación pendiente y continuar normalmente
-                print(f"🔄 [API] Pregunta no es respuesta a confirmación, limpiando confirmación pendiente")
+                # Establecer destino y continuar con lógica normal
+                current_destination = pending_confirmation['detected_destination']
+                destination_string = pending_confirmation['detected_destination']
+                use_structured_format = True
+                skip_destination_detection = True
+                # Cambiar la pregunta a la original para procesarla
+                # Pero primero añadir la pregunta original al historial si no está
+                # (la respuesta de confirmación ya se añadió arriba)
+                query.question = original_question
+                # No añadir de nuevo al historial, ya se añadió cuando se detectó el cambio
+            
+            elif confirmed is False:
+                # Usuario rechazó el cambio
+                print(f"❌ [API] Usuario rechazó cambio de destino")
                 conversation_history.clear_pending_confirmation(session_id)
+                current_destination = pending_confirmation['current_destination']
+                # Continuar con pregunta actual normalmente
                 skip_destination_detection = False
+            
+            else:
+                # Respuesta ambigua - pedir aclaración
+                print(f"❓ [API] Respuesta ambigua, solicitando aclaración")
+                clarification_message = (
+                    f"No estoy seguro de tu respuesta. "
+                    f"¿Quieres cambiar el destino a '{pending_confirmation['detected_destination']}' "
+                    f"o prefieres continuar con '{pending_confirmation['current_destination']}'? "
+                    f"Por favor responde 'sí' o 'no', o menciona el destino que prefieres."
+                )
+                conversation_history.add_message(session_id, 'assistant', clarification_message)
+                return TravelResponse(
+                    answer=clarification_message,
+                    session_id=session_id,
+                    weather=None,
+                    photos=None,
+                    requires_confirmation=False,
+                    detected_destination=None,
+                    current_destination=pending_confirmation['current_destination'],
+                    response_format="confirmation"
+                )
+        else:
+            # No es respuesta a confirmación - limpiar confirmación pendiente y continuar normalmente
+            print(f"🔄 [API] Pregunta no es respuesta a confirmación, limpiando confirmación pendiente")
+            conversation_history.clear_pending_confirmation(session_id)
+            skip_destination_detection = False
+    
+    # ============================================================
+    # PASO 2: Obtener destino actual de la conversación
+    # ============================================================
+    if 'current_destination' not in locals():
+        current_destination = conversation_history.get_current_destination(session_id)
+        print(f"📍 [API] Destino actual de la conversación: {current_destination or 'Ninguno'}")
+    
+    # ============================================================
+    # PASO 3: Si es formulario inicial, establecer destino y usar formato estructurado
+    # ============================================================
+    if 'use_structured_format' not in locals():
+        use_structured_format = False
+    if 'destination_string' not in locals():
+        destination_string = None
+    
+    if is_form_submission:
+        # Establecer destino actual
+        conversation_history.set_current_destination(session_id, query.destination)
+        current_destination = query.destination
+        destination_string = query.destination
+        
+        # Usar formato estructurado (5 secciones)
+        use_structured_format = True
+        print(f"📋 [API] Formulario inicial - Usando formato estructurado (5 secciones)")
+    
+    # ============================================================
+    # PASO 4: Si es pregunta de chat, detectar cambio de destino
+    # ============================================================
+    elif is_chat_question and not skip_destination_detection:
+        # La pregunta del usuario (si no se añadió antes) se añade al historial junto con la
+        # respuesta, para que peticiones concurrentes de la sesión no intercalen preguntas y respuestas
+        record_question = not (pending_confirmation and 'is_response' in locals() and is_response)
+        if record_question:
+            pending_question = query.question
+        
+        # Detectar si hay cambio de destino
+        is_change, detected_dest, is_explicit = detect_destination_change(
+            current_destination, 
+            query.question
+        )
         
-        # ============================================================
-        # PASO 2: Obtener destino actual de la conversación
-        # ============================================================
-        if 'current_destination' not in locals():
-            current_destination = conversation_history.get_current_destination(session_id)
-            print(f"📍 [API] Destino actual de la conversación: {current_destination or 'Ninguno'}")
+        print(f"🔍 [API] Detección de destino: cambio={is_change}, detectado={detected_dest}, explícito={is_explicit}")
         
         # ============================================================
-        # PASO 3: Si es formulario inicial, establecer destino y usar formato estructurado
+        # PASO 5: Si hay cambio de destino (implícito), establecer confirmación pendiente
         # ============================================================
-        if 'use_structured_format' not in locals():
-            use_structured_format = False
-        if 'destination_string' not in locals():
-            destination_string = None
-        
-        if is_form_submission:
-            # Establecer destino actual
-            conversation_history.set_current_destination(session_id, query.destination)
-            current_destination = query.destination
-            destination_string = query.destination
+        if is_change and not is_explicit:
+            # Cambio implícito detectado - establecer confirmación pendiente y preguntar
+            confirmation_message = (
+                f"Veo que mencionaste '{detected_dest}' en tu pregunta. "
+                f"Actualmente estamos hablando sobre '{current_destination}'. "
+                f"¿Te gustaría cambiar el destino a '{detected_dest}' o prefieres continuar con '{current_destination}'?"
+            )
             
-            # Usar formato estructurado (5 secciones)
-            use_structured_format = True
-            print(f"📋 [API] Formulario inicial - Usando formato estructurado (5 secciones)")
-        
-        # ============================================================
-        # PASO 4: Si es pregunta de chat, detectar cambio de destino
-        # ============================================================
-        elif is_chat_question and not skip_destination_detection:
-            # Añadir pregunta del usuario al historial (si no se añadió antes)
-            if not (pending_confirmation and 'is_response' in locals() and is_response):
+            if record_question:
                 conversation_history.add_message(session_id, 'user', query.question)
                 print(f"💬 [API] Pregunta añadida al historial")
             
-            # Detectar si hay cambio de destino
-            is_change, detected_dest, is_explicit = detect_destination_change(
-                current_destination, 
-                query.question
+            # Establecer confirmación pendiente
+            conversation_history.set_pending_confirmation(
+                session_id,
+                detected_dest,
+                current_destination,
+                query.question  # Guardar pregunta original
             )
             
-            print(f"🔍 [API] Detección de destino: cambio={is_change}, detectado={detected_dest}, explícito={is_explicit}")
+            # Agregar mensaje de confirmación al historial
+            conversation_history.add_message(session_id, 'assistant', confirmation_message)
             
-            # ============================================================
-            # PASO 5: Si hay cambio de destino (implícito), establecer confirmación pendiente
-            # ============================================================
-            if is_change and not is_explicit:
-                # Cambio implícito detectado - establecer confirmación pendiente y preguntar
-                confirmation_message = (
-                    f"Veo que mencionaste '{detected_dest}' en tu pregunta. "
-                    f"Actualmente estamos hablando sobre '{current_destination}'. "
-                    f"¿Te gustaría cambiar el destino a '{detected_dest}' o prefieres continuar con '{current_destination}'?"
-                )
-                
-                # Establecer confirmación pendiente
-                conversation_history.set_pending_confirmation(
-                    session_id,
-                    detected_dest,
-                    current_destination,
-                    query.question  # Guardar pregunta original
-                )
-                
-                # Agregar mensaje de confirmación al historial
-                conversation_history.add_message(session_id, 'assistant', confirmation_message)
-                
-                print(f"❓ [API] Cambio implícito detectado - Confirmación pendiente establecida")
-                
-                # Retornar mensaje de confirmación (sin requires_confirmation, se maneja en el chat)
-                return TravelResponse(
-                    answer=confirmation_message,
-                    session_id=session_id,
-                    weather=None,
-                    photos=None,
-                    requires_confirmation=False,  # Ya no se usa window.confirm
-                    detected_destination=detected_dest,
-                    current_destination=current_destination,
-                    response_format="confirmation"
-                )
+            print(f"❓ [API] Cambio implícito detectado - Confirmación pendiente establecida")
             
-            # ============================================================
-            # PASO 6: Si hay cambio explícito, actualizar destino y usar formato estructurado
-            # ============================================================
-            elif is_change and is_explicit:
-                # Cambio explícito - actualizar destino y usar formato estructurado
-                conversation_history.set_current_destination(session_id, detected_dest)
-                current_destination = detected_dest
-                destination_string = detected_dest
-                use_structured_format = True
-                print(f"🔄 [API] Cambio explícito de destino - Usando formato estructurado (5 secciones)")
-            
-            # ============================================================
-            # PASO 7: Si NO hay cambio, usar respuesta directa contextualizada
-            # ============================================================
-            else:
-                # Si no hay destino actual (primera pregunta), usar formato estructurado
-                if not current_destination:
-                    # Primera pregunta sin destino - usar formato estructurado
-                    if detected_dest:
-                        # Si se detectó un destino, establecerlo y usar formato estructurado
-                        conversation_history.set_current_destination(session_id, detected_dest)
-                        current_destination = detected_dest
-                        destination_string = detected_dest
-                        use_structured_format = True
-                        print(f"🆕 [API] Primera pregunta con destino detectado - Usando formato estructurado (5 secciones)")
-                    else:
-                        # No se detectó destino - usar formato estructurado por defecto
-                        use_structured_format = True
-                        print(f"🆕 [API] Primera pregunta sin destino - Usando formato estructurado (5 secciones)")
-                else:
-                    # Mismo destino - usar respuesta directa (NO formato estructurado)
-                    use_structured_format = False
-                    destination_string = current_destination
-                    print(f"💬 [API] Pregunta sobre mismo destino - Usando respuesta directa contextualizada")
+            # Retornar mensaje de confirmación (sin requires_confirmation, se maneja en el chat)
+            return TravelResponse(
+                answer=confirmation_message,
+                session_id=session_id,
+                weather=None,
+                photos=None,
+                requires_confirmation=False,  # Ya no se usa window.confirm
+                detected_destination=detected_dest,
+                current_destination=current_destination,
+                response_format="confirmation"
+            )
         
         # ============================================================
-        # PASO 8: Construir prompt según el formato a usar
+        # PASO 6: Si hay cambio explícito, actualizar destino y usar formato estructurado
         # ============================================================
-        # Obtener contexto de conversaciones anteriores
-        conversation_context = conversation_history.get_conversation_context(session_id, limit=10)
-        print(f"📚 [API] Contexto del historial: {len(conversation_context.split(chr(10))) if conversation_context else 0} líneas")
+        elif is_change and is_explicit:
+            # Cambio explícito - actualizar destino y usar formato estructurado
+            conversation_history.set_current_destination(session_id, detected_dest)
+            current_destination = detected_dest
+            destination_string = detected_dest
+            use_structured_format = True
+            print(f"🔄 [API] Cambio explícito de destino - Usando formato estructurado (5 secciones)")
         
-        if use_structured_format:
-            # Usar prompt estructurado (5 secciones) - código existente mejorado
-            base_prompt = load_prompt("travel_planning", question=query.question)
+        # ============================================================
+        # PASO 7: Si NO hay cambio, usar respuesta directa contextualizada
+        # ============================================================
+        else:
+            # Si no hay destino actual (primera pregunta), usar formato estructurado
+            if not current_destination:
+                # Primera pregunta sin destino - usar formato estructurado
+                if detected_dest:
+                    # Si se detectó un destino, establecerlo y usar formato estructurado
+                    conversation_history.set_current_destination(session_id, detected_dest)
+                    current_destination = detected_dest
+                    destination_string = detected_dest
+                    use_structured_format = True
+                    print(f"🆕 [API] Primera pregunta con destino detectado - Usando formato estructurado (5 secciones)")
+                else:
+                    # No se detectó destino - usar formato estructurado por defecto
+                    use_structured_format = True
+                    print(f"🆕 [API] Primera pregunta sin destino - Usando formato estructurado (5 secciones)")
+            else:
+                # Mismo destino - usar respuesta directa (NO formato estructurado)
+                use_structured_format = False
+                destination_string = current_destination
+                print(f"💬 [API] Pregunta sobre mismo destino - Usando respuesta directa contextualizada")
+    
+    # ============================================================
+    # PASO 8: Construir prompt según el formato a usar
+    # ============================================================
+    # Obtener el historial una sola vez (líneas ya renderizadas al guardar cada mensaje);
+    # el contexto se ajusta al presupuesto de tokens del formato. Delante de la
+    # ventana van los mensajes que ya salieron de ella pero aún no están en el
+    # resumen (se resume por lotes), para que ningún mensaje quede fuera de ambos
+    history_lines = conversation_history.get_unsummarized_lines(session_id)
+    history_lines.extend(conversation_history.get_context_lines(session_id, limit=conversation_history.context_window))
+    if pending_question is not None:
+        # La pregunta actual cierra el historial del prompt aunque se guarde junto con la respuesta
+        history_lines.append(render_context_line('user', pending_question))
+    # Resumen de los turnos anteriores a la ventana (se actualiza en segundo plano)
+    summary = conversation_history.get_summary(session_id)
+    summary_line = f"resumen | {summary}" if summary else ""
+    print(f"📚 [API] Contexto del historial: {len(history_lines)} mensajes{' + resumen' if summary else ''}")
+    
+    if use_structured_format:
+        prompt_format = "structured"
+        # Usar prompt estructurado (5 secciones) - código existente mejorado
+        base_prompt = load_prompt("travel_planning", question=query.question)
+        
+        history_kept = 0
+        
+        # Añadir contexto del historial si existe (optimizado en formato TOON)
+        if history_lines:
+            # Analizar si la pregunta es específica sobre un tema
+            question_lower = query.question.lower()
+            is_specific_question = any(word in question_lower for word in [
+                'transporte', 'comida', 'alojamiento', 'hotel', 'restaurante', 
+                'precio', 'costo', 'lugar', 'atracción', 'consejo'
+            ])
+            uses_reference = any(word in question_lower for word in [
+                'allí', 'ahí', 'ese', 'esa', 'este', 'esta', 'el', 'la', 'los', 'las'
+            ])
             
-            # Añadir contexto del historial si existe (optimizado en formato TOON)
-            if conversation_context:
-                # Analizar si la pregunta es específica sobre un tema
-                question_lower = query.question.lower()
-                is_specific_question = any(word in question_lower for word in [
-                    'transporte', 'comida', 'alojamiento', 'hotel', 'restaurante', 
-                    'precio', 'costo', 'lugar', 'atracción', 'consejo'
-                ])
-                uses_reference = any(word in question_lower for word in [
-                    'allí', 'ahí', 'ese', 'esa', 'este', 'esta', 'el', 'la', 'los', 'las'
-                ])
-                
-                # Construir contexto optimizado en formato TOON
-                context_parts = []
-                
-                if current_destination:
-                    context_parts.append(f"destino | {current_destination}")
-                
-                # Solo incluir historial relevante (últimas 3-4 interacciones para optimizar tokens)
-                recent_context = conversation_history.get_conversation_context(session_id, limit=6)
-                if recent_context:
-                    context_parts.append(f"historial | {recent_context}")
-                
-                # Instrucciones específicas según el tipo de pregunta
-                if uses_reference and current_destination:
-                    context_parts.append(f"referencia | pregunta usa 'allí/ahí/ese' → se refiere a {current_destination}")
+            # Construir contexto optimizado en formato TOON
+            context_parts = []
+            
+            if current_destination:
+                context_parts.append(f"destino | {current_destination}")
+            if summary_line:
+                context_parts.append(summary_line)
+            
+            # Instrucciones específicas según el tipo de pregunta
+            if uses_reference and current_destination:
+                context_parts.append(f"referencia | pregunta usa 'allí/ahí/ese' → se refiere a {current_destination}")
+            
+            if is_specific_question:
+                # Identificar el tema específico
+                topic = _detect_question_topic(question_lower)
                 
-                if is_specific_question:
-                    # Identificar el tema específico
-                    topic = None
-                    if any(word in question_lower for word in ['transporte', 'metro', 'autobús', 'taxi', 'movilidad']):
-                        topic = "transporte"
-                    elif any(word in question_lower for word in ['comida', 'restaurante', 'gastronomía', 'plato', 'comer']):
-                        topic = "comida"
-                    elif any(word in question_lower for word in ['alojamiento', 'hotel', 'hostal', 'dormir', 'hospedaje']):
-                        topic = "alojamiento"
-                    elif any(word in question_lower for word in ['precio', 'costo', 'gasto', 'presupuesto']):
-                        topic = "precios"
-                    
-                    if topic:
-                        context_parts.append(f"tema | pregunta específica sobre {topic} - enfócate en este tema con detalles")
-                    else:
-                        context_parts.append("enfoque | pregunta específica - enfócate en el tema pero completa todas las secciones")
+                if topic:
+                    context_parts.append(f"tema | pregunta específica sobre {topic} - enfócate en este tema con detalles")
                 else:
-                    context_parts.append("enfoque | pregunta general - proporciona información completa")
-                
-                context_section = "\n".join(context_parts)
-                prompt = context_section + "\n\n" + base_prompt
+                    context_parts.append("enfoque | pregunta específica - enfócate en el tema pero completa todas las secciones")
             else:
-                prompt = base_prompt
+                context_parts.append("enfoque | pregunta general - proporciona información completa")
             
-            print(f"📋 [API] Usando prompt estructurado (formato JSON con 5 secciones)")
-        else:
-            # Usar prompt contextualizado (respuesta directa)
-            if not current_destination:
-                # Si no hay destino actual, intentar extraer del historial o usar genérico
-                last_destination = conversation_history.extract_last_destination(session_id)
-                current_destination = last_destination or "el destino actual"
+            # El historial usa el presupuesto que queda tras la plantilla y el resto del contexto
+            budget = history_budget(prompt_format, base_prompt + "\n".join(context_parts) + "\nhistorial | ")
+            recent_context, history_kept = build_history_context(history_lines, budget)
+            if recent_context:
+                insert_at = (1 if current_destination else 0) + (1 if summary_line else 0)
+                context_parts.insert(insert_at, f"historial | {recent_context}")
             
-            base_prompt = load_prompt("travel_contextual", 
-                question=query.question,
-                current_destination=current_destination or "el destino actual",
-                conversation_history=conversation_context or "No hay historial previo"
-            )
+            context_section = "\n".join(context_parts)
+            prompt = context_section + "\n\n" + base_prompt
+        else:
             prompt = base_prompt
-            print(f"💬 [API] Usando prompt contextualizado (respuesta directa conversacional)")
-
-        # Inicializar el modelo de Gemini
-        # IMPORTANTE: Solo usamos modelos GRATUITOS de Gemini (modelos Flash)
-        # Los modelos Flash son gratuitos y no generan costos
-        # NO usar modelos Pro (gemini-pro, gemini-2.5-pro, etc.) ya que son de pago
-        
-        # Modelo por defecto: gemini-2.0-flash (100% gratuito)
-        GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
-        
-        # Lista de modelos gratuitos permitidos
-        FREE_MODELS = [
-            "gemini-2.0-flash",
-            "gemini-2.5-flash", 
-            "gemini-2.0-flash-lite",
-            "gemini-flash-latest",
-            "gemini-pro-latest"  # Gratuito con límites
-        ]
-        
-        # Validar que solo se usen modelos gratuitos (Flash)
-        # Verificar que el nombre del modelo contiene "flash" o es "gemini-pro-latest"
-        model_lower = GEMINI_MODEL.lower()
-        is_free_model = (
-            "flash" in model_lower or 
-            model_lower == "gemini-pro-latest" or
-            model_lower == "models/gemini-pro-latest"
-        )
         
-        if not is_free_model:
-            raise HTTPException(
-                status_code=400,
-                detail=f"❌ Modelo '{GEMINI_MODEL}' NO permitido. Solo se permiten modelos GRATUITOS de Gemini. " +
-                       f"Modelos permitidos: {', '.join(FREE_MODELS)}. " +
-                       "Los modelos Pro (gemini-2.5-pro, gemini-2.0-pro) son de pago y NO están permitidos."
-            )
+        prompt_size_stats.record(prompt_format, estimate_tokens(prompt), len(history_lines), history_kept)
+        print(f"📋 [API] Usando prompt estructurado (formato JSON con 5 secciones)")
+    else:
+        prompt_format = "contextual"
+        # Usar prompt contextualizado (respuesta directa)
+        if not current_destination:
+            # Si no hay destino actual, intentar extraer del historial o usar genérico
+            last_destination = conversation_history.extract_last_destination(session_id)
+            current_destination = last_destination or "el destino actual"
         
-        model = genai.GenerativeModel(GEMINI_MODEL)
+        prompt_kwargs = {
+            "question": query.question,
+            "current_destination": current_destination or "el destino actual",
+        }
+        budget = history_budget(prompt_format, load_prompt("travel_contextual", conversation_history=summary_line, **prompt_kwargs))
+        conversation_context, history_kept = build_history_context(history_lines, budget)
+        if summary_line:
+            conversation_context = f"{summary_line}\n{conversation_context}" if conversation_context else summary_line
+        base_prompt = load_prompt("travel_contextual", 
+            conversation_history=conversation_context or "No hay historial previo",
+            **prompt_kwargs
+        )
+        prompt = base_prompt
+        prompt_size_stats.record(prompt_format, estimate_tokens(prompt), len(history_lines), history_kept)
+        print(f"💬 [API] Usando prompt contextualizado (respuesta directa conversacional)")
+    
+    # Clave del cache de respuestas: solo primer turno estructurado sin historial
+    answer_cache_key = None
+    if travel_answer_cache.enabled and use_structured_format and not history_lines and destination_string:
+        canonical_destination = gazetteer.canonical_destination(destination_string) or destination_string.strip()
+        topic = _detect_question_topic(query.question.lower()) or "general"
+        answer_cache_key = (canonical_destination, topic)
+    
+    # Modelo gratuito, validado una sola vez al arrancar (ver gemini_models)
+    model = _get_gemini_model("travel")
+    
+    return {
+        "session_id": session_id,
+        "prompt": prompt,
+        "model": model,
+        "model_name": gemini_models.get_model_name("travel"),
+        "current_destination": current_destination,
+        "destination_string": destination_string,
+        "use_structured_format": use_structured_format,
+        "is_form_submission": is_form_submission,
+        "record_question": record_question,
+        "answer_cache_key": answer_cache_key,
+    }
+
+
+async def _with_timeout(coro, timeout: float, label: str):
+    """
+    Espera una rama de enriquecimiento con su propio timeout.
+    Si tarda demasiado o falla, se responde sin ella (devuelve None).
+    """
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        print(f"⏱️ Timeout de {timeout}s al obtener {label}, se responde sin este dato")
+    except Exception as e:
+        print(f"⚠️ Error al obtener {label}: {e}")
+    return None
+
+
+async def _get_travel_weather(destination_string: str) -> Optional[str]:
+    """Obtiene el mensaje de clima del destino (None si no está disponible)."""
+    if not weather_service.is_available():
+        print(f"⚠️ Servicio de clima no disponible (API key no configurada)")
+        return None
+    
+    # Intentar parsear el destino para obtener ciudad y país
+    destination = await parse_form_destination(destination_string)
+    if not destination:
+        return None
+    
+    city, country = destination
+    if not (city and country):
+        return None
+    
+    print(f"🌤️ Intentando obtener clima para: {city}, {country}")
+    weather_data = await weather_service.get_weather(city, country)
+    if weather_data:
+        print(f"✅ Clima obtenido exitosamente")
+        return weather_service.format_weather_message(weather_data)
+    print(f"❌ No se pudo obtener el clima para {city}, {country}")
+    return None
+
+
+async def _get_travel_photos(destination_string: str) -> Optional[List[Dict[str, Any]]]:
+    """Obtiene fotos del destino (None si no están disponibles)."""
+    if not unsplash_service.is_available():
+        print(f"⚠️ Servicio de fotos no disponible (API key no configurada)")
+        return None
+    
+    print(f"📸 Intentando obtener fotos para: {destination_string}")
+    photos = await unsplash_service.get_photos(destination_string, 3)
+    if photos:
+        print(f"✅ {len(photos)} fotos obtenidas exitosamente")
+    else:
+        print(f"❌ No se pudo obtener fotos para {destination_string}")
+    return photos
+
+
+async def _get_travel_enrichment(destination_string: Optional[str]) -> Tuple[Optional[str], Optional[List[Dict[str, Any]]]]:
+    """
+    Obtiene clima y fotos para el destino de la conversación en paralelo.
+    Cada rama tiene su propio timeout: una API lenta no retrasa la respuesta.
+    Se lanza junto a la llamada a Gemini (ver _start_travel_enrichment).
+    
+    Args:
+        destination_string: Destino en formato "Ciudad, País" (puede ser None)
         
-        print(f"🤖 [API] Enviando prompt a Gemini (modelo: {GEMINI_MODEL})")
-        print(f"📏 [API] Longitud del prompt: {len(prompt)} caracteres")
-        print(f"📋 [API] Primeros 300 caracteres del prompt:\n{prompt[:300]}...")
-        print(f"⚠️ [API] IMPORTANTE: Consultando DIRECTAMENTE a Gemini (NO hay caché de respuestas)")
+    Returns:
+        Tupla (mensaje_clima, fotos)
+    """
+    if not destination_string:
+        print(f"⚠️ No se pudo obtener el destino para clima/fotos")
+        return None, None
+    
+    weather_message, photos = await asyncio.gather(
+        _with_timeout(_get_travel_weather(destination_string), ENRICHMENT_WEATHER_TIMEOUT, "clima"),
+        _with_timeout(_get_travel_photos(destination_string), ENRICHMENT_PHOTOS_TIMEOUT, "fotos"),
+    )
+    return weather_message, photos
+
+
+async def _summarize_conversation(previous_summary: Optional[str], lines: List[str]) -> str:
+    """
+    Actualiza con Gemini el resumen de una conversación (se ejecuta en segundo
+    plano, ver ConversationHistory). Si falla, el historial usa el resumen local.
+    
+    Args:
+        previous_summary: Resumen anterior (None si no hay)
+        lines: Líneas del historial que salieron de la ventana del prompt
         
-        # Generar la respuesta - SIEMPRE se consulta a Gemini, nunca se usa caché
-        response = model.generate_content(prompt)
+    Returns:
+        Resumen actualizado
+    """
+    if not gemini_models.is_available():
+        raise RuntimeError("Gemini no está configurado")
+    prompt = load_prompt(
+        "conversation_summary",
+        previous_summary=previous_summary or "ninguno",
+        messages="\n".join(lines),
+        max_chars=conversation_history.summary_max_chars
+    )
+    return await gemini_client.generate_text(prompt, gemini_models.get("summary"))
+
+
+if CONVERSATION_SUMMARY_WITH_GEMINI:
+    conversation_history.summarizer = _summarize_conversation
+
+
+async def _snapshot_conversations_periodically() -> None:
+    """
+    Guarda el snapshot de conversaciones cada CONVERSATION_SNAPSHOT_INTERVAL segundos.
+    En el event loop solo se copia el estado de las sesiones; la serialización
+    y la escritura del fichero se hacen en otro hilo.
+    """
+    while True:
+        await asyncio.sleep(CONVERSATION_SNAPSHOT_INTERVAL)
+        try:
+            records = conversation_history.snapshot_records()
+            count = await asyncio.to_thread(write_snapshot, CONVERSATION_SNAPSHOT_PATH, records)
+            print(f"💾 [HISTORY] Snapshot periódico guardado: {count} sesiones")
+        except (OSError, ValueError) as e:
+            print(f"⚠️ [HISTORY] No se pudo guardar el snapshot: {e}")
+
+
+def _start_travel_enrichment(prepared: Dict[str, Any]) -> asyncio.Task:
+    """
+    Lanza el enriquecimiento (clima y fotos) en segundo plano.
+    Solo depende del destino, así que corre mientras Gemini genera la respuesta.
+    
+    Args:
+        prepared: Contexto devuelto por _prepare_travel_request
+        
+    Returns:
+        Tarea que devuelve (mensaje_clima, fotos)
+    """
+    return asyncio.create_task(_get_travel_enrichment(prepared["destination_string"]))
+
+
+def _record_travel_exchange(prepared: Dict[str, Any], question: str, response_text: str) -> None:
+    """
+    Registra en el historial la pregunta (si no se añadió antes) y la respuesta del
+    asistente, juntas y sin await entre ambas: peticiones concurrentes de la misma
+    sesión no pueden intercalar sus preguntas y respuestas.
+    
+    Args:
+        prepared: Contexto devuelto por _prepare_travel_request
+        question: Pregunta del usuario
+        response_text: Respuesta completa de Gemini
+    """
+    session_id = prepared["session_id"]
+    
+    if prepared["record_question"]:
+        conversation_history.add_message(session_id, 'user', question)
+        print(f"💬 [API] Pregunta añadida al historial")
+    
+    # Añadir respuesta del asistente al historial
+    conversation_history.add_message(session_id, 'assistant', response_text)
+    print(f"💬 [API] Respuesta añadida al historial")
+
+
+def _build_travel_response(prepared: Dict[str, Any], response_text: str, weather_message: Optional[str],
+                           photos: Optional[List[Dict[str, Any]]]) -> TravelResponse:
+    """Construye la respuesta final de /api/travel a partir del contexto preparado."""
+    use_structured_format = prepared["use_structured_format"]
+    
+    print(f"✅ [API] Respuesta final preparada")
+    print(f"📊 [API] Resumen: respuesta={len(response_text)} chars, formato={'estructurado' if use_structured_format else 'contextual'}, clima={'sí' if weather_message else 'no'}, fotos={len(photos) if photos else 0}")
+    print(f"{'='*80}\n")
+    
+    return TravelResponse(
+        answer=response_text, 
+        weather=weather_message, 
+        photos=photos,
+        session_id=prepared["session_id"],
+        requires_confirmation=False,
+        detected_destination=None,
+        current_destination=prepared["current_destination"],
+        response_format="structured" if use_structured_format else "contextual"
+    )
+
+
+@app.post("/api/travel", response_model=TravelResponse)
+async def plan_travel(query: TravelQuery):
+    """
+    Endpoint para procesar preguntas sobre viajes usando Google Gemini
+    Mantiene historial de conversación para contexto
+    """
+    try:
+        prepared = await _prepare_travel_request(query)
+        if isinstance(prepared, TravelResponse):
+            await conversation_history.flush()
+            return prepared
         
-        print(f"✅ [API] Respuesta recibida de Gemini (consulta directa, no desde caché)")
+        prompt = prepared["prompt"]
+        answer_cache_key = prepared["answer_cache_key"]
         
-        # Extraer el texto de la respuesta
-        if not response:
-            raise HTTPException(
-                status_code=500,
-                detail="No se recibió respuesta de Gemini"
-            )
+        # Clima y fotos se obtienen mientras Gemini genera la respuesta
+        enrichment_task = _start_travel_enrichment(prepared)
         
-        # Verificar que la respuesta tenga texto
-        # Gemini puede devolver el texto de diferentes formas
-        response_text = None
-        if hasattr(response, 'text') and response.text:
-            response_text = response.text
-        elif hasattr(response, 'candidates') and response.candidates:
-            # Intentar obtener el texto de los candidatos
-            if len(response.candidates) > 0:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                    parts = candidate.content.parts
-                    if parts and len(parts) > 0:
-                        response_text = parts[0].text if hasattr(parts[0], 'text') else str(parts[0])
-        
-        if not response_text:
-            raise HTTPException(
-                status_code=500,
-                detail="La respuesta de Gemini está vacía o en formato inesperado"
-            )
+        try:
+            # Primer turno estructurado sin historial: probar el cache de respuestas (opcional)
+            response_text = travel_answer_cache.get(*answer_cache_key) if answer_cache_key else None
+            
+            if response_text is None:
+                print(f"🤖 [API] Enviando prompt a Gemini (modelo: {prepared['model_name']})")
+                print(f"📏 [API] Longitud del prompt: {len(prompt)} caracteres")
+                print(f"📋 [API] Primeros 300 caracteres del prompt:\n{prompt[:300]}...")
+                
+                # La llamada se ejecuta en el pool de hilos de gemini_client para no bloquear el event loop
+                response_text = await gemini_client.generate_text(prompt, prepared["model"])
+                
+                print(f"✅ [API] Respuesta recibida de Gemini")
+                
+                if not response_text:
+                    raise HTTPException(
+                        status_code=500,
+                        detail="La respuesta de Gemini está vacía o en formato inesperado"
+                    )
+                
+                if answer_cache_key:
+                    travel_answer_cache.set(*answer_cache_key, response_text)
+        except BaseException:
+            enrichment_task.cancel()
+            raise
         
         print(f"📝 [API] Respuesta de Gemini (primeros 200 caracteres): {response_text[:200]}...")
         print(f"📏 [API] Longitud de la respuesta: {len(response_text)} caracteres")
@@ -688,66 +1032,14 @@ async def plan_travel(query: TravelQuery):
         # ============================================================
         # PASO 9: Consultar a Gemini y procesar respuesta
         # ============================================================
-        # Si no se añadió la pregunta al historial antes (solo para formularios), añadirla ahora
-        if is_form_submission:
-            conversation_history.add_message(session_id, 'user', query.question)
-            print(f"💬 [API] Pregunta añadida al historial")
-        
-        # Procesar clima y fotos solo si hay destination_string válido
-        weather_message = None
-        photos = None
-        destination = None
-        
-        if destination_string:
-            # Intentar parsear el destino para obtener ciudad y país
-            destination = parse_form_destination(destination_string)
-            
-            # Obtener clima
-            if weather_service.is_available():
-                if destination:
-                    city, country = destination
-                    if city and country:
-                        print(f"🌤️ Intentando obtener clima para: {city}, {country}")
-                        weather_data = weather_service.get_weather(city, country)
-                        if weather_data:
-                            weather_message = weather_service.format_weather_message(weather_data)
-                            print(f"✅ Clima obtenido exitosamente")
-                        else:
-                            print(f"❌ No se pudo obtener el clima para {city}, {country}")
-            
-            # Obtener fotos
-            if unsplash_service.is_available():
-                print(f"📸 Intentando obtener fotos para: {destination_string}")
-                photos = unsplash_service.get_photos(destination_string, count=3)
-                if photos:
-                    print(f"✅ {len(photos)} fotos obtenidas exitosamente")
-                else:
-                    print(f"❌ No se pudo obtener fotos para {destination_string}")
-            else:
-                print(f"⚠️ Servicio de fotos no disponible (API key no configurada)")
-        else:
-            print(f"⚠️ No se pudo obtener el destino para clima/fotos")
-            if not weather_service.is_available():
-                print(f"⚠️ Servicio de clima no disponible (API key no configurada)")
+        # Gemini puede tardar: revalidar la sesión contra el store (fuera del event loop) antes de registrar
+        await conversation_history.prefetch(prepared["session_id"])
+        _record_travel_exchange(prepared, query.question, response_text)
+        weather_message, photos = await enrichment_task
+        # Antes de responder el historial debe estar en el store (la siguiente petición puede ir a otro worker)
+        await conversation_history.flush()
         
-        # Añadir respuesta del asistente al historial
-        conversation_history.add_message(session_id, 'assistant', response_text)
-        print(f"💬 [API] Respuesta añadida al historial")
-        
-        print(f"✅ [API] Respuesta final preparada")
-        print(f"📊 [API] Resumen: respuesta={len(response_text)} chars, formato={'estructurado' if use_structured_format else 'contextual'}, clima={'sí' if weather_message else 'no'}, fotos={len(photos) if photos else 0}")
-        print(f"{'='*80}\n")
-        
-        return TravelResponse(
-            answer=response_text, 
-            weather=weather_message, 
-            photos=photos,
-            session_id=session_id,
-            requires_confirmation=False,
-            detected_destination=None,
-            current_destination=current_destination,
-            response_format="structured" if use_structured_format else "contextual"
-        )
+        return _build_travel_response(prepared, response_text, weather_message, photos)
         
     except HTTPException:
         # Re-lanzar excepciones HTTP directamente
@@ -763,6 +1055,104 @@ async def plan_travel(query: TravelQuery):
         raise HTTPException(status_code=500, detail=full_error)
 
 
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Formatea un evento Server-Sent Events con datos JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/travel/stream")
+async def plan_travel_stream(query: TravelQuery):
+    """
+    Variante en streaming de /api/travel usando Server-Sent Events.
+    
+    Eventos emitidos:
+    - start: session_id, destino actual y formato de la respuesta
+    - chunk: fragmento de texto de Gemini ({"text": ...})
+    - done: TravelResponse completo (incluye clima y fotos)
+    - error: detalle del error si Gemini falla durante el stream
+    
+    El historial solo se actualiza cuando el stream termina correctamente.
+    """
+    try:
+        prepared = await _prepare_travel_request(query)
+    except HTTPException:
+        raise
+    except Exception as e:
+        error_type = type(e).__name__
+        error_message = str(e) if str(e) else "Error desconocido"
+        full_error = f"Error al procesar la solicitud ({error_type}): {error_message}"
+        print(f"Error completo: {full_error}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=full_error)
+    
+    async def event_stream():
+        # Confirmaciones y aclaraciones no consultan a Gemini: un único evento final
+        if isinstance(prepared, TravelResponse):
+            await conversation_history.flush()
+            yield _sse_event("done", prepared.model_dump())
+            return
+        
+        response_format = "structured" if prepared["use_structured_format"] else "contextual"
+        yield _sse_event("start", {
+            "session_id": prepared["session_id"],
+            "current_destination": prepared["current_destination"],
+            "response_format": response_format
+        })
+        
+        answer_cache_key = prepared["answer_cache_key"]
+        chunks: List[str] = []
+        enrichment_task = _start_travel_enrichment(prepared)
+        try:
+            # Respuesta cacheada (primer turno estructurado sin historial): un único fragmento
+            cached_text = travel_answer_cache.get(*answer_cache_key) if answer_cache_key else None
+            if cached_text is not None:
+                chunks.append(cached_text)
+                yield _sse_event("chunk", {"text": cached_text})
+            else:
+                print(f"🤖 [API] Enviando prompt a Gemini en streaming (modelo: {prepared['model_name']})")
+                print(f"📏 [API] Longitud del prompt: {len(prepared['prompt'])} caracteres")
+                
+                async for text in gemini_client.stream_text(prepared["prompt"], prepared["model"]):
+                    chunks.append(text)
+                    yield _sse_event("chunk", {"text": text})
+            
+            response_text = "".join(chunks)
+            if not response_text:
+                yield _sse_event("error", {"detail": "La respuesta de Gemini está vacía o en formato inesperado"})
+                return
+            
+            if cached_text is None:
+                print(f"✅ [API] Stream de Gemini completado ({len(chunks)} fragmentos, {len(response_text)} caracteres)")
+                if answer_cache_key:
+                    travel_answer_cache.set(*answer_cache_key, response_text)
+            
+            await conversation_history.prefetch(prepared["session_id"])
+            _record_travel_exchange(prepared, query.question, response_text)
+            weather_message, photos = await enrichment_task
+            await conversation_history.flush()
+            response = _build_travel_response(prepared, response_text, weather_message, photos)
+            yield _sse_event("done", response.model_dump())
+        except Exception as e:
+            error_type = type(e).__name__
+            error_message = str(e) if str(e) else "Error desconocido"
+            full_error = f"Error al procesar la solicitud ({error_type}): {error_message}"
+            print(f"Error completo: {full_error}")
+            yield _sse_event("error", {"detail": full_error})
+        finally:
+            # Si el stream falla o el cliente se desconecta, no seguir enriqueciendo
+            enrichment_task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Evitar buffering en proxies (nginx, Railway)
+        }
+    )
+
+
 @app.post("/api/travel/confirm-destination")
 async def confirm_destination_change(confirmation: DestinationConfirmation):
     """
@@ -775,6 +1165,7 @@ async def confirm_destination_change(confirmation: DestinationConfirmation):
         print(f"📍 [API] Nuevo destino: {confirmation.new_destination}")
         print(f"✅ [API] Confirmado: {confirmation.confirmed}")
         
+        await conversation_history.prefetch(confirmation.session_id)
         if confirmation.confirmed:
             # Actualizar destino actual
             conversation_history.set_current_destination(confirmation.session_id, confirmation.new_destination)
@@ -792,6 +1183,7 @@ async def confirm_destination_change(confirmation: DestinationConfirmation):
                 # Procesar la pregunta con el nuevo destino
                 return await plan_travel(travel_query)
             else:
+                await conversation_history.flush()
                 return {
                     "status": "confirmed",
                     "new_destination": confirmation.new_destination,
@@ -814,10 +1206,79 @@ async def confirm_destination_change(confirmation: DestinationConfirmation):
         )
 
 
+async def _preprocess_destinations(destinations: List[str], label: str) -> None:
+    """
+    Pre-procesa destinos para preparar información del clima.
+    Parsea cada destino y obtiene códigos ISO usando Gemini (con cache),
+    en paralelo para no sumar la latencia de cada consulta.
+    
+    Args:
+        destinations: Destinos en formato "Ciudad, País"
+        label: Etiqueta para los logs
+    """
+    async def preprocess(dest: str) -> None:
+        try:
+            # Parsear destino (esto obtiene código ISO con Gemini si no está en cache)
+            parsed = await parse_form_destination(dest)
+            if parsed:
+                city, country_code = parsed
+                print(f"✅ {label} pre-procesado para cache: {dest} → ({city}, {country_code})")
+        except Exception as e:
+            # No fallar si hay error en pre-procesamiento, es solo optimización
+            print(f"⚠️ Error al pre-procesar {label.lower()} {dest}: {e}")
+    
+    await asyncio.gather(*(preprocess(dest) for dest in destinations))
+
+
+async def _fetch_popular_destinations() -> Optional[List[str]]:
+    """
+    Consulta a Gemini los 5 destinos más populares y los pre-procesa.
+    
+    Returns:
+        Lista de destinos o None si la respuesta no se pudo parsear
+    """
+    # Cargar prompt optimizado en formato TOON desde archivo
+    prompt = load_prompt("popular_destinations")
+
+    # Modelo gratuito, validado una sola vez al arrancar (ver gemini_models)
+    model = _get_gemini_model("popular")
+    
+    # Generar la respuesta sin bloquear el event loop
+    response_text = await gemini_client.generate_text(prompt, model)
+    
+    if not response_text:
+        raise HTTPException(
+            status_code=500,
+            detail="La respuesta de Gemini está vacía o en formato inesperado"
+        )
+    
+    # Parsear respuesta usando parser simple
+    destinations = parse_destinations_simple(response_text)
+    
+    # Validar y limitar a 5 destinos
+    if not destinations:
+        return None
+    
+    destinations = destinations[:5]
+    await _preprocess_destinations(destinations, "Destino popular")
+    return destinations
+
+
+# Destinos por defecto si Gemini falla o la respuesta no se puede parsear
+DEFAULT_POPULAR_DESTINATIONS = [
+    "París, Francia",
+    "Tokio, Japón",
+    "Nueva York, Estados Unidos",
+    "Bali, Indonesia",
+    "Barcelona, España"
+]
+
+
 @app.get("/api/destinations/popular", response_model=DestinationsResponse)
 async def get_popular_destinations():
     """
-    Endpoint para obtener los 5 destinos más populares/recomendados usando Gemini
+    Endpoint para obtener los 5 destinos más populares/recomendados usando Gemini.
+    La lista se sirve desde cache y se refresca en segundo plano antes de expirar.
     """
     try:
         # Verificar que la API key esté configurada
@@ -827,100 +1288,13 @@ async def get_popular_destinations():
                 detail="API key de Gemini no configurada. Por favor, configura la variable de entorno GEMINI_API_KEY. Ver SECRETS.md para instrucciones."
             )
         
-        # Cargar prompt optimizado en formato TOON desde archivo
-        prompt = load_prompt("popular_destinations")
-
-        # Inicializar el modelo de Gemini
-        GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
-        
-        # Validar que solo se usen modelos gratuitos (Flash)
-        model_lower = GEMINI_MODEL.lower()
-        is_free_model = (
-            "flash" in model_lower or 
-            model_lower == "gemini-pro-latest" or
-            model_lower == "models/gemini-pro-latest"
-        )
-        
-        if not is_free_model:
-            raise HTTPException(
-                status_code=400,
-                detail=f"❌ Modelo '{GEMINI_MODEL}' NO permitido. Solo se permiten modelos GRATUITOS de Gemini."
-            )
-        
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        
-        # Generar la respuesta
-        response = model.generate_content(prompt)
-        
-        # Extraer el texto de la respuesta
-        if not response:
-            raise HTTPException(
-                status_code=500,
-                detail="No se recibió respuesta de Gemini"
-            )
-        
-        response_text = None
-        if hasattr(response, 'text') and response.text:
-            response_text = response.text
-        elif hasattr(response, 'candidates') and response.candidates:
-            if len(response.candidates) > 0:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                    parts = candidate.content.parts
-                    if parts and len(parts) > 0:
-                        response_text = parts[0].text if hasattr(parts[0], 'text') else str(parts[0])
-        
-        if not response_text:
-            raise HTTPException(
-                status_code=500,
-                detail="La respuesta de Gemini está vacía o en formato inesperado"
-            )
-        
-        # Parsear respuesta usando parser simple
-        destinations = parse_destinations_simple(response_text)
-        
-        # Validar y limitar a 5 destinos
-        if destinations and len(destinations) > 0:
-            destinations = destinations[:5]
-            
-            # Pre-procesar destinos para preparar información del clima
-            # Esto parsea cada destino y obtiene códigos ISO usando Gemini (con cache)
-            from weather import parse_form_destination
-            
-            for dest in destinations:
-                try:
-                    # Parsear destino (esto obtiene código ISO con Gemini si no está en cache)
-                    parsed = parse_form_destination(dest)
-                    if parsed:
-                        city, country_code = parsed
-                        print(f"✅ Destino popular pre-procesado para cache: {dest} → ({city}, {country_code})")
-                except Exception as e:
-                    # No fallar si hay error en pre-procesamiento, es solo optimización
-                    print(f"⚠️ Error al pre-procesar destino popular {dest}: {e}")
-            
+        destinations = await popular_destinations_cache.get(_fetch_popular_destinations)
+        if destinations:
             return DestinationsResponse(destinations=destinations)
         
-        # Si falla el parseo, devolver destinos por defecto
-        default_destinations = [
-            "París, Francia",
-            "Tokio, Japón",
-            "Nueva York, Estados Unidos",
-            "Bali, Indonesia",
-            "Barcelona, España"
-        ]
-        
-        # Pre-procesar destinos por defecto también
-        from weather import parse_form_destination
-        for dest in default_destinations:
-            try:
-                parsed = parse_form_destination(dest)
-                if parsed:
-                    city, country_code = parsed
-                    print(f"✅ Destino por defecto pre-procesado para cache: {dest} → ({city}, {country_code})")
-            except Exception as e:
-                print(f"⚠️ Error al pre-procesar destino por defecto {dest}: {e}")
-        
-        return DestinationsResponse(destinations=default_destinations)
+        # Si falla el parseo, devolver destinos por defecto (sin cachearlos)
+        await _preprocess_destinations(DEFAULT_POPULAR_DESTINATIONS, "Destino por defecto")
+        return DestinationsResponse(destinations=list(DEFAULT_POPULAR_DESTINATIONS))
         
     except HTTPException:
         raise
@@ -932,32 +1306,37 @@ async def get_popular_destinations():
         import traceback
         traceback.print_exc()
         # En caso de error, devolver destinos por defecto
-        default_destinations = [
-            "París, Francia",
-            "Tokio, Japón",
-            "Nueva York, Estados Unidos",
-            "Bali, Indonesia",
-            "Barcelona, España"
-        ]
-        
-        # Pre-procesar destinos por defecto también
-        from weather import parse_form_destination
-        for dest in default_destinations:
-            try:
-                parsed = parse_form_destination(dest)
-                if parsed:
-                    city, country_code = parsed
-                    print(f"✅ Destino por defecto (error) pre-procesado para cache: {dest} → ({city}, {country_code})")
-            except Exception as e:
-                print(f"⚠️ Error al pre-procesar destino por defecto {dest}: {e}")
-        
-        return DestinationsResponse(destinations=default_destinations)
+        await _preprocess_destinations(DEFAULT_POPULAR_DESTINATIONS, "Destino por defecto (error)")
+        return DestinationsResponse(destinations=list(DEFAULT_POPULAR_DESTINATIONS))
+
+
+@app.get("/api/destinations/popular/cache/stats")
+def get_popular_destinations_cache_stats():
+    """
+    Endpoint para obtener estadísticas del cache de destinos populares.
+    """
+    return {
+        "cache_stats": popular_destinations_cache.get_stats()
+    }
+
+
+@app.post("/api/destinations/popular/cache/clear")
+def clear_popular_destinations_cache():
+    """
+    Endpoint para limpiar el cache de destinos populares.
+    """
+    popular_destinations_cache.clear()
+    return {
+        "message": "Cache de destinos populares limpiado exitosamente",
+        "cleared": True
+    }
 
 
 @app.post("/api/destinations/search", response_model=DestinationsResponse)
 async def search_destinations(search_query: DestinationSearchQuery):
     """
-    Endpoint para buscar destinos basado en lo que el usuario está escribiendo usando Gemini
+    Endpoint para buscar destinos basado en lo que el usuario está escribiendo.
+    Usa el gazetteer local y, si no hay coincidencias, Gemini.
     """
     try:
         # Verificar que la API key esté configurada
@@ -973,77 +1352,41 @@ async def search_destinations(search_query: DestinationSearchQuery):
         
         query = search_query.query.strip()
         
+        # Responder desde el gazetteer local (ordenado por población); Gemini solo si no hay coincidencias
+        local_destinations = gazetteer.search(query)
+        if local_destinations:
+            print(f"🗺️  Gazetteer HIT para búsqueda '{query}' ({len(local_destinations)} resultados)")
+            return DestinationsResponse(destinations=local_destinations)
+        
+        # Consultar el cache (búsqueda exacta o filtrando un prefijo ya respondido)
+        cached_destinations = destination_search_cache.get(query)
+        if cached_destinations is not None:
+            return DestinationsResponse(destinations=cached_destinations)
+        
         # Cargar prompt optimizado en formato TOON desde archivo
         prompt = load_prompt("search_destinations", query=query)
 
-        # Inicializar el modelo de Gemini
-        GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
-        
-        # Validar que solo se usen modelos gratuitos (Flash)
-        model_lower = GEMINI_MODEL.lower()
-        is_free_model = (
-            "flash" in model_lower or 
-            model_lower == "gemini-pro-latest" or
-            model_lower == "models/gemini-pro-latest"
-        )
-        
-        if not is_free_model:
-            raise HTTPException(
-                status_code=400,
-                detail=f"❌ Modelo '{GEMINI_MODEL}' NO permitido. Solo se permiten modelos GRATUITOS de Gemini."
-            )
+        # Modelo gratuito, validado una sola vez al arrancar (ver gemini_models)
+        model = _get_gemini_model("search")
         
-        model = genai.GenerativeModel(GEMINI_MODEL)
+        # Generar la respuesta sin bloquear el event loop
+        response_text = await gemini_client.generate_text(prompt, model)
         
-        # Generar la respuesta
-        response = model.generate_content(prompt)
+        # Parsear respuesta usando parser simple (respuesta vacía = sin resultados)
+        destinations = parse_destinations_simple(response_text) if response_text else []
         
-        # Extraer el texto de la respuesta
-        if not response:
-            return DestinationsResponse(destinations=[])
-        
-        response_text = None
-        if hasattr(response, 'text') and response.text:
-            response_text = response.text
-        elif hasattr(response, 'candidates') and response.candidates:
-            if len(response.candidates) > 0:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                    parts = candidate.content.parts
-                    if parts and len(parts) > 0:
-                        response_text = parts[0].text if hasattr(parts[0], 'text') else str(parts[0])
-        
-        if not response_text:
-            return DestinationsResponse(destinations=[])
+        # Validar y limitar a 5 destinos
+        destinations = destinations[:5]
         
-        # Parsear respuesta usando parser simple
-        destinations = parse_destinations_simple(response_text)
+        # Guardar en cache, incluidas las búsquedas sin resultados
+        destination_search_cache.set(query, destinations)
         
-        # Validar y limitar a 5 destinos
-        if destinations and len(destinations) > 0:
-            destinations = destinations[:5]
-            
+        if destinations:
             # Pre-procesar destinos para preparar información del clima
-            # Esto parsea cada destino y obtiene códigos ISO usando Gemini (con cache)
             # Como usa cache, es rápido y no bloquea significativamente la respuesta
-            from weather import parse_form_destination
-            
-            for dest in destinations:
-                try:
-                    # Parsear destino (esto obtiene código ISO con Gemini si no está en cache)
-                    # Si ya está en cache, es instantáneo
-                    parsed = parse_form_destination(dest)
-                    if parsed:
-                        city, country_code = parsed
-                        print(f"✅ Destino pre-procesado para cache: {dest} → ({city}, {country_code})")
-                except Exception as e:
-                    # No fallar si hay error en pre-procesamiento, es solo optimización
-                    print(f"⚠️ Error al pre-procesar destino {dest}: {e}")
-            
-            return DestinationsResponse(destinations=destinations)
+            await _preprocess_destinations(destinations, "Destino")
         
-        # Si falla el parseo, devolver lista vacía
-        return DestinationsResponse(destinations=[])
+        return DestinationsResponse(destinations=destinations)
         
     except HTTPException:
         raise
@@ -1058,6 +1401,79 @@ async def search_destinations(search_query: DestinationSearchQuery):
         return DestinationsResponse(destinations=[])
 
 
+@app.get("/api/destinations/search/cache/stats")
+def get_destination_search_cache_stats():
+    """
+    Endpoint para obtener estadísticas del cache de búsqueda de destinos.
+    """
+    return {
+        "cache_stats": destination_search_cache.get_stats(),
+        "gazetteer_stats": gazetteer.get_stats()
+    }
+
+
+@app.post("/api/destinations/search/cache/clear")
+def clear_destination_search_cache():
+    """
+    Endpoint para limpiar el cache de búsqueda de destinos.
+    """
+    destination_search_cache.clear()
+    return {
+        "message": "Cache de búsqueda de destinos limpiado exitosamente",
+        "cleared": True
+    }
+
+
+@app.get("/api/travel/answer-cache/stats")
+def get_travel_answer_cache_stats():
+    """
+    Endpoint para obtener estadísticas del cache de respuestas de viaje.
+    """
+    return {
+        "cache_stats": travel_answer_cache.get_stats()
+    }
+
+
+@app.post("/api/travel/answer-cache/invalidate")
+def invalidate_travel_answer_cache(request: AnswerCacheInvalidation):
+    """
+    Endpoint para invalidar las respuestas cacheadas de un destino
+    (p.ej. tras un cambio relevante en el destino).
+    """
+    destination = gazetteer.canonical_destination(request.destination) or request.destination.strip()
+    removed = travel_answer_cache.invalidate_destination(destination)
+    return {
+        "message": f"Respuestas cacheadas de '{destination}' invalidadas",
+        "destination": destination,
+        "removed": removed
+    }
+
+
+@app.post("/api/travel/answer-cache/clear")
+def clear_travel_answer_cache():
+    """
+    Endpoint para limpiar el cache de respuestas de viaje.
+    """
+    travel_answer_cache.clear()
+    return {
+        "message": "Cache de respuestas de viaje limpiado exitosamente",
+        "cleared": True
+    }
+
+
+@app.get("/api/gemini/stats")
+def get_gemini_stats():
+    """
+    Endpoint para obtener estadísticas de las llamadas a Gemini
+    (modelos configurados y prompts idénticos coalescidos).
+    """
+    return {
+        "client_stats": gemini_client.get_stats(),
+        "models": gemini_models.get_stats(),
+        "prompt_sizes": prompt_size_stats.get_stats()
+    }
+
+
 @app.get("/api/health")
 def health_check():
     return {"status": "ok"}
@@ -1077,7 +1493,7 @@ def get_weather_cache_stats():
     stats = weather_service.cache.get_stats()
     return {
         "cache_stats": stats,
-        "api_available": not weather_service.api_unavailable
+        "api_available": not weather_service.circuit_breaker.is_open()
     }
 
 
@@ -1130,12 +1546,16 @@ class RealtimeInfoQuery(BaseModel):
 
 class ConversationHistoryRequest(BaseModel):
     session_id: str
+    after: Optional[int] = None  # Índice del último mensaje que ya tiene el cliente
+    limit: Optional[int] = None  # Máximo de mensajes a devolver
 
 
 class ConversationHistoryResponse(BaseModel):
     session_id: str
     messages: List[Dict[str, Any]]
     stats: Dict[str, Any]
+    next_after: Optional[int] = None  # Cursor para pedir solo los mensajes nuevos
+    has_more: bool = False
 
 
 @app.post("/api/realtime-info")
@@ -1153,7 +1573,7 @@ async def get_realtime_info(query: RealtimeInfoQuery):
                 detail="El destino es requerido"
             )
         
-        info = realtime_info_service.get_realtime_info(query.destination)
+        info = await realtime_info_service.get_realtime_info(query.destination)
         
         if not info:
             raise HTTPException(
@@ -1181,6 +1601,7 @@ async def create_conversation_session():
     Crea una nueva sesión de conversación
     """
     session_id = conversation_history.create_session()
+    await conversation_history.flush()
     return {
         "session_id": session_id,
         "message": "Sesión de conversación creada exitosamente"
@@ -1193,20 +1614,71 @@ async def get_conversation_history(request: ConversationHistoryRequest):
     Obtiene el historial de una conversación
     """
     session_id = request.session_id
+    await conversation_history.prefetch(session_id)
     
-    if session_id not in conversation_history.get_all_sessions():
+    if not conversation_history.has_session(session_id):
         raise HTTPException(
             status_code=404,
             detail="Sesión no encontrada"
         )
     
-    messages = conversation_history.get_history(session_id)
-    stats = conversation_history.get_session_stats(session_id)
+    return _conversation_history_page(session_id, request.after, request.limit)
+
+
+@app.get("/api/conversation/history/{session_id}", response_model=ConversationHistoryResponse)
+async def get_conversation_history_delta(
+    session_id: str,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Obtiene los mensajes de una conversación posteriores a `after` (todos si no se indica).
+    
+    Envía un ETag derivado de la versión de la sesión: si el cliente manda el
+    mismo en If-None-Match y la sesión no cambió, responde 304 sin cuerpo.
+    """
+    await conversation_history.prefetch(session_id)
+    version = conversation_history.get_version(session_id)
+    if version is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Sesión no encontrada"
+        )
     
+    etag = f'"{conversation_history.version_tag}-{version}-{after}-{limit}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    page = _conversation_history_page(session_id, after, limit)
+    return JSONResponse(content=page.model_dump(), headers=headers)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Compara If-None-Match con el ETag actual (comparación débil, como indica HTTP)."""
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _conversation_history_page(session_id: str, after: Optional[int], limit: Optional[int]) -> ConversationHistoryResponse:
+    """
+    Construye la respuesta del historial a partir del cursor after/limit.
+    """
+    if limit is not None and limit < 1:
+        raise HTTPException(
+            status_code=400,
+            detail="limit debe ser mayor que 0"
+        )
+    
+    page = conversation_history.get_history_page(session_id, after, limit)
     return ConversationHistoryResponse(
         session_id=session_id,
-        messages=messages,
-        stats=stats
+        messages=page['messages'],
+        stats=conversation_history.get_session_stats(session_id),
+        next_after=page['next_after'],
+        has_more=page['has_more']
     )
 
 
@@ -1216,17 +1688,58 @@ async def clear_conversation_history(request: ConversationHistoryRequest):
     Limpia el historial de una conversación
     """
     session_id = request.session_id
+    await conversation_history.prefetch(session_id)
     
-    if session_id not in conversation_history.get_all_sessions():
+    if not conversation_history.has_session(session_id):
         raise HTTPException(
             status_code=404,
             detail="Sesión no encontrada"
         )
     
     conversation_history.clear_session(session_id)
+    await conversation_history.flush()
     
     return {
         "session_id": session_id,
         "message": "Historial limpiado exitosamente"
     }
 
+
+
+@app.get("/api/conversation/stats")
+async def get_conversation_stats():
+    """
+    Obtiene estadísticas globales del historial de conversaciones
+    (sesiones activas, memoria usada y expulsiones por inactividad o capacidad)
+    """
+    return {
+        "status": "success",
+        "conversation_stats": conversation_history.get_stats()
+    }
+
+
+@app.get("/api/circuit-breakers/stats")
+async def get_circuit_breaker_stats():
+    """
+    Obtiene el estado de los circuit breakers de las APIs externas (estado,
+    tasa de fallos en la ventana, enfriamiento y cambios de estado recientes)
+    """
+    return {
+        "status": "success",
+        "circuit_breakers": {
+            "openweathermap": weather_service.circuit_breaker.get_stats(),
+            "unsplash": unsplash_service.circuit_breaker.get_stats()
+        }
+    }
+
+
+@app.get("/api/http/stats")
+async def get_http_stats():
+    """
+    Obtiene estadísticas del cliente HTTP compartido (peticiones, errores y
+    conexiones abiertas por upstream)
+    """
+    return {
+        "status": "success",
+        "http_stats": http_client.get_stats()
+    }
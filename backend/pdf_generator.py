@@ -13,7 +13,7 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Page
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_JUSTIFY
 from reportlab.pdfgen import canvas
 from PIL import Image as PILImage
-import requests
+from http_client import http_client
 from xml.sax.saxutils import escape
 
 
@@ -112,6 +112,7 @@ def extract_sections_from_history(messages: List[Dict]) -> Dict[str, List[str]]:
 def download_image(url: str, max_size: tuple = (800, 600)) -> Optional[BytesIO]:
     """
     Descarga una imagen desde una URL y la redimensiona si es necesario.
+    Usa las conexiones del cliente HTTP compartido (las fotos vienen del mismo host).
     
     Args:
         url: URL de la imagen
@@ -121,7 +122,7 @@ def download_image(url: str, max_size: tuple = (800, 600)) -> Optional[BytesIO]:
         BytesIO con la imagen o None si hay error
     """
     try:
-        response = requests.get(url, timeout=10)
+        response = http_client.get_sync("images", url)
         if response.status_code == 200:
             img = PILImage.open(BytesIO(response.content))
             # Convertir a RGB si es necesario
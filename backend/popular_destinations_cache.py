@@ -0,0 +1,124 @@
+"""
+Cache para la lista de destinos populares generada por Gemini.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+from single_flight import SingleFlight
+
+
+class PopularDestinationsCache:
+    """
+    Cache en memoria para /api/destinations/popular.
+
+    Criterio de actualización:
+    - TTL por defecto: 24 horas (la lista cambia como mucho una vez al día)
+    - Pasado el umbral de refresco (80% del TTL) se sigue sirviendo la lista
+      cacheada y se lanza una actualización en segundo plano
+    - Single-flight: aunque lleguen muchas peticiones en frío, solo se hace
+      una consulta a Gemini
+    """
+
+    def __init__(self, ttl_seconds: int = 86400, refresh_ratio: float = 0.8, retry_seconds: int = 60):
+        """
+        Inicializa el cache.
+
+        Args:
+            ttl_seconds: Tiempo de vida de la lista en segundos (default: 24 horas)
+            refresh_ratio: Fracción del TTL a partir de la cual se refresca en segundo plano
+            retry_seconds: Espera mínima entre intentos de refresco en segundo plano
+        """
+        self.ttl_seconds = ttl_seconds
+        self.refresh_after_seconds = ttl_seconds * refresh_ratio
+        self.retry_seconds = retry_seconds
+        self._last_refresh_attempt = 0.0
+        self.destinations: Optional[List[str]] = None
+        self.cached_at = 0.0
+        self._single_flight = SingleFlight()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        print(f"📦 Cache de destinos populares inicializado con TTL de {ttl_seconds // 60} minutos")
+
+    async def _load(self, loader: Callable[[], Awaitable[Optional[List[str]]]]) -> Optional[List[str]]:
+        """Ejecuta el loader y guarda el resultado si es válido."""
+        destinations = await loader()
+        if destinations:
+            self.destinations = list(destinations)
+            self.cached_at = time.time()
+            print(f"💾 Destinos populares guardados en cache ({len(destinations)} destinos)")
+        return destinations
+
+    async def _refresh(self, loader: Callable[[], Awaitable[Optional[List[str]]]]) -> None:
+        """Actualización en segundo plano; los errores no afectan a la lista servida."""
+        try:
+            destinations = await self._single_flight.do("popular", lambda: self._load(loader))
+            if destinations:
+                self.refreshes += 1
+                print(f"🔄 Destinos populares actualizados en segundo plano")
+            else:
+                self.refresh_failures += 1
+        except Exception as e:
+            self.refresh_failures += 1
+            print(f"⚠️ Error al actualizar destinos populares en segundo plano: {e}")
+
+    async def get(self, loader: Callable[[], Awaitable[Optional[List[str]]]]) -> Optional[List[str]]:
+        """
+        Obtiene la lista de destinos populares.
+
+        Args:
+            loader: Función async que consulta Gemini y devuelve la lista
+                    (o None si la respuesta no es válida; None no se cachea)
+
+        Returns:
+            Lista de destinos o None si no hay lista cacheada y el loader falló
+        """
+        age = time.time() - self.cached_at
+
+        if self.destinations is not None and age <= self.ttl_seconds:
+            self.hits += 1
+            if (age > self.refresh_after_seconds
+                    and not self._single_flight.is_in_flight("popular")
+                    and time.time() - self._last_refresh_attempt > self.retry_seconds):
+                self._last_refresh_attempt = time.time()
+                print(f"⏰ Destinos populares próximos a expirar, actualizando en segundo plano")
+                self._refresh_task = asyncio.create_task(self._refresh(loader))
+            print(f"📦 Cache HIT para destinos populares")
+            return list(self.destinations)
+
+        self.misses += 1
+        print(f"📦 Cache MISS para destinos populares")
+        destinations = await self._single_flight.do("popular", lambda: self._load(loader))
+        return list(destinations) if destinations else None
+
+    def clear(self) -> None:
+        """
+        Limpia el cache.
+        """
+        self.destinations = None
+        self.cached_at = 0.0
+        print(f"🗑️  Cache de destinos populares limpiado")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Obtiene estadísticas del cache.
+
+        Returns:
+            Diccionario con estadísticas del cache
+        """
+        age = int(time.time() - self.cached_at) if self.destinations is not None else None
+        flight_stats = self._single_flight.get_stats()
+        return {
+            "cached": self.destinations is not None,
+            "age_seconds": age,
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "gemini_calls": flight_stats["executions"],
+            "coalesced_requests": flight_stats["coalesced"],
+            "ttl_seconds": self.ttl_seconds,
+            "ttl_minutes": self.ttl_seconds // 60
+        }
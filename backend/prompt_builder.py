@@ -0,0 +1,243 @@
+"""
+Construcción de prompts con presupuesto de tokens para /api/travel.
+"""
+import json
+import os
+from collections import deque
+from typing import Deque, Dict, Any, List, Optional, Tuple
+
+
+# Presupuesto total de tokens (estimados) por formato de prompt.
+# La plantilla y la pregunta se cuentan primero; el historial usa lo que queda.
+PROMPT_TOKEN_BUDGETS = {
+    "structured": int(os.getenv("PROMPT_TOKEN_BUDGET_STRUCTURED", "2500")),
+    "contextual": int(os.getenv("PROMPT_TOKEN_BUDGET_CONTEXTUAL", "2000")),
+}
+
+# Máximo de tokens por mensaje del historial antes de recortarlo
+MAX_MESSAGE_TOKENS = 300
+# Caracteres por recomendación al resumir una respuesta JSON del asistente
+ELIDED_ITEM_CHARS = 60
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimación rápida del número de tokens (≈ 4 caracteres por token).
+    No es exacta, pero es suficiente para decidir cuánto historial cabe.
+
+    Args:
+        text: Texto a estimar
+
+    Returns:
+        Número aproximado de tokens
+    """
+    return (len(text) + 3) // 4
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars - 1].rstrip() + "…"
+
+
+def _parse_json_answer(content: str) -> Optional[Dict[str, Any]]:
+    """Intenta leer una respuesta estructurada (JSON, con o sin bloque ```json)."""
+    text = content.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        if text.lower().startswith("json"):
+            text = text[4:]
+    if not text.lstrip().startswith("{"):
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def compact_message(role: str, content: str, max_tokens: int = MAX_MESSAGE_TOKENS) -> str:
+    """
+    Reduce un mensaje del historial para incluirlo en el prompt.
+    Las respuestas JSON del asistente se resumen a la primera recomendación
+    de cada sección; el resto de mensajes largos se recortan.
+
+    Args:
+        role: 'user' o 'assistant'
+        content: Contenido del mensaje
+        max_tokens: Máximo de tokens estimados del mensaje
+
+    Returns:
+        Contenido listo para el prompt
+    """
+    if role == 'assistant':
+        data = _parse_json_answer(content)
+        if data is not None:
+            sections = []
+            for section, items in data.items():
+                first = items[0] if isinstance(items, list) and items else items
+                sections.append(f"{section}: {_truncate(str(first), ELIDED_ITEM_CHARS)}")
+            content = "[itinerario JSON resumido] " + "; ".join(sections)
+    return _truncate(content, max_tokens * 4)
+
+
+def render_context_line(role: str, content: str) -> str:
+    """
+    Renderiza un mensaje como línea del historial del prompt.
+    ConversationHistory lo hace una sola vez por mensaje, al añadirlo.
+
+    Args:
+        role: 'user' o 'assistant'
+        content: Contenido del mensaje
+
+    Returns:
+        Línea "Usuario: ..." / "Alex: ..." con el contenido compactado
+    """
+    role_name = "Usuario" if role == 'user' else "Alex"
+    return f"{role_name}: {compact_message(role, content)}"
+
+
+def build_history_context(lines: List[str], budget_tokens: int) -> Tuple[str, int]:
+    """
+    Construye el historial para el prompt dentro de un presupuesto de tokens.
+    Se recorre de lo más reciente a lo más antiguo y se conservan los turnos
+    nuevos que quepan; el resultado mantiene el orden cronológico.
+
+    Args:
+        lines: Líneas ya renderizadas (ver ConversationHistory.get_context_lines)
+        budget_tokens: Tokens disponibles para el historial
+
+    Returns:
+        Tupla (historial formateado "Usuario: ..." / "Alex: ...", mensajes incluidos)
+    """
+    used = 0
+    start = len(lines)
+    while start > 0:
+        tokens = estimate_tokens(lines[start - 1]) + 1  # +1 por el salto de línea
+        if used + tokens > budget_tokens:
+            break
+        used += tokens
+        start -= 1
+    return "\n".join(lines[start:]), len(lines) - start
+
+
+def cap_summary(summary: str, max_chars: int) -> str:
+    """
+    Deja el resumen de la conversación en una sola línea de como mucho max_chars.
+
+    Args:
+        summary: Resumen generado
+        max_chars: Máximo de caracteres
+
+    Returns:
+        Resumen en una línea, recortado si es necesario
+    """
+    return _truncate(" ".join(summary.split()), max_chars)
+
+
+def extractive_summary(previous_summary: Optional[str], lines: List[str], max_chars: int) -> str:
+    """
+    Resumen local (sin Gemini): añade las líneas compactadas al resumen anterior
+    y, si no cabe, conserva la parte más reciente.
+
+    Args:
+        previous_summary: Resumen anterior (None si no hay)
+        lines: Líneas del historial que salieron de la ventana del prompt
+        max_chars: Máximo de caracteres del resumen
+
+    Returns:
+        Resumen en una línea de como mucho max_chars
+    """
+    parts = ([previous_summary] if previous_summary else []) + lines
+    summary = " · ".join(" ".join(part.split()) for part in parts)
+    if len(summary) <= max_chars:
+        return summary
+    return "…" + summary[-(max_chars - 1):].lstrip()
+
+
+def history_budget(prompt_format: str, fixed_text: str) -> int:
+    """
+    Tokens disponibles para el historial una vez contado el resto del prompt.
+
+    Args:
+        prompt_format: "structured" o "contextual"
+        fixed_text: Partes del prompt que no son historial (plantilla, pregunta, contexto)
+
+    Returns:
+        Tokens disponibles (0 si la parte fija ya agota el presupuesto)
+    """
+    return max(0, PROMPT_TOKEN_BUDGETS[prompt_format] - estimate_tokens(fixed_text))
+
+
+class PromptSizeStats:
+    """
+    Distribución del tamaño de los prompts enviados, por formato, para
+    ajustar los presupuestos. Guarda las últimas N muestras de cada formato.
+    """
+
+    def __init__(self, window: int = 1000, log_every: int = 50):
+        """
+        Args:
+            window: Número de prompts recientes a conservar por formato
+            log_every: Cada cuántos prompts se imprime la distribución
+        """
+        self.window = window
+        self.log_every = log_every
+        self._samples: Dict[str, Deque[int]] = {}
+        self._counts: Dict[str, int] = {}
+        self._history_dropped: Dict[str, int] = {}
+
+    def record(self, prompt_format: str, prompt_tokens: int, history_messages: int, history_kept: int) -> None:
+        """
+        Registra el tamaño de un prompt.
+
+        Args:
+            prompt_format: "structured" o "contextual"
+            prompt_tokens: Tokens estimados del prompt completo
+            history_messages: Mensajes de historial disponibles
+            history_kept: Mensajes de historial que cupieron en el presupuesto
+        """
+        samples = self._samples.setdefault(prompt_format, deque(maxlen=self.window))
+        samples.append(prompt_tokens)
+        self._counts[prompt_format] = self._counts.get(prompt_format, 0) + 1
+        dropped = history_messages - history_kept
+        if dropped:
+            self._history_dropped[prompt_format] = self._history_dropped.get(prompt_format, 0) + dropped
+
+        budget = PROMPT_TOKEN_BUDGETS.get(prompt_format)
+        print(f"📏 [PROMPT] {prompt_format}: ~{prompt_tokens} tokens (presupuesto {budget}), "
+              f"historial {history_kept}/{history_messages} mensajes")
+        if self._counts[prompt_format] % self.log_every == 0:
+            stats = self.get_stats()[prompt_format]
+            print(f"📊 [PROMPT] Distribución {prompt_format} (últimos {stats['samples']}): "
+                  f"p50={stats['p50']} p90={stats['p90']} p99={stats['p99']} máx={stats['max']} tokens")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Obtiene la distribución del tamaño de los prompts.
+
+        Returns:
+            Diccionario por formato con percentiles de tokens estimados
+        """
+        stats = {}
+        for prompt_format, samples in self._samples.items():
+            ordered = sorted(samples)
+
+            def pct(p: float) -> int:
+                return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+            stats[prompt_format] = {
+                "total_prompts": self._counts[prompt_format],
+                "samples": len(ordered),
+                "budget": PROMPT_TOKEN_BUDGETS.get(prompt_format),
+                "p50": pct(50),
+                "p90": pct(90),
+                "p99": pct(99),
+                "max": ordered[-1],
+                "history_messages_dropped": self._history_dropped.get(prompt_format, 0)
+            }
+        return stats
+
+
+# Instancia global de estadísticas de tamaño de prompts
+prompt_size_stats = PromptSizeStats()
@@ -2,6 +2,7 @@
 Módulo para cargar prompts optimizados en formato TOON desde archivos.
 """
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
@@ -9,9 +10,29 @@ from typing import Optional
 PROMPTS_DIR = Path(__file__).parent
 
 
+@lru_cache(maxsize=None)
+def _read_prompt(prompt_name: str) -> str:
+    """
+    Lee una plantilla de prompt del disco (una sola vez por proceso).
+    
+    Raises:
+        FileNotFoundError: Si el archivo de prompt no existe
+    """
+    prompt_path = PROMPTS_DIR / f"{prompt_name}.txt"
+    
+    if not prompt_path.exists():
+        raise FileNotFoundError(
+            f"Prompt '{prompt_name}' no encontrado en {PROMPTS_DIR}"
+        )
+    
+    with open(prompt_path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+
 def load_prompt(prompt_name: str, **kwargs) -> str:
     """
     Carga un prompt desde un archivo y aplica formato con variables.
+    Las plantillas se leen del disco una sola vez y se reutilizan.
     
     Args:
         prompt_name: Nombre del archivo de prompt (sin extensión .txt)
@@ -23,15 +44,7 @@ def load_prompt(prompt_name: str, **kwargs) -> str:
     Raises:
         FileNotFoundError: Si el archivo de prompt no existe
     """
-    prompt_path = PROMPTS_DIR / f"{prompt_name}.txt"
-    
-    if not prompt_path.exists():
-        raise FileNotFoundError(
-            f"Prompt '{prompt_name}' no encontrado en {PROMPTS_DIR}"
-        )
-    
-    with open(prompt_path, 'r', encoding='utf-8') as f:
-        prompt_content = f.read().strip()
+    prompt_content = _read_prompt(prompt_name)
     
     # Aplicar formato si hay variables
     if kwargs:
@@ -1,11 +1,12 @@
 """
 Módulo para obtener información en tiempo real: tipo de cambio, diferencia horaria y temperatura.
 """
+import asyncio
 import os
-import requests
 from typing import Optional, Dict, Any
 from datetime import datetime
 import pytz
+from http_client import http_client
 from weather import WeatherService, parse_form_destination
 
 
@@ -17,11 +18,17 @@ class RealtimeInfoService:
     EXCHANGE_RATE_API = "https://api.exchangerate-api.com/v4/latest/USD"
     TIMEZONE_API = "https://worldtimeapi.org/api/timezone"
     
-    def __init__(self):
-        """Inicializa el servicio de información en tiempo real."""
-        self.weather_service = WeatherService()
+    def __init__(self, weather_service: Optional[WeatherService] = None):
+        """
+        Inicializa el servicio de información en tiempo real.
+        
+        Args:
+            weather_service: Servicio de clima compartido (su cache, coalescencia
+                y circuit breaker). Si no se proporciona, se crea uno propio.
+        """
+        self.weather_service = weather_service or WeatherService()
     
-    def get_realtime_info(self, destination: str) -> Optional[Dict[str, Any]]:
+    async def get_realtime_info(self, destination: str) -> Optional[Dict[str, Any]]:
         """
         Obtiene información en tiempo real para un destino.
         
@@ -35,19 +42,21 @@ class RealtimeInfoService:
             return None
         
         # Parsear destino
-        parsed = parse_form_destination(destination)
+        parsed = await parse_form_destination(destination)
         if not parsed:
             return None
         
         city, country_code = parsed
         
-        # Obtener información del clima (incluye coordenadas)
-        weather_data = None
+        # Obtener información del clima (incluye coordenadas) y tipo de cambio en paralelo
         if self.weather_service.is_available():
-            weather_data = self.weather_service.get_weather(city, country_code)
-        
-        # Obtener tipo de cambio
-        exchange_rate = self._get_exchange_rate(country_code)
+            weather_request = self.weather_service.get_weather(city, country_code)
+        else:
+            weather_request = asyncio.sleep(0, result=None)
+        weather_data, exchange_rate = await asyncio.gather(
+            weather_request,
+            self._get_exchange_rate(country_code)
+        )
         
         # Obtener diferencia horaria
         time_difference = self._get_time_difference(city, country_code, weather_data)
@@ -67,7 +76,7 @@ class RealtimeInfoService:
             "weather_data": weather_data
         }
     
-    def _get_exchange_rate(self, country_code: Optional[str]) -> Optional[Dict[str, Any]]:
+    async def _get_exchange_rate(self, country_code: Optional[str]) -> Optional[Dict[str, Any]]:
         """
         Obtiene el tipo de cambio de la moneda del país.
         
@@ -123,7 +132,7 @@ class RealtimeInfoService:
         
         try:
             # Usar API gratuita de exchangerate-api.com
-            response = requests.get(self.EXCHANGE_RATE_API, timeout=5)
+            response = await http_client.get("exchange_rate", self.EXCHANGE_RATE_API)
             if response.status_code == 200:
                 data = response.json()
                 rates = data.get("rates", {})
@@ -242,7 +251,7 @@ class RealtimeInfoService:
             return None
 
 
-def get_realtime_info(destination: str) -> Optional[Dict[str, Any]]:
+async def get_realtime_info(destination: str) -> Optional[Dict[str, Any]]:
     """
     Función helper para obtener información en tiempo real.
     
@@ -253,5 +262,5 @@ def get_realtime_info(destination: str) -> Optional[Dict[str, Any]]:
         Diccionario con información en tiempo real o None
     """
     service = RealtimeInfoService()
-    return service.get_realtime_info(destination)
+    return await service.get_realtime_info(destination)
 
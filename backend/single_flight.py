@@ -0,0 +1,67 @@
+"""
+Coalescencia de llamadas asíncronas idénticas (single-flight).
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Garantiza que solo haya una ejecución en curso por clave.
+
+    Si llegan varias peticiones con la misma clave mientras la primera está en
+    curso, todas esperan y reciben el mismo resultado (o la misma excepción).
+    La operación se ejecuta en su propia tarea: si el solicitante original se
+    cancela (p.ej. el cliente HTTP se desconecta), el resto sigue esperando.
+    """
+
+    def __init__(self):
+        """Inicializa el registro de operaciones en curso."""
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.executions = 0  # Operaciones realmente ejecutadas
+        self.coalesced = 0  # Peticiones que esperaron a una operación ya en curso
+
+    def is_in_flight(self, key: Hashable) -> bool:
+        """Indica si hay una operación en curso para la clave."""
+        return key in self._in_flight
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ejecuta fn() una sola vez por clave entre peticiones concurrentes.
+
+        Args:
+            key: Clave que identifica la operación
+            fn: Función que devuelve el awaitable a ejecutar
+
+        Returns:
+            Resultado de la operación compartida
+        """
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self.executions += 1
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t, k=key: self._on_done(k, t))
+        return await asyncio.shield(task)
+
+    def _on_done(self, key: Hashable, task: asyncio.Task) -> None:
+        """Libera la clave y marca la excepción como recuperada si nadie esperaba."""
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Obtiene estadísticas de coalescencia.
+
+        Returns:
+            Diccionario con ejecuciones, peticiones coalescidas y operaciones en curso
+        """
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight)
+        }
@@ -3,6 +3,7 @@
 Script para probar la API key de Unsplash.
 Valida que la API key esté configurada y funcionando correctamente.
 """
+import asyncio
 import os
 import sys
 from unsplash import UnsplashService
@@ -39,7 +40,7 @@ def test_unsplash_api_key():
     service = UnsplashService()
     
     print("🔍 Validando API key con Unsplash...")
-    is_valid, error_msg = service.validate_api_key()
+    is_valid, error_msg = asyncio.run(service.validate_api_key())
     
     if is_valid:
         print("✅ API key de Unsplash válida y funcionando")
@@ -48,7 +49,7 @@ def test_unsplash_api_key():
         # Probar obtener fotos de un destino de prueba
         print("📸 Probando obtención de fotos...")
         print("   Buscando fotos de: 'Barcelona, España'")
-        photos = service.get_photos("Barcelona, España", count=3)
+        photos = asyncio.run(service.get_photos("Barcelona, España", count=3))
         
         if photos and len(photos) > 0:
             print(f"✅ ¡Éxito! Se obtuvieron {len(photos)} fotos")
@@ -0,0 +1,158 @@
+"""
+Cache opcional de respuestas de Gemini para itinerarios estructurados del primer turno.
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Set, Tuple
+from destination_search_cache import normalize_query
+
+
+class TravelAnswerCache:
+    """
+    Cache en memoria para respuestas estructuradas (prompt travel_planning) sin historial.
+
+    Una petición del primer turno sin contexto de conversación depende solo
+    del destino y del tema de la pregunta, así que la clave es
+    (destino canónico, tema). La respuesta se comparte entre usuarios aunque
+    el formulario difiera en fechas o presupuesto: por eso el cache es opcional
+    (TRAVEL_ANSWER_CACHE_ENABLED) y está desactivado por defecto.
+
+    - TTL por entrada y tamaño acotado con expulsión LRU
+    - Invalidación de todas las entradas de un destino
+    """
+
+    def __init__(self, enabled: bool = False, max_entries: int = 500, ttl_seconds: int = 86400):
+        """
+        Inicializa el cache.
+
+        Args:
+            enabled: Si es False, get() siempre falla y set() no guarda nada
+            max_entries: Número máximo de respuestas cacheadas
+            ttl_seconds: Tiempo de vida de cada respuesta en segundos (default: 24 horas)
+        """
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: 'OrderedDict[Tuple[str, str], Tuple[str, float]]' = OrderedDict()
+        self._topics_by_destination: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        if enabled:
+            print(f"📦 Cache de respuestas de viaje activado ({max_entries} entradas, TTL de {ttl_seconds // 60} minutos)")
+        else:
+            print("ℹ️  Cache de respuestas de viaje desactivado (TRAVEL_ANSWER_CACHE_ENABLED)")
+
+    def _destination_key(self, destination: str) -> str:
+        return normalize_query(destination)
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        """Elimina una entrada del LRU y del índice por destino."""
+        self._entries.pop(key, None)
+        topics = self._topics_by_destination.get(key[0])
+        if topics is not None:
+            topics.discard(key[1])
+            if not topics:
+                del self._topics_by_destination[key[0]]
+
+    def get(self, destination: str, topic: str) -> Optional[str]:
+        """
+        Obtiene la respuesta cacheada para un destino y tema.
+
+        Args:
+            destination: Destino canónico "Ciudad, País"
+            topic: Tema de la pregunta (p.ej. "general", "comida")
+
+        Returns:
+            Respuesta de Gemini o None si no está en cache, expiró o el cache está desactivado
+        """
+        if not self.enabled:
+            return None
+
+        key = (self._destination_key(destination), topic)
+        entry = self._entries.get(key)
+        if entry is not None:
+            answer, cached_at = entry
+            if time.time() - cached_at <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                print(f"📦 Cache HIT de respuesta para '{destination}' (tema: {topic})")
+                return answer
+            self._remove(key)
+
+        self.misses += 1
+        print(f"📦 Cache MISS de respuesta para '{destination}' (tema: {topic})")
+        return None
+
+    def set(self, destination: str, topic: str, answer: str) -> None:
+        """
+        Guarda la respuesta de Gemini para un destino y tema.
+
+        Args:
+            destination: Destino canónico "Ciudad, País"
+            topic: Tema de la pregunta
+            answer: Respuesta completa de Gemini
+        """
+        if not self.enabled or not answer:
+            return
+
+        key = (self._destination_key(destination), topic)
+        self._entries[key] = (answer, time.time())
+        self._entries.move_to_end(key)
+        self._topics_by_destination.setdefault(key[0], set()).add(topic)
+
+        # Expulsar las respuestas menos usadas recientemente
+        while len(self._entries) > self.max_entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def invalidate_destination(self, destination: str) -> int:
+        """
+        Elimina todas las respuestas cacheadas de un destino.
+
+        Args:
+            destination: Destino canónico "Ciudad, País"
+
+        Returns:
+            Número de respuestas eliminadas
+        """
+        destination_key = self._destination_key(destination)
+        topics = list(self._topics_by_destination.get(destination_key, ()))
+        for topic in topics:
+            self._remove((destination_key, topic))
+        self.invalidations += len(topics)
+        print(f"🗑️  Respuestas cacheadas de '{destination}' invalidadas ({len(topics)} entradas)")
+        return len(topics)
+
+    def clear(self) -> None:
+        """
+        Limpia todo el cache.
+        """
+        count = len(self._entries)
+        self._entries.clear()
+        self._topics_by_destination.clear()
+        print(f"🗑️  Cache de respuestas de viaje limpiado ({count} entradas eliminadas)")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Obtiene estadísticas del cache.
+
+        Returns:
+            Diccionario con estadísticas del cache
+        """
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "total_entries": len(self._entries),
+            "destinations": len(self._topics_by_destination),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "ttl_seconds": self.ttl_seconds,
+            "ttl_minutes": self.ttl_seconds // 60
+        }
@@ -4,6 +4,8 @@ Módulo para obtener fotos de destinos usando Unsplash API.
 import os
 import requests
 from typing import Optional, List, Dict, Any, Tuple
+from http_client import http_client
+from circuit_breaker import CircuitBreaker, parse_retry_after
 
 
 class UnsplashService:
@@ -21,7 +23,8 @@ class UnsplashService:
             api_key: API key de Unsplash. Si no se proporciona, se busca en variables de entorno.
         """
         self.api_key = api_key or os.getenv("UNSPLASH_API_KEY")
-        self.api_unavailable = False  # Flag para evitar reintentos si la API no está disponible
+        # Deja de llamar a la API tras varios fallos y la vuelve a probar pasado un enfriamiento
+        self.circuit_breaker = CircuitBreaker("Unsplash")
     
     def is_available(self) -> bool:
         """
@@ -32,7 +35,7 @@ class UnsplashService:
         """
         return self.api_key is not None and self.api_key.strip() != ""
     
-    def get_photos(self, destination: str, count: int = 3) -> Optional[List[Dict[str, Any]]]:
+    async def get_photos(self, destination: str, count: int = 3) -> Optional[List[Dict[str, Any]]]:
         """
         Obtiene fotos de un destino.
         
@@ -47,30 +50,27 @@ class UnsplashService:
             print("⚠️ API key de Unsplash no configurada")
             return None
         
-        # Si la API no está disponible, no intentar solicitud
-        if self.api_unavailable:
-            print(f"⚠️ API de Unsplash no disponible, no se harán más intentos")
+        # Si el circuito está abierto, no intentar solicitud
+        if not self.circuit_breaker.allow_request():
+            print(f"⚠️ API de Unsplash no disponible, nuevo intento en "
+                  f"{self.circuit_breaker.retry_in():.0f} seg")
             return None
         
         # Limpiar el destino para la búsqueda
         search_query = destination.strip()
         
         print(f"📸 Consultando API de Unsplash para: {search_query}")
-        photos_data = self._fetch_photos_from_api(search_query, count)
+        photos_data = await self._fetch_photos_from_api(search_query, count)
         
         if photos_data:
-            self.api_unavailable = False  # Resetear flag si la solicitud fue exitosa
             print(f"✅ {len(photos_data)} fotos obtenidas de Unsplash")
-        else:
-            # Si falló por error de autenticación o API no disponible, marcar como no disponible
-            if self.api_unavailable:
-                print(f"⚠️ API marcada como no disponible, no se harán más intentos hasta reiniciar el servidor")
         
         return photos_data
     
-    def _fetch_photos_from_api(self, query: str, count: int) -> Optional[List[Dict[str, Any]]]:
+    async def _fetch_photos_from_api(self, query: str, count: int) -> Optional[List[Dict[str, Any]]]:
         """
-        Hace una solicitud a la API de Unsplash.
+        Hace una solicitud a la API de Unsplash y registra el resultado en el
+        circuit breaker.
         
         Args:
             query: Término de búsqueda
@@ -81,14 +81,14 @@ class UnsplashService:
         """
         if not self.api_key:
             print("❌ API key de Unsplash no configurada")
-            self.api_unavailable = True
+            self.circuit_breaker.record_failure("API key no configurada", trip=True)
             return None
         
         # Limpiar la API key (eliminar espacios en blanco)
         api_key_clean = self.api_key.strip()
         if not api_key_clean:
             print("❌ API key de Unsplash está vacía")
-            self.api_unavailable = True
+            self.circuit_breaker.record_failure("API key vacía", trip=True)
             return None
         
         try:
@@ -103,9 +103,10 @@ class UnsplashService:
                 "order_by": "relevance"  # Ordenar por relevancia
             }
             
-            response = requests.get(self.BASE_URL, headers=headers, params=params, timeout=10)
+            response = await http_client.get("unsplash", self.BASE_URL, headers=headers, params=params)
             
             if response.status_code == 200:
+                self.circuit_breaker.record_success()
                 data = response.json()
                 results = data.get("results", [])
                 
@@ -128,30 +129,40 @@ class UnsplashService:
                 
             elif response.status_code == 401:
                 print(f"❌ ERROR 401: API key de Unsplash no válida o no autorizada")
-                self.api_unavailable = True
+                self.circuit_breaker.record_failure("HTTP 401", trip=True)
                 return None
-            elif response.status_code == 403:
-                print(f"❌ ERROR 403: Acceso denegado a la API de Unsplash")
-                self.api_unavailable = True
+            elif response.status_code in (403, 429):
+                # Unsplash responde 403 cuando se agota el límite por hora
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                print(f"❌ ERROR {response.status_code}: Acceso denegado o límite excedido en la API de Unsplash"
+                      + (f" (Retry-After: {retry_after:.0f} seg)" if retry_after is not None else ""))
+                self.circuit_breaker.record_failure(f"HTTP {response.status_code}", retry_after=retry_after, trip=True)
                 return None
             else:
                 print(f"❌ ERROR {response.status_code}: Error al consultar Unsplash API")
                 print(f"   Respuesta: {response.text[:200]}")
+                if response.status_code >= 500:
+                    self.circuit_breaker.record_failure(f"HTTP {response.status_code}")
+                else:
+                    self.circuit_breaker.record_success()  # Error de la petición, no de la API
                 return None
                 
         except requests.exceptions.Timeout:
             print(f"❌ Timeout al consultar Unsplash API")
+            self.circuit_breaker.record_failure("timeout")
             return None
         except requests.exceptions.RequestException as e:
             print(f"❌ Error de conexión con Unsplash API: {e}")
+            self.circuit_breaker.record_failure(type(e).__name__)
             return None
         except Exception as e:
             print(f"❌ Error inesperado al consultar Unsplash API: {e}")
             import traceback
             traceback.print_exc()
+            self.circuit_breaker.record_failure(type(e).__name__)
             return None
     
-    def validate_api_key(self) -> Tuple[bool, Optional[str]]:
+    async def validate_api_key(self) -> Tuple[bool, Optional[str]]:
         """
         Valida la API key haciendo una solicitud de prueba.
         
@@ -172,7 +183,7 @@ class UnsplashService:
                 "per_page": 1
             }
             
-            response = requests.get(self.BASE_URL, headers=headers, params=params, timeout=10)
+            response = await http_client.get("unsplash", self.BASE_URL, headers=headers, params=params)
             
             if response.status_code == 200:
                 return True, None
@@ -4,9 +4,13 @@ Módulo para obtener información del clima usando OpenWeatherMap API.
 import os
 import requests
 from typing import Optional, Dict, Any
+from http_client import http_client
+from circuit_breaker import CircuitBreaker, parse_retry_after
 from weather_cache import WeatherCache
 from country_code_cache import CountryCodeCache
-import google.generativeai as genai
+from gemini_client import gemini_client
+from gemini_models import gemini_models
+from gazetteer import gazetteer
 
 # Cache global para códigos de países
 _country_code_cache = CountryCodeCache()
@@ -19,23 +23,31 @@ class WeatherService:
     
     BASE_URL = "https://api.openweathermap.org/data/2.5/weather"
     
-    def __init__(self, api_key: Optional[str] = None, cache_ttl_seconds: int = 1800):
+    def __init__(self, api_key: Optional[str] = None, cache_ttl_seconds: int = 1800,
+                 cache_hard_ttl_seconds: Optional[int] = None, cache_max_entries: int = 10000):
         """
         Inicializa el servicio de clima.
         
         Args:
             api_key: API key de OpenWeatherMap. Si no se proporciona, se busca en variables de entorno.
             cache_ttl_seconds: Tiempo de vida del cache en segundos (default: 30 minutos)
+            cache_hard_ttl_seconds: Antigüedad máxima del clima servido mientras se
+                actualiza en segundo plano (default: ver WeatherCache)
+            cache_max_entries: Número máximo de ciudades en cache (expulsión LRU)
         """
         self.api_key = api_key or os.getenv("OPENWEATHER_API_KEY")
-        self.cache = WeatherCache(ttl_seconds=cache_ttl_seconds)
-        self.api_unavailable = False  # Flag para evitar reintentos si la API no está disponible
+        self.cache = WeatherCache(ttl_seconds=cache_ttl_seconds, hard_ttl_seconds=cache_hard_ttl_seconds,
+                                  max_entries=cache_max_entries)
+        # Deja de llamar a la API tras varios fallos y la vuelve a probar pasado un enfriamiento
+        self.circuit_breaker = CircuitBreaker("OpenWeatherMap")
     
-    def get_weather(self, city: str, country: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    async def get_weather(self, city: str, country: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
         Obtiene el clima actual de una ciudad.
         Primero busca en el cache, si no está disponible o ha expirado, hace solicitud a la API.
-        NO hace reintentos si la API no está disponible.
+        Si el dato cacheado venció hace poco, se devuelve y se actualiza en segundo plano.
+        Las peticiones simultáneas para la misma ciudad comparten una sola consulta a la API.
+        Si la API está fallando (circuito abierto) no se consulta hasta el siguiente intento de prueba.
         
         Args:
             city: Nombre de la ciudad
@@ -44,43 +56,40 @@ class WeatherService:
         Returns:
             Diccionario con información del clima o None si hay error
         """
-        # 1. Limpiar entradas expiradas periódicamente (cada 10 solicitudes aproximadamente)
-        # Esto se hace de forma lazy para no impactar el rendimiento
-        import random
-        if random.random() < 0.1:  # 10% de probabilidad
-            self.cache.clear_expired()
-        
-        # 2. Verificar cache primero
-        cached_data = self.cache.get(city, country)
-        if cached_data:
-            return cached_data
-        
-        # 3. Si la API no está disponible, no intentar solicitud
-        if self.api_unavailable:
-            print(f"⚠️ API de OpenWeatherMap no disponible, no se harán más intentos")
+        # Verificar cache primero; si no está, consultar la API (el cache guarda el resultado
+        # y elimina las entradas caducadas al guardar)
+        return await self.cache.get_or_fetch(city, country, lambda: self._load_weather(city, country))
+    
+    async def _load_weather(self, city: str, country: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Consulta la API para el cache (en un fallo de cache o en una actualización
+        en segundo plano).
+        
+        Args:
+            city: Nombre de la ciudad
+            country: Código de país (opcional)
+            
+        Returns:
+            Diccionario con información del clima o None si hay error
+        """
+        # Si el circuito está abierto, no intentar solicitud
+        if not self.circuit_breaker.allow_request():
+            print(f"⚠️ API de OpenWeatherMap no disponible, nuevo intento en "
+                  f"{self.circuit_breaker.retry_in():.0f} seg")
             return None
         
-        # 4. Si no hay cache, hacer solicitud a la API
         print(f"🌐 Consultando API de OpenWeatherMap para: {city}, {country}")
-        weather_data = self._fetch_weather_from_api(city, country)
+        weather_data = await self._fetch_weather_from_api(city, country)
         
-        # 5. Si la solicitud fue exitosa, guardar en cache
         if weather_data:
-            self.cache.set(city, country, weather_data)
-            self.api_unavailable = False  # Resetear flag si la solicitud fue exitosa
-            print(f"✅ Clima obtenido y guardado en cache")
-        else:
-            # Si falló por error de autenticación o API no disponible, marcar como no disponible
-            # Esto evita hacer múltiples solicitudes fallidas
-            if self.api_unavailable:
-                print(f"⚠️ API marcada como no disponible, no se harán más intentos hasta reiniciar el servidor")
+            print(f"✅ Clima obtenido de la API")
         
         return weather_data
     
-    def _fetch_weather_from_api(self, city: str, country: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    async def _fetch_weather_from_api(self, city: str, country: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
-        Hace una solicitud a la API de OpenWeatherMap.
-        NO hace reintentos si falla.
+        Hace una solicitud a la API de OpenWeatherMap y registra el resultado
+        en el circuit breaker. NO hace reintentos si falla.
         
         Args:
             city: Nombre de la ciudad
@@ -91,14 +100,14 @@ class WeatherService:
         """
         if not self.api_key:
             print("❌ API key de OpenWeatherMap no configurada")
-            self.api_unavailable = True
+            self.circuit_breaker.record_failure("API key no configurada", trip=True)
             return None
         
         # Limpiar la API key (eliminar espacios en blanco)
         api_key_clean = self.api_key.strip()
         if not api_key_clean:
             print("❌ API key de OpenWeatherMap está vacía")
-            self.api_unavailable = True
+            self.circuit_breaker.record_failure("API key vacía", trip=True)
             return None
         
         # Construir query: "city,country" o solo "city"
@@ -112,12 +121,11 @@ class WeatherService:
         }
         
         try:
-            response = requests.get(self.BASE_URL, params=params, timeout=10)
+            response = await http_client.get("openweathermap", self.BASE_URL, params=params)
             
             # Manejar errores específicos (SIN REINTENTOS)
             if response.status_code == 401:
                 print(f"❌ ERROR 401: API key de OpenWeatherMap no válida o no activada")
-                print(f"   No se harán más intentos hasta reiniciar el servidor")
                 print(f"   Verifica en: https://home.openweathermap.org/api_keys")
                 try:
                     error_data = response.json()
@@ -125,38 +133,45 @@ class WeatherService:
                         print(f"   Mensaje de la API: {error_data['message']}")
                 except:
                     pass
-                self.api_unavailable = True  # Marcar API como no disponible
+                self.circuit_breaker.record_failure("HTTP 401", trip=True)  # Abrir el circuito
                 return None
             elif response.status_code == 404:
                 print(f"⚠️ Ciudad no encontrada: {query}")
-                # No marcar como no disponible para 404, puede ser que la ciudad no exista
+                # La API respondió bien: puede ser que la ciudad no exista
+                self.circuit_breaker.record_success()
                 return None
             elif response.status_code == 429:
-                print(f"⚠️ Límite de solicitudes excedido para OpenWeatherMap")
-                print(f"   No se harán más intentos hasta reiniciar el servidor")
-                self.api_unavailable = True  # Marcar API como no disponible temporalmente
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                print(f"⚠️ Límite de solicitudes excedido para OpenWeatherMap"
+                      + (f" (Retry-After: {retry_after:.0f} seg)" if retry_after is not None else ""))
+                self.circuit_breaker.record_failure("HTTP 429", retry_after=retry_after, trip=True)
                 return None
             
             response.raise_for_status()
             data = response.json()
             
+            self.circuit_breaker.record_success()
             return self._format_weather_data(data)
             
         except requests.exceptions.HTTPError as e:
             print(f"❌ Error HTTP al obtener clima para {query}: {e}")
-            if hasattr(e.response, 'status_code'):
-                if e.response.status_code in [401, 403, 429]:
-                    self.api_unavailable = True  # Marcar como no disponible para errores críticos
+            status_code = getattr(e.response, 'status_code', None)
+            if status_code is not None and 400 <= status_code < 500 and status_code != 403:
+                # Error de la petición (p.ej. 400), no de la API
+                self.circuit_breaker.record_success()
+            else:
+                # 403 es un error de la cuenta: abrir el circuito sin esperar a la tasa de fallos
+                self.circuit_breaker.record_failure(f"HTTP {status_code}", trip=status_code == 403)
             return None
         except requests.exceptions.RequestException as e:
             print(f"❌ Error de conexión al obtener clima para {query}: {e}")
-            print(f"   No se harán más intentos hasta reiniciar el servidor")
-            self.api_unavailable = True  # Marcar API como no disponible
+            self.circuit_breaker.record_failure(type(e).__name__)
             return None
         except Exception as e:
             print(f"❌ Error inesperado al procesar clima para {query}: {e}")
             import traceback
             traceback.print_exc()
+            self.circuit_breaker.record_failure(type(e).__name__)
             return None
     
     def _format_weather_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
@@ -233,7 +248,7 @@ class WeatherService:
         """
         return self.api_key is not None and self.api_key.strip() != ""
     
-    def validate_api_key(self) -> tuple[bool, Optional[str]]:
+    async def validate_api_key(self) -> tuple[bool, Optional[str]]:
         """
         Valida la API key haciendo una solicitud de prueba.
         
@@ -251,7 +266,7 @@ class WeatherService:
         }
         
         try:
-            response = requests.get(self.BASE_URL, params=test_params, timeout=5)
+            response = await http_client.get("openweathermap", self.BASE_URL, params=test_params)
             if response.status_code == 200:
                 return (True, None)
             elif response.status_code == 401:
@@ -266,10 +281,10 @@ class WeatherService:
             return (False, f"Error inesperado: {str(e)}")
 
 
-def get_country_code_with_gemini(country_name: str) -> Optional[str]:
+async def get_country_code_with_gemini(country_name: str) -> Optional[str]:
     """
     Obtiene el código ISO de un país usando Gemini AI.
-    Primero busca en cache, si no está, consulta a Gemini.
+    Primero busca en cache y en el gazetteer local; si no está, consulta a Gemini.
     
     Args:
         country_name: Nombre del país
@@ -287,20 +302,21 @@ def get_country_code_with_gemini(country_name: str) -> Optional[str]:
     if cached_code is not None:
         return cached_code
     
-    # 2. Si no está en cache, consultar a Gemini
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
+    # 2. Buscar en el gazetteer local (nombres en español e inglés)
+    local_code = gazetteer.get_country_code(country_name)
+    if local_code:
+        _country_code_cache.set(country_name, local_code)
+        return local_code
+    
+    # 3. Si no está en el gazetteer, consultar a Gemini
+    if not gemini_models.is_available():
         print(f"⚠️ GEMINI_API_KEY no configurada, no se puede obtener código para '{country_name}'")
         _country_code_cache.set(country_name, None)  # Guardar None en cache para no intentar de nuevo
         return None
     
     try:
-        # Configurar Gemini
-        genai.configure(api_key=gemini_api_key)
-        
-        # Modelo gratuito
-        model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
-        model = genai.GenerativeModel(model_name)
+        # Modelo gratuito, ya validado al arrancar
+        model = gemini_models.get("country_code")
         
         # Prompt optimizado para obtener código ISO
         prompt = f"""Dado el nombre de un país, devuelve SOLO su código ISO 3166-1 alpha-2 (2 letras).
@@ -318,19 +334,9 @@ Ejemplos:
 - Países que no existen → NOT_FOUND"""
         
         print(f"🤖 Consultando Gemini para código ISO de '{country_name}'...")
-        response = model.generate_content(prompt)
-        
-        # Extraer el texto de la respuesta
-        response_text = None
-        if hasattr(response, 'text') and response.text:
-            response_text = response.text.strip()
-        elif hasattr(response, 'candidates') and response.candidates:
-            if len(response.candidates) > 0:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                    parts = candidate.content.parts
-                    if parts and len(parts) > 0:
-                        response_text = parts[0].text.strip() if hasattr(parts[0], 'text') else str(parts[0]).strip()
+        response_text = await gemini_client.generate_text(prompt, model)
+        if response_text:
+            response_text = response_text.strip()
         
         if not response_text:
             print(f"⚠️ Gemini no devolvió respuesta para '{country_name}'")
@@ -357,7 +363,7 @@ Ejemplos:
         return None
 
 
-def parse_form_destination(destination: str) -> Optional[tuple[str, Optional[str]]]:
+async def parse_form_destination(destination: str) -> Optional[tuple[str, Optional[str]]]:
     """
     Parsea el destino del formulario que viene en formato "Ciudad, País".
     Usa Gemini para obtener códigos ISO de países con cache.
@@ -381,7 +387,7 @@ def parse_form_destination(destination: str) -> Optional[tuple[str, Optional[str
         
         if country_name:
             # Obtener código de país usando Gemini (con cache)
-            country_code = get_country_code_with_gemini(country_name)
+            country_code = await get_country_code_with_gemini(country_name)
             if country_code:
                 print(f"✅ Destino del formulario parseado: {city}, {country_code}")
                 return (city, country_code)
@@ -1,9 +1,24 @@
 """
 Sistema de cache para datos del clima.
 """
+import asyncio
+import heapq
 import time
-from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Dict, Any, Tuple
+from single_flight import SingleFlight
+
+
+class _WeatherEntry:
+    """Clima cacheado de una ciudad."""
+
+    __slots__ = ('weather_data', 'cached_at', 'fresh', 'refresh_failed_at')
+
+    def __init__(self, weather_data: Dict[str, Any], cached_at: float):
+        self.weather_data = weather_data
+        self.cached_at = cached_at
+        self.fresh = True  # False cuando el heap de vigencia lo pasa a vencido
+        self.refresh_failed_at = 0.0
 
 
 class WeatherCache:
@@ -14,18 +29,55 @@ class WeatherCache:
     - TTL por defecto: 30 minutos (1800 segundos)
     - El clima no cambia tan rápido, 30 minutos es un buen balance
     - Reduce significativamente las solicitudes a la API
+    
+    Stale-while-revalidate (get_or_fetch): pasado el TTL (soft) y hasta el
+    TTL máximo (hard), se devuelve el dato cacheado al momento y se lanza una
+    sola actualización en segundo plano por ciudad. Solo pasado el TTL máximo
+    la petición espera a la API.
+    
+    Las consultas a la API se coalescen por clave (single-flight): si una
+    ciudad popular falla en cache para muchas peticiones a la vez, se hace
+    una sola consulta y todas reciben su resultado.
+    
+    El tamaño está acotado con expulsión LRU. Los vencimientos se ordenan en
+    dos min-heaps de (cached_at, clave), uno hasta el TTL y otro hasta el TTL
+    máximo, así que caducar entradas cuesta O(entradas caducadas) y
+    get_stats es O(1) con contadores. Los elementos del heap de una entrada
+    ya reemplazada o expulsada se descartan al salir (borrado perezoso).
     """
     
-    def __init__(self, ttl_seconds: int = 1800):
+    def __init__(self, ttl_seconds: int = 1800, hard_ttl_seconds: Optional[int] = None, retry_seconds: int = 60,
+                 max_entries: int = 10000):
         """
         Inicializa el cache.
         
         Args:
             ttl_seconds: Tiempo de vida del cache en segundos (default: 30 minutos)
+            hard_ttl_seconds: Antigüedad máxima de un dato servido mientras se
+                actualiza en segundo plano (default: 4 veces el TTL)
+            retry_seconds: Espera mínima antes de reintentar una actualización fallida
+            max_entries: Número máximo de ciudades cacheadas
         """
-        self.cache: Dict[str, Dict[str, Any]] = {}
+        self.cache: 'OrderedDict[str, _WeatherEntry]' = OrderedDict()
         self.ttl_seconds = ttl_seconds
-        print(f"📦 Cache de clima inicializado con TTL de {ttl_seconds // 60} minutos")
+        self.hard_ttl_seconds = max(hard_ttl_seconds if hard_ttl_seconds is not None else ttl_seconds * 4, ttl_seconds)
+        self.retry_seconds = retry_seconds
+        self.max_entries = max_entries
+        self._fresh_heap: List[Tuple[float, str]] = []
+        self._stale_heap: List[Tuple[float, str]] = []
+        self._fresh_count = 0
+        self._refresh_tasks: Dict[str, asyncio.Task] = {}
+        self._single_flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.served_stale = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.evictions = 0
+        self.expirations = 0
+        print(f"📦 Cache de clima inicializado con TTL de {ttl_seconds // 60} minutos "
+              f"(hasta {self.hard_ttl_seconds // 60} minutos actualizando en segundo plano, "
+              f"{max_entries} ciudades)")
     
     def _get_cache_key(self, city: str, country: Optional[str] = None) -> str:
         """
@@ -46,6 +98,52 @@ class WeatherCache:
             return f"{city_normalized},{country_normalized}"
         return city_normalized
     
+    def _remove(self, cache_key: str) -> None:
+        """Elimina una entrada (sus elementos en los heaps se descartan al salir)."""
+        entry = self.cache.pop(cache_key, None)
+        if entry is not None and entry.fresh:
+            self._fresh_count -= 1
+    
+    def _expire(self, now: float) -> int:
+        """
+        Avanza los heaps hasta now: las entradas que pasaron el TTL pasan a
+        vencidas y las que pasaron el TTL máximo se eliminan.
+        
+        Args:
+            now: Tiempo actual (epoch)
+            
+        Returns:
+            Número de entradas eliminadas
+        """
+        fresh_heap = self._fresh_heap
+        fresh_before = now - self.ttl_seconds
+        while fresh_heap and fresh_heap[0][0] < fresh_before:
+            cached_at, cache_key = heapq.heappop(fresh_heap)
+            entry = self.cache.get(cache_key)
+            if entry is not None and entry.fresh and entry.cached_at == cached_at:
+                entry.fresh = False
+                self._fresh_count -= 1
+                heapq.heappush(self._stale_heap, (cached_at, cache_key))
+        
+        stale_heap = self._stale_heap
+        stale_before = now - self.hard_ttl_seconds
+        expired = 0
+        while stale_heap and stale_heap[0][0] < stale_before:
+            cached_at, cache_key = heapq.heappop(stale_heap)
+            entry = self.cache.get(cache_key)
+            if entry is not None and not entry.fresh and entry.cached_at == cached_at:
+                del self.cache[cache_key]
+                expired += 1
+        self.expirations += expired
+        
+        # Reconstruir los heaps si acumulan demasiados elementos descartados
+        if len(fresh_heap) + len(stale_heap) > 2 * len(self.cache) + 64:
+            self._fresh_heap = [(e.cached_at, k) for k, e in self.cache.items() if e.fresh]
+            self._stale_heap = [(e.cached_at, k) for k, e in self.cache.items() if not e.fresh]
+            heapq.heapify(self._fresh_heap)
+            heapq.heapify(self._stale_heap)
+        return expired
+    
     def get(self, city: str, country: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
         Obtiene datos del clima del cache si están disponibles y no han expirado.
@@ -59,23 +157,25 @@ class WeatherCache:
         """
         cache_key = self._get_cache_key(city, country)
         
-        if cache_key not in self.cache:
+        entry = self.cache.get(cache_key)
+        if entry is None:
             print(f"📦 Cache MISS para {cache_key} (no encontrado en cache)")
             return None
         
-        cached_data = self.cache[cache_key]
-        cached_time = cached_data.get("cached_at", 0)
         current_time = time.time()
+        age = current_time - entry.cached_at
         
         # Verificar si el cache ha expirado
-        if current_time - cached_time > self.ttl_seconds:
-            # Cache expirado, eliminarlo
-            del self.cache[cache_key]
+        if age > self.ttl_seconds:
+            # Pasado el TTL máximo ya no sirve ni como dato vencido: eliminarlo
+            if age > self.hard_ttl_seconds:
+                self._remove(cache_key)
             print(f"⏰ Cache expirado para {cache_key}, será actualizado en la próxima solicitud")
             return None
         
         # Cache válido, retornar datos
-        time_remaining = int(self.ttl_seconds - (current_time - cached_time))
+        self.cache.move_to_end(cache_key)
+        time_remaining = int(self.ttl_seconds - age)
         minutes_remaining = time_remaining // 60
         seconds_remaining = time_remaining % 60
         if minutes_remaining > 0:
@@ -83,11 +183,12 @@ class WeatherCache:
         else:
             time_str = f"{seconds_remaining} seg"
         print(f"📦 Cache HIT para {cache_key} (válido por {time_str} más)")
-        return cached_data.get("weather_data")
+        return entry.weather_data
     
     def set(self, city: str, country: Optional[str], weather_data: Dict[str, Any]) -> None:
         """
-        Guarda datos del clima en el cache.
+        Guarda datos del clima en el cache, expulsando las ciudades menos
+        usadas recientemente si se supera max_entries.
         
         Args:
             city: Nombre de la ciudad
@@ -95,39 +196,137 @@ class WeatherCache:
             weather_data: Datos del clima a guardar
         """
         cache_key = self._get_cache_key(city, country)
+        now = time.time()
+        self._expire(now)
         
-        self.cache[cache_key] = {
-            "weather_data": weather_data,
-            "cached_at": time.time()
-        }
+        self._remove(cache_key)
+        self.cache[cache_key] = _WeatherEntry(weather_data, now)
+        self._fresh_count += 1
+        heapq.heappush(self._fresh_heap, (now, cache_key))
+        
+        while len(self.cache) > self.max_entries:
+            self._remove(next(iter(self.cache)))
+            self.evictions += 1
         
         print(f"💾 Datos del clima guardados en cache para {cache_key}")
     
+    async def get_or_fetch(
+        self,
+        city: str,
+        country: Optional[str],
+        fetch: Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Obtiene el clima del cache o, si no está, de fetch (y lo guarda).
+        Un dato vencido pero dentro del TTL máximo se devuelve al momento y se
+        actualiza en segundo plano.
+        
+        Args:
+            city: Nombre de la ciudad
+            country: Código del país (opcional)
+            fetch: Función async que consulta la API (None si falla; None no se cachea)
+            
+        Returns:
+            Datos del clima o None si no hay dato utilizable y fetch falló
+        """
+        cache_key = self._get_cache_key(city, country)
+        entry = self.cache.get(cache_key)
+        if entry is not None:
+            age = time.time() - entry.cached_at
+            if age <= self.ttl_seconds:
+                self.hits += 1
+                self.cache.move_to_end(cache_key)
+                print(f"📦 Cache HIT para {cache_key} (válido por {int(self.ttl_seconds - age)} seg más)")
+                return entry.weather_data
+            if age <= self.hard_ttl_seconds:
+                self.served_stale += 1
+                self.cache.move_to_end(cache_key)
+                print(f"⏰ Cache vencido para {cache_key} (hace {int(age - self.ttl_seconds)} seg), "
+                      f"se sirve y se actualiza en segundo plano")
+                self._schedule_refresh(cache_key, city, country, fetch)
+                return entry.weather_data
+            self._remove(cache_key)
+        
+        self.misses += 1
+        if self._single_flight.is_in_flight(cache_key):
+            print(f"🔗 Cache MISS para {cache_key}, esperando la consulta ya en curso")
+        else:
+            print(f"📦 Cache MISS para {cache_key}")
+        return await self._single_flight.do(cache_key, lambda: self._load(city, country, fetch))
+    
+    async def _load(
+        self,
+        city: str,
+        country: Optional[str],
+        fetch: Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+    ) -> Optional[Dict[str, Any]]:
+        """Consulta la API (una vez por clave, ver get_or_fetch) y guarda el resultado."""
+        weather_data = await fetch()
+        if weather_data:
+            self.set(city, country, weather_data)
+        return weather_data
+    
+    def _schedule_refresh(
+        self,
+        cache_key: str,
+        city: str,
+        country: Optional[str],
+        fetch: Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+    ) -> None:
+        """Lanza la actualización en segundo plano (una por clave, con espera tras un fallo)."""
+        if cache_key in self._refresh_tasks:
+            return
+        if time.time() - self.cache[cache_key].refresh_failed_at < self.retry_seconds:
+            return
+        self._refresh_tasks[cache_key] = asyncio.create_task(self._refresh(cache_key, city, country, fetch))
+    
+    async def _refresh(
+        self,
+        cache_key: str,
+        city: str,
+        country: Optional[str],
+        fetch: Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+    ) -> None:
+        """Actualización en segundo plano; si falla se sigue sirviendo el dato vencido."""
+        try:
+            weather_data = await self._single_flight.do(cache_key, lambda: self._load(city, country, fetch))
+            if weather_data:
+                self.refreshes += 1
+                print(f"🔄 Clima de {cache_key} actualizado en segundo plano")
+            else:
+                self.refresh_failures += 1
+                self._mark_refresh_failed(cache_key)
+        except Exception as e:
+            self.refresh_failures += 1
+            self._mark_refresh_failed(cache_key)
+            print(f"⚠️ Error al actualizar el clima de {cache_key} en segundo plano: {e}")
+        finally:
+            self._refresh_tasks.pop(cache_key, None)
+    
+    def _mark_refresh_failed(self, cache_key: str) -> None:
+        entry = self.cache.get(cache_key)
+        if entry is not None:
+            entry.refresh_failed_at = time.time()
+    
     def clear(self) -> None:
         """
         Limpia todo el cache.
         """
         count = len(self.cache)
         self.cache.clear()
+        self._fresh_heap.clear()
+        self._stale_heap.clear()
+        self._fresh_count = 0
         print(f"🗑️  Cache limpiado ({count} entradas eliminadas)")
     
     def clear_expired(self) -> None:
         """
-        Elimina solo las entradas expiradas del cache.
+        Elimina solo las entradas expiradas del cache (pasado el TTL máximo).
+        Cuesta O(entradas caducadas), no recorre todo el cache.
         """
-        current_time = time.time()
-        expired_keys = []
-        
-        for key, cached_data in self.cache.items():
-            cached_time = cached_data.get("cached_at", 0)
-            if current_time - cached_time > self.ttl_seconds:
-                expired_keys.append(key)
-        
-        for key in expired_keys:
-            del self.cache[key]
-        
-        if expired_keys:
-            print(f"🧹 {len(expired_keys)} entradas expiradas eliminadas del cache")
+        expired = self._expire(time.time())
+        if expired:
+            print(f"🧹 {expired} entradas expiradas eliminadas del cache")
     
     def get_stats(self) -> Dict[str, Any]:
         """
@@ -136,22 +335,27 @@ class WeatherCache:
         Returns:
             Diccionario con estadísticas del cache
         """
-        current_time = time.time()
-        valid_entries = 0
-        expired_entries = 0
-        
-        for cached_data in self.cache.values():
-            cached_time = cached_data.get("cached_at", 0)
-            if current_time - cached_time > self.ttl_seconds:
-                expired_entries += 1
-            else:
-                valid_entries += 1
-        
+        self._expire(time.time())
+        total = self.hits + self.misses + self.served_stale
+        flight_stats = self._single_flight.get_stats()
         return {
             "total_entries": len(self.cache),
-            "valid_entries": valid_entries,
-            "expired_entries": expired_entries,
+            "max_entries": self.max_entries,
+            "valid_entries": self._fresh_count,
+            "stale_entries": len(self.cache) - self._fresh_count,
+            "expired_entries": 0,  # se eliminan al calcular las estadísticas
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.served_stale) / total, 3) if total else None,
+            "served_stale": self.served_stale,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "refreshing": len(self._refresh_tasks),
+            "api_calls": flight_stats["executions"],
+            "coalesced_requests": flight_stats["coalesced"],
+            "evictions": self.evictions,
+            "expirations": self.expirations,
             "ttl_seconds": self.ttl_seconds,
-            "ttl_minutes": self.ttl_seconds // 60
+            "ttl_minutes": self.ttl_seconds // 60,
+            "hard_ttl_seconds": self.hard_ttl_seconds
         }
-